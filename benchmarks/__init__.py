@@ -0,0 +1,21 @@
+"""
+Micro-benchmarks for Mohawk.
+
+These are not part of the test suite. Run a benchmark module from the
+repository root like this::
+
+    python -m benchmarks.mac
+"""
+from __future__ import print_function
+
+import timeit
+
+
+def best_of(func, number=10000, repeat=5):
+    """Returns the best time per call of func, in microseconds."""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def report(name, usec):
+    print('{name:<56} {usec:>10.2f} usec/call'.format(name=name, usec=usec))
@@ -0,0 +1,176 @@
+"""
+Load test of the ASGI middleware with concurrent clients.
+
+Each client sends its requests one after the other through an in-process
+ASGI server loop, so this measures the middleware and not the network.
+Requests are signed before the clock starts. Large bodies arrive in
+64 KiB ``http.request`` messages like they do from a real server.
+
+Besides throughput and latency this reports the largest delay of a
+ticker task that wakes up every millisecond. If the middleware blocked
+the event loop, for example by hashing a large chunk inline, that delay
+would grow with the body size.
+
+Usage::
+
+    python -m benchmarks.asgi
+    python -m benchmarks.asgi --clients 200 --requests 50
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import logging
+import time
+
+from mohawk import Sender
+from mohawk.asgi import HawkMiddleware
+from mohawk.nonce import MemoryNonceStore
+from mohawk.util import PayloadHasher
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'some complicated SEKRET',
+               'algorithm': 'sha256'}
+CHUNK_SIZE = 64 * 1024
+PAYLOAD_SIZES = (0, 1024, 1024 * 1024)
+
+
+def lookup_credentials(id):
+    return CREDENTIALS
+
+
+async def app(scope, receive, send):
+    # Reads the body and answers with a short JSON body.
+    more_body = True
+    while more_body:
+        message = await receive()
+        more_body = message.get('more_body', False)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{"ok": true}'})
+
+
+def make_messages(size):
+    body = b'x' * size
+    return [{'type': 'http.request',
+             'body': body[i:i + CHUNK_SIZE],
+             'more_body': i + CHUNK_SIZE < size}
+            for i in range(0, max(size, 1), CHUNK_SIZE)]
+
+
+def make_scope(size, hasher):
+    # The body is the same for every request so it is only hashed once.
+    sender = Sender(CREDENTIALS, 'https://site.com/upload', 'POST',
+                    content_type='application/octet-stream',
+                    content_hash=hasher)
+    return {
+        'type': 'http',
+        'method': 'POST',
+        'scheme': 'https',
+        'path': '/upload',
+        'raw_path': b'/upload',
+        'query_string': b'',
+        'headers': [
+            (b'host', b'site.com'),
+            (b'content-type', b'application/octet-stream'),
+            (b'content-length', str(size).encode('ascii')),
+            (b'authorization', sender.request_header.encode('ascii')),
+        ],
+    }
+
+
+async def call(application, scope, messages):
+    incoming = iter(messages)
+    status = []
+
+    async def receive():
+        # Give other tasks a turn like a socket read would.
+        await asyncio.sleep(0)
+        return next(incoming, {'type': 'http.disconnect'})
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    if status != [200]:
+        raise AssertionError('unexpected response: {0}'.format(status))
+
+
+async def client(application, requests, latencies):
+    for scope, messages in requests:
+        started = time.perf_counter()
+        await call(application, scope, messages)
+        latencies.append(time.perf_counter() - started)
+
+
+async def ticker(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def load(application, size, clients, requests):
+    messages = make_messages(size)
+    hasher = PayloadHasher(CREDENTIALS['algorithm'],
+                           'application/octet-stream')
+    for message in messages:
+        hasher.update(message['body'])
+    work = [[(make_scope(size, hasher), messages) for i in range(requests)]
+            for c in range(clients)]
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[client(application, requests, latencies)
+                           for requests in work])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[int(len(latencies) * 0.99)],
+        'max_lag': max(lags) if lags else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=100,
+                        help='Number of concurrent clients.')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='Requests per client.')
+    args = parser.parse_args(argv)
+
+    cases = [
+        ('no middleware', app),
+        ('HawkMiddleware', HawkMiddleware(
+            app, lookup_credentials, seen_nonce=MemoryNonceStore())),
+        ('HawkMiddleware(verify_body_first=True)', HawkMiddleware(
+            app, lookup_credentials, seen_nonce=MemoryNonceStore(),
+            verify_body_first=True)),
+    ]
+    print('{0} clients x {1} requests'.format(args.clients, args.requests))
+    print('{0:<40} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'case', 'payload', 'req/s', 'p50 ms', 'p99 ms', 'max lag ms'))
+    loop = asyncio.new_event_loop()
+    try:
+        for size in PAYLOAD_SIZES:
+            for name, application in cases:
+                result = loop.run_until_complete(
+                    load(application, size, args.clients, args.requests))
+                print('{0:<40} {1:>8} {2:>10.0f} {3:>10.2f} {4:>10.2f} '
+                      '{5:>10.2f}'.format(
+                          name, size, result['rps'], result['p50'] * 1e3,
+                          result['p99'] * 1e3, result['max_lag'] * 1e3))
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    logging.getLogger('mohawk').setLevel(logging.ERROR)
+    main()
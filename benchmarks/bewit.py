@@ -0,0 +1,71 @@
+"""
+Verifying bewits with check_bewit() versus a reusable BewitVerifier.
+
+This is what a server that hands out signed download links does for every
+request. The requests/sec are for one thread and so for one CPU core.
+
+Usage::
+
+    python -m benchmarks.bewit
+"""
+from __future__ import print_function
+
+import itertools
+
+from mohawk.base import Resource
+from mohawk.bewit import BewitVerifier, check_bewit, get_bewit
+from mohawk.util import utc_now
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-recipient',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+URL = 'https://cdn.site.org/assets/{0}/music-album.zip'
+NUM_URLS = 1000
+
+
+def lookup_credentials(id):
+    return CREDENTIALS
+
+
+def bewit_url(url, expiration):
+    resource = Resource(url=url, method='GET', credentials=CREDENTIALS,
+                        timestamp=expiration, nonce='')
+    return url + '?bewit=' + get_bewit(resource)
+
+
+def main():
+    valid = bewit_url(URL.format(0), utc_now() + 3600)
+    expired = bewit_url(URL.format(0), utc_now() - 1)
+    many = itertools.cycle([bewit_url(URL.format(i), utc_now() + 3600)
+                            for i in range(NUM_URLS)])
+    verifier = BewitVerifier(lookup_credentials)
+
+    def rejected(func, url):
+        def call():
+            try:
+                func(url, lookup_credentials)
+            except Exception:
+                pass
+        return call
+
+    cases = [
+        ('check_bewit()', lambda: check_bewit(valid, lookup_credentials)),
+        ('BewitVerifier.verify()', lambda: verifier.verify(valid)),
+        ('check_bewit() for {0} URLs'.format(NUM_URLS),
+         lambda: check_bewit(next(many), lookup_credentials)),
+        ('BewitVerifier.verify() for {0} URLs'.format(NUM_URLS),
+         lambda: verifier.verify(next(many))),
+        ('check_bewit() when expired', rejected(check_bewit, expired)),
+        ('BewitVerifier.verify() when expired',
+         rejected(lambda url, lookup: verifier.verify(url), expired)),
+    ]
+    for name, func in cases:
+        usec = best_of(func, number=20000)
+        report(name, usec)
+        print('{0:>56} {1:>10.0f} requests/sec'.format('', 1e6 / usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Hashing file payloads with different block sizes.
+
+This writes temporary files from 1 KB up to MAX_SIZE_IN_MB (1 GB by
+default) and compares the old fixed 1 KB block size with adaptive reads
+and with the default, which hashes large files through a memory map.
+
+Usage::
+
+    python -m benchmarks.block_size [MAX_SIZE_IN_MB]
+"""
+from __future__ import print_function
+
+import sys
+import tempfile
+import time
+
+import mock
+
+from mohawk.util import calculate_payload_hash
+
+KB = 1024
+MB = 1024 * KB
+NEVER = float('inf')
+
+
+def sizes(max_size):
+    size = KB
+    while size <= max_size:
+        yield size
+        size *= 16 if size < MB else 4
+
+
+def hash_file(payload, block_size):
+    payload.seek(0)
+    start = time.time()
+    calculate_payload_hash(payload, 'sha256', 'application/octet-stream',
+                           block_size=block_size)
+    return time.time() - start
+
+
+def best_time(payload, size, block_size=None, mmap_threshold=None):
+    # Repeat small files enough to get a stable reading.
+    repeat = max(3, min(1000, 64 * MB // size))
+    if mmap_threshold is None:
+        return min(hash_file(payload, block_size) for i in range(repeat))
+    with mock.patch('mohawk.util.MMAP_THRESHOLD', mmap_threshold):
+        return min(hash_file(payload, block_size) for i in range(repeat))
+
+
+def main(max_size_in_mb=1024):
+    strategies = [
+        ('1 KB reads', dict(block_size=KB, mmap_threshold=NEVER)),
+        ('adaptive reads', dict(mmap_threshold=NEVER)),
+        ('default', {}),
+    ]
+    print('{0:>8}'.format('size') +
+          ''.join('{0:>16}'.format(name) for name, kw in strategies))
+    for size in sizes(max_size_in_mb * MB):
+        with tempfile.TemporaryFile() as payload:
+            chunk = b'x' * min(size, MB)
+            for i in range(size // len(chunk)):
+                payload.write(chunk)
+            payload.flush()
+
+            line = '{0:>5} {1}'.format(*(
+                (size // MB, 'MB') if size >= MB else (size // KB, 'KB')))
+            for name, kw in strategies:
+                elapsed = best_time(payload, size, **kw)
+                line += '{0:>11.1f} MB/s'.format(size / elapsed / 1e6)
+            print(line)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
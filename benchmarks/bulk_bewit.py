@@ -0,0 +1,69 @@
+"""
+Signing a batch of download URLs with get_bewit() versus bewit_urls().
+
+Usage::
+
+    python -m benchmarks.bulk_bewit
+    python -m benchmarks.bulk_bewit --urls 1000000 --processes 8
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from mohawk.base import Resource
+from mohawk.bewit import bewit_urls, get_bewit
+from mohawk.util import utc_now
+
+CREDENTIALS = {'id': 'some-recipient',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+URL = 'https://cdn.site.org/exports/1234/file-{0}.csv'
+
+
+def with_get_bewit(urls, expiration):
+    for url in urls:
+        resource = Resource(url=url, method='GET', credentials=CREDENTIALS,
+                            timestamp=expiration, nonce='')
+        yield url + '?bewit=' + get_bewit(resource)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--urls', type=int, default=100000,
+                        help='Number of URLs to sign.')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Size of the process pool.')
+    args = parser.parse_args(argv)
+
+    expiration = utc_now() + 3600
+    urls = [URL.format(i) for i in range(args.urls)]
+    executor = ProcessPoolExecutor(args.processes)
+    # Start the worker processes before the clock does.
+    list(bewit_urls(CREDENTIALS, expiration, urls[:1], executor=executor))
+
+    cases = [
+        ('get_bewit()', lambda: with_get_bewit(urls, expiration)),
+        ('bewit_urls()', lambda: bewit_urls(CREDENTIALS, expiration, urls)),
+        ('bewit_urls() with {0} processes'.format(args.processes),
+         lambda: bewit_urls(CREDENTIALS, expiration, urls,
+                            executor=executor)),
+    ]
+    try:
+        for name, func in cases:
+            started = time.perf_counter()
+            for signed_url in func():
+                pass
+            elapsed = time.perf_counter() - started
+            print('{0:<40} {1:>10.2f} sec {2:>10.0f} URLs/sec'.format(
+                name, elapsed, len(urls) / elapsed))
+    finally:
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
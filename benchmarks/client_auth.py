@@ -0,0 +1,55 @@
+"""
+Signing requests with the requests and HTTPX adapters versus building a
+Sender for every request by hand.
+
+This needs requests and httpx to be installed.
+
+Usage::
+
+    python -m benchmarks.client_auth
+"""
+from __future__ import print_function
+
+import httpx
+import requests
+
+from mohawk import Sender
+from mohawk.httpx_auth import HawkAuth as HTTPXHawkAuth
+from mohawk.requests_auth import HawkAuth
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'some complicated SEKRET',
+               'algorithm': 'sha256'}
+URL = 'https://site.com:8443/purchases?page=2'
+CONTENT = b'{"a": 1}'
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def main():
+    prepared = requests.Request('POST', URL, data=CONTENT,
+                                headers=HEADERS).prepare()
+    auth = HawkAuth(CREDENTIALS, verify_responses=False)
+
+    def by_hand():
+        sender = Sender(CREDENTIALS, prepared.url, prepared.method,
+                        content=prepared.body,
+                        content_type=prepared.headers['Content-Type'])
+        prepared.headers['Authorization'] = sender.request_header
+
+    httpx_request = httpx.Request('POST', URL, content=CONTENT,
+                                  headers=HEADERS)
+    httpx_auth = HTTPXHawkAuth(CREDENTIALS, verify_responses=False)
+
+    def httpx_sign():
+        next(httpx_auth.sync_auth_flow(httpx_request))
+
+    report('Sender() by hand', best_of(by_hand, number=20000))
+    report('requests_auth.HawkAuth', best_of(lambda: auth(prepared),
+                                             number=20000))
+    report('httpx_auth.HawkAuth', best_of(httpx_sign, number=20000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compares benchmark results written by :mod:`benchmarks.suite`.
+
+Cases that got slower than the baseline by more than the threshold are
+flagged and make the command exit with status 1, so it can gate CI.
+
+Usage::
+
+    python -m benchmarks.compare BASELINE.json CURRENT.json [--threshold 10]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as results:
+        return json.load(results)['results']
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns a list of (key, baseline usec, current usec, change in percent,
+    status) tuples for all cases in either result set.
+    """
+    rows = []
+    for key in sorted(set(baseline) | set(current)):
+        if key not in current:
+            rows.append((key, baseline[key]['usec'], None, None, 'missing'))
+            continue
+        if key not in baseline:
+            rows.append((key, None, current[key]['usec'], None, 'new'))
+            continue
+        before = baseline[key]['usec']
+        after = current[key]['usec']
+        change = (after - before) / before * 100 if before else 0.0
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'faster'
+        else:
+            status = ''
+        rows.append((key, before, after, change, status))
+    return rows
+
+
+def _usec(value):
+    return '-' if value is None else '{0:.2f}'.format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent slowdown to flag as a regression.')
+    args = parser.parse_args(argv)
+
+    rows = compare(load(args.baseline), load(args.current), args.threshold)
+    print('{0:<72} {1:>12} {2:>12} {3:>8}'.format(
+        'case', 'baseline', 'current', 'change'))
+    for key, before, after, change, status in rows:
+        print('{0:<72} {1:>12} {2:>12} {3:>8} {4}'.format(
+            key, _usec(before), _usec(after),
+            '' if change is None else '{0:+.1f}%'.format(change), status))
+
+    regressions = [row for row in rows if row[4] == 'REGRESSION']
+    if regressions:
+        print('{0} case(s) regressed by more than {1}%'.format(
+            len(regressions), args.threshold), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Building Hawk headers with the old incremental formatting and with the
+single join in HawkAuthority._make_header().
+
+"cold" numbers build a header for a Resource that has not built one yet,
+"warm" numbers rebuild it for the same Resource.
+
+Usage::
+
+    python -m benchmarks.header
+"""
+from __future__ import print_function
+
+from mohawk import Sender
+from mohawk.base import HawkAuthority
+from mohawk.util import prepare_header_val
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+URL = 'https://site.com/foo?bar=1'
+MAC = b'6R4rV5iE+NPoym+WwjeHzjAGXUtLNIxmo1vpMofpLAE='
+
+
+def legacy_make_header(resource, mac, additional_keys=None):
+    keys = additional_keys
+    if not keys:
+        keys = ('id', 'ts', 'nonce', 'ext', 'app', 'dlg')
+    header = u'Hawk mac="{mac}"'.format(mac=prepare_header_val(mac))
+    if resource.content_hash:
+        header = u'{header}, hash="{hash}"'.format(
+            header=header, hash=prepare_header_val(resource.content_hash))
+    if 'id' in keys:
+        header = u'{header}, id="{id}"'.format(
+            header=header, id=prepare_header_val(resource.credentials['id']))
+    if 'ts' in keys:
+        header = u'{header}, ts="{ts}"'.format(
+            header=header, ts=prepare_header_val(resource.timestamp))
+    if 'nonce' in keys:
+        header = u'{header}, nonce="{nonce}"'.format(
+            header=header, nonce=prepare_header_val(resource.nonce))
+    for key in ('ext', 'app', 'dlg'):
+        if key in keys and getattr(resource, key):
+            header = u'{header}, {key}="{val}"'.format(
+                header=header, key=key,
+                val=prepare_header_val(getattr(resource, key)))
+    return header
+
+
+def make_resources():
+    request = Sender(CREDENTIALS, URL, 'POST', content=b'{"a": 1}',
+                     content_type='application/json').req_resource
+    full = Sender(CREDENTIALS, URL, 'POST', content=b'{"a": 1}',
+                  content_type='application/json', ext='some external data',
+                  app='some-app', dlg='some-delegate').req_resource
+    response = request.for_response(content=b'{"ok": true}',
+                                    content_type='application/json',
+                                    ext='response ext')
+    response.gen_content_hash()
+    return [
+        ('request', request, None),
+        ('request with ext, app, dlg', full, None),
+        ('response', response, ['hash', 'ext']),
+    ]
+
+
+def main():
+    authority = HawkAuthority()
+    for name, resource, keys in make_resources():
+        report('legacy ({0})'.format(name),
+               best_of(lambda: legacy_make_header(resource, MAC, keys)))
+
+        def cold():
+            resource._header_vals = None
+            return authority._make_header(resource, MAC, keys)
+
+        report('single join, cold ({0})'.format(name), best_of(cold))
+        report('single join, warm ({0})'.format(name),
+               best_of(lambda: authority._make_header(resource, MAC, keys)))
+        report('single join, bytes ({0})'.format(name),
+               best_of(lambda: authority._make_header(
+                   resource, MAC, keys).encode('ascii')))
+
+
+if __name__ == '__main__':
+    main()
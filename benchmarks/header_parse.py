@@ -0,0 +1,46 @@
+"""
+Parsing Hawk headers with the single pass parser and with the regex parser.
+"""
+from __future__ import print_function
+
+from mohawk import Sender
+from mohawk.util import (parse_authorization_header,
+                         _parse_attributes,
+                         _parse_attributes_re)
+
+from . import best_of, report
+
+
+def make_headers():
+    credentials = {'id': 'some-sender',
+                   'key': 'a long, complicated secret',
+                   'algorithm': 'sha256'}
+    url = 'https://site.com/foo?bar=1'
+    return [
+        ('minimal', Sender(credentials, url, 'GET',
+                           always_hash_content=False).request_header),
+        ('with hash', Sender(credentials, url, 'GET', content='',
+                             content_type='').request_header),
+        ('with ext, app, dlg', Sender(credentials, url, 'GET', content='',
+                                      content_type='',
+                                      ext='some external data',
+                                      app='some-app',
+                                      dlg='some-delegate').request_header),
+    ]
+
+
+def main():
+    for name, header in make_headers():
+        attributes = header.split(' ', 1)[1]
+        report('regex parser ({0})'.format(name),
+               best_of(lambda: _parse_attributes_re(attributes),
+                       number=50000))
+        report('single pass parser ({0})'.format(name),
+               best_of(lambda: _parse_attributes(attributes), number=50000))
+        report('parse_authorization_header ({0})'.format(name),
+               best_of(lambda: parse_authorization_header(header),
+                       number=50000))
+
+
+if __name__ == '__main__':
+    main()
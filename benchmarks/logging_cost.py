@@ -0,0 +1,70 @@
+"""
+Logging overhead of verifying a 1 MB POST body.
+
+At INFO level no debug message should be formatted at all. This counts
+the calls to pprint.pformat and compares the time it takes to verify a
+request against the time it takes to only hash its body.
+"""
+from __future__ import print_function
+
+import hashlib
+import logging
+import pprint
+
+from mohawk import Receiver, Sender
+from mohawk import base, util
+
+from . import best_of, report
+
+credentials = {'id': 'some-sender',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+url = 'https://site.com/upload'
+content = b'x' * (1024 * 1024)
+content_type = 'application/octet-stream'
+
+
+def verify(request_header):
+    return Receiver(lambda id: credentials, request_header, url, 'POST',
+                    content=content, content_type=content_type,
+                    timestamp_skew_in_seconds=3600,
+                    seen_nonce=lambda *args: False)
+
+
+def main():
+    logger = logging.getLogger('mohawk')
+    logger.addHandler(logging.NullHandler())
+    sender = Sender(credentials, url, 'POST',
+                    content=content, content_type=content_type)
+
+    calls = []
+
+    def counting_pformat(*args, **kw):
+        calls.append(args)
+        return pprint.pformat(*args, **kw)
+
+    util.pprint = base.pprint = type('pprint', (), {
+        'pformat': staticmethod(counting_pformat)})
+    try:
+        report('sha256 of the body only',
+               best_of(lambda: hashlib.sha256(content).digest(), number=50))
+
+        logger.setLevel(logging.INFO)
+        report('Receiver at INFO',
+               best_of(lambda: verify(sender.request_header), number=50))
+        print('pformat calls at INFO: {0}'.format(len(calls)))
+
+        logger.setLevel(logging.DEBUG)
+        report('Receiver at DEBUG',
+               best_of(lambda: verify(sender.request_header), number=50))
+
+        util.redact_payloads_in_logs = True
+        report('Receiver at DEBUG with redacted payloads',
+               best_of(lambda: verify(sender.request_header), number=50))
+    finally:
+        util.pprint = base.pprint = pprint
+        util.redact_payloads_in_logs = False
+
+
+if __name__ == '__main__':
+    main()
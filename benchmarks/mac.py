@@ -0,0 +1,59 @@
+"""
+Per-request MAC latency with and without the keyed HMAC cache.
+
+The receiver sees a few thousand credential IDs over and over so each
+round cycles through ``NUM_IDS`` different credentials. The cached case
+uses a cache of the default size. A cache that is smaller than
+``NUM_IDS`` is shown too; it misses every time.
+"""
+from __future__ import print_function
+
+import itertools
+
+from mohawk import util
+from mohawk.base import Resource
+
+from . import best_of, report
+
+NUM_IDS = 2000
+
+
+def make_resources(algorithm):
+    resources = []
+    for i in range(NUM_IDS):
+        credentials = {'id': 'sender-{0}'.format(i),
+                       'key': 'a long, complicated secret {0}'.format(i),
+                       'algorithm': algorithm}
+        resources.append(Resource(url='https://site.com/foo?bar=1',
+                                  method='POST',
+                                  credentials=credentials,
+                                  content='', content_type='',
+                                  timestamp=1356420407,
+                                  nonce='abc123'))
+    return resources
+
+
+def bench(algorithm, cache):
+    resources = itertools.cycle(make_resources(algorithm))
+    orig_cache = util.hmac_key_cache
+    util.hmac_key_cache = cache
+    try:
+        return best_of(
+            lambda: util.calculate_mac('header', next(resources), 'hash'),
+            number=NUM_IDS * 10)
+    finally:
+        util.hmac_key_cache = orig_cache
+
+
+def main():
+    for algorithm in ('sha1', 'sha256', 'sha512'):
+        report('calculate_mac {0} (uncached)'.format(algorithm),
+               bench(algorithm, util.HmacKeyCache(max_size=0)))
+        report('calculate_mac {0} (cached)'.format(algorithm),
+               bench(algorithm, util.HmacKeyCache()))
+        report('calculate_mac {0} (cache too small)'.format(algorithm),
+               bench(algorithm, util.HmacKeyCache(max_size=NUM_IDS // 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Cost of recording verifications in a MetricsRegistry.
+
+Usage::
+
+    python -m benchmarks.metrics
+"""
+from __future__ import print_function
+
+import logging
+
+from mohawk import Receiver, Sender
+from mohawk.metrics import MetricsRegistry
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+URL = 'https://site.com/foo?bar=1'
+
+
+def main():
+    # Nonces are not checked here so don't warn about it on every call.
+    logging.getLogger('mohawk').setLevel(logging.ERROR)
+    header = Sender(CREDENTIALS, URL, 'POST', content=b'{"a": 1}',
+                    content_type='application/json').request_header
+    registry = MetricsRegistry()
+
+    def verify(sink=None):
+        Receiver(lambda id: CREDENTIALS, header, URL, 'POST',
+                 content=b'{"a": 1}', content_type='application/json',
+                 sink=sink)
+
+    report('MetricsRegistry.record()',
+           best_of(lambda: registry.record('receiver', 'mac', 0.00002),
+                   number=100000))
+    report('Receiver without a sink', best_of(verify))
+    report('Receiver with a MetricsRegistry',
+           best_of(lambda: verify(registry)))
+    for i in range(1000):
+        verify(registry)
+    report('MetricsRegistry.render()', best_of(registry.render, number=1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+MmapNonceStore throughput with several worker processes sharing a table.
+
+Usage::
+
+    python -m benchmarks.mmap_nonce_store [WORKERS] [CALLS_PER_WORKER]
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from mohawk.nonce import MemoryNonceStore, MmapNonceStore
+from mohawk.util import random_string, utc_now
+
+from . import best_of, report
+
+
+def worker(path, calls, results):
+    store = MmapNonceStore(path)
+    ts = utc_now()
+    nonces = [random_string(6) for i in range(calls)]
+    start = time.time()
+    for nonce in nonces:
+        store('some-sender', nonce, ts)
+    results.put(time.time() - start)
+    store.close()
+
+
+def main(workers=4, calls=100000):
+    tmp_dir = tempfile.mkdtemp(dir='/dev/shm' if os.path.isdir('/dev/shm')
+                               else None)
+    path = os.path.join(tmp_dir, 'nonces')
+    try:
+        ts = utc_now()
+        for store in (MemoryNonceStore(), MmapNonceStore(path)):
+            nonces = iter([random_string(6) for i in range(50000)])
+            report('{0} single process'.format(store.__class__.__name__),
+                   best_of(lambda: store('some-sender', next(nonces), ts),
+                           number=10000, repeat=5))
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker,
+                                         args=(path, calls, results))
+                 for i in range(workers)]
+        start = time.time()
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        elapsed = time.time() - start
+        per_call = max(results.get() for proc in procs) / calls * 1e6
+        report('MmapNonceStore with {0} processes'.format(workers), per_call)
+        print('aggregate: {0:.0f} calls/sec'
+              .format(workers * calls / elapsed))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
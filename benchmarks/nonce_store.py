@@ -0,0 +1,58 @@
+"""
+Sustained load on MemoryNonceStore.
+
+This simulates RATE requests per second for DURATION seconds of
+(simulated) time and reports the time per call and the memory held by the
+store at each simulated second. Memory should level off once the
+timestamp skew window has passed.
+
+Usage::
+
+    python -m benchmarks.nonce_store [RATE] [DURATION]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+
+import mock
+
+from mohawk.nonce import MemoryNonceStore
+from mohawk.util import random_string
+
+from . import report
+
+NUM_SENDERS = 1000
+SKEW = 60
+
+
+def main(rate=50000, duration=3 * SKEW):
+    clock = [1356420407]
+    store = MemoryNonceStore(timestamp_skew_in_seconds=SKEW)
+    senders = ['sender-{0}'.format(i) for i in range(NUM_SENDERS)]
+    # Generating nonces is not what we are measuring.
+    nonces = [random_string(6) for i in range(rate)]
+
+    tracemalloc.start()
+    elapsed = 0.0
+    with mock.patch('mohawk.nonce.utc_now', lambda: clock[0]):
+        for second in range(duration):
+            ts = str(clock[0])
+            start = time.time()
+            for i in range(rate):
+                store(senders[i % NUM_SENDERS], nonces[i], ts)
+            elapsed += time.time() - start
+            clock[0] += 1
+            if second % 10 == 0 or second == duration - 1:
+                current, peak = tracemalloc.get_traced_memory()
+                print('t={0:>4}s live nonces={1:>9} memory={2:>8.1f} MB'
+                      .format(second, store.count(), current / 1e6))
+    tracemalloc.stop()
+
+    report('MemoryNonceStore.seen_nonce (under tracemalloc)',
+           elapsed / (rate * duration) * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
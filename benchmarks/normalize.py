@@ -0,0 +1,72 @@
+"""
+Building the normalized string that a MAC is calculated over.
+
+This compares normalize_string() followed by a UTF-8 encode (the old
+path) with the template of constant parts used by calculate_mac(), on
+its own and as part of a whole MAC calculation. The content hash is
+given both as str and as the bytes that calculate_payload_hash()
+returns.
+
+Usage::
+
+    python -m benchmarks.normalize
+"""
+from __future__ import print_function
+
+from base64 import b64encode
+
+from mohawk.base import Resource
+from mohawk.util import (calculate_mac,
+                         hmac_key_cache,
+                         normalize_string,
+                         _normalize_bytes)
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'a long, complicated secret',
+               'algorithm': 'sha256'}
+HASHES = [('str hash', 'Yi9LfIIFRtBEPt74PVmbTF/xVAwPn7ub15ePICfgnuY='),
+          ('bytes hash', b'Yi9LfIIFRtBEPt74PVmbTF/xVAwPn7ub15ePICfgnuY=')]
+
+
+def make_resources():
+    kw = dict(url='https://site.com/foo?bar=1', method='POST',
+              credentials=CREDENTIALS, timestamp=1356420407, nonce='abc123')
+    return [
+        ('minimal', Resource(**kw)),
+        # Like Sender, this gets a random nonce which is bytes.
+        ('random nonce', Resource(**dict(kw, nonce=None))),
+        ('with ext, app, dlg', Resource(ext='some external data',
+                                        app='some-app', dlg='some-delegate',
+                                        **kw)),
+    ]
+
+
+def legacy_calculate_mac(mac_type, resource, content_hash):
+    normalized = normalize_string(mac_type, resource, content_hash)
+    mac = hmac_key_cache.hmac_for(resource.credentials)
+    mac.update(normalized.encode('utf8'))
+    return b64encode(mac.digest())
+
+
+def main():
+    for name, resource in make_resources():
+        for hash_name, content_hash in HASHES:
+            case = '{0}, {1}'.format(name, hash_name)
+            report('normalize_string + encode ({0})'.format(case),
+                   best_of(lambda: normalize_string(
+                       'header', resource, content_hash).encode('utf8'),
+                       number=50000))
+            report('template ({0})'.format(case),
+                   best_of(lambda: _normalize_bytes(
+                       'header', resource, content_hash), number=50000))
+            report('MAC with normalize_string ({0})'.format(case),
+                   best_of(lambda: legacy_calculate_mac(
+                       'header', resource, content_hash), number=50000))
+            report('MAC with template ({0})'.format(case),
+                   best_of(lambda: calculate_mac(
+                       'header', resource, content_hash), number=50000))
+
+if __name__ == '__main__':
+    main()
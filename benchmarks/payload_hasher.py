@@ -0,0 +1,61 @@
+"""
+Hashing a streamed body with PayloadHasher versus buffering it first.
+
+Usage::
+
+    python -m benchmarks.payload_hasher [SIZE_IN_MB]
+"""
+from __future__ import print_function
+
+import sys
+import time
+import tracemalloc
+
+from mohawk.util import PayloadHasher, calculate_payload_hash
+
+CHUNK_SIZE = 64 * 1024
+
+
+def stream(size):
+    # Like a socket reading into a reusable buffer.
+    buf = bytearray(b'x' * CHUNK_SIZE)
+    view = memoryview(buf)
+    remaining = size
+    while remaining > 0:
+        n = min(remaining, CHUNK_SIZE)
+        yield view[:n]
+        remaining -= n
+
+
+def streaming(size):
+    hasher = PayloadHasher('sha256', 'application/octet-stream')
+    for chunk in stream(size):
+        hasher.update(chunk)
+    return hasher.digest()
+
+
+def buffering(size):
+    body = b''.join(bytes(chunk) for chunk in stream(size))
+    return calculate_payload_hash(body, 'sha256', 'application/octet-stream')
+
+
+def measure(name, func, size):
+    tracemalloc.start()
+    start = time.time()
+    func(size)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{name:<12} {mb_s:>8.1f} MB/s  peak memory {peak:>8.1f} MB'
+          .format(name=name, mb_s=size / elapsed / 1e6, peak=peak / 1e6))
+
+
+def main(size_in_mb=256):
+    size = size_in_mb * 1024 * 1024
+    assert streaming(size) == buffering(size)
+    measure('streaming', streaming, size)
+    measure('buffering', buffering, size)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
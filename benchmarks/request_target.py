@@ -0,0 +1,53 @@
+"""
+Receiving a request with a URL versus a pre-split RequestTarget.
+
+Usage::
+
+    python -m benchmarks.request_target
+"""
+from __future__ import print_function
+
+from mohawk import Receiver, Sender
+from mohawk.base import RequestTarget, Resource
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'some complicated SEKRET',
+               'algorithm': 'sha256'}
+
+# What a web framework hands us.
+SCHEME, HOST, PORT, PATH, QUERY = ('https', 'site.com', 8443,
+                                   '/purchases/items', 'page=2&sort=date')
+
+
+def lookup_credentials(id):
+    return CREDENTIALS
+
+
+def url():
+    return '{0}://{1}:{2}{3}?{4}'.format(SCHEME, HOST, PORT, PATH, QUERY)
+
+
+def target():
+    return RequestTarget(SCHEME, HOST, PORT, PATH, QUERY)
+
+
+def main():
+    for name, make_url in (('URL', url), ('RequestTarget', target)):
+        report('Resource() with a {0}'.format(name), best_of(
+            lambda: Resource(url=make_url(), method='GET',
+                             credentials=CREDENTIALS)))
+
+    header = Sender(CREDENTIALS, url(), 'GET',
+                    content='', content_type='').request_header
+    for name, make_url in (('URL', url), ('RequestTarget', target)):
+        report('Receiver() with a {0}'.format(name), best_of(
+            lambda: Receiver(lookup_credentials, header, make_url(), 'GET',
+                             content='', content_type='',
+                             seen_nonce=lambda *args: False),
+            number=2000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Allocations and time per Resource and per request / response cycle.
+
+Allocations are measured with tracemalloc by keeping the objects created
+by many calls alive and comparing snapshots.
+
+Usage::
+
+    python -m benchmarks.resource
+"""
+from __future__ import print_function
+
+import logging
+import tracemalloc
+
+from mohawk import Receiver, Sender
+from mohawk.base import Resource
+
+from . import best_of, report
+
+URL = 'https://site.com/foo?bar=1'
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'some complicated SEKRET',
+               'algorithm': 'sha256'}
+
+
+def lookup_credentials(id):
+    return CREDENTIALS
+
+
+def make_resource():
+    return Resource(url=URL, method='POST', credentials=CREDENTIALS,
+                    content=b'{"a": 1}', content_type='application/json',
+                    timestamp=1356420407, nonce='abc123')
+
+
+REQUEST = make_resource()
+
+
+def parse_response_resource():
+    return Resource(url=REQUEST.url, method=REQUEST.method,
+                    credentials=REQUEST.credentials,
+                    content=b'{"ok": true}', content_type='application/json',
+                    timestamp=REQUEST.timestamp, nonce=REQUEST.nonce)
+
+
+def derive_response_resource():
+    return REQUEST.for_response(content=b'{"ok": true}',
+                                content_type='application/json')
+
+
+def cycle():
+    sender = Sender(CREDENTIALS, URL, 'POST',
+                    content=b'{"a": 1}', content_type='application/json')
+    receiver = Receiver(lookup_credentials, sender.request_header,
+                        URL, 'POST',
+                        content=b'{"a": 1}', content_type='application/json')
+    receiver.respond(content=b'{"ok": true}',
+                     content_type='application/json')
+    sender.accept_response(receiver.response_header,
+                           content=b'{"ok": true}',
+                           content_type='application/json')
+    return sender, receiver
+
+
+def allocations(func, number=1000):
+    """Returns the (count, bytes) of memory blocks that func keeps alive."""
+    func()
+    this_file = tracemalloc.Filter(False, __file__)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces([this_file])
+        kept = [func() for i in range(number)]
+        after = tracemalloc.take_snapshot().filter_traces([this_file])
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    count = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del kept
+    return count / float(number), size / float(number)
+
+
+def main():
+    # Don't warn about the missing seen_nonce on every cycle.
+    logging.getLogger('mohawk').setLevel(logging.ERROR)
+    for name, func in [
+            ('Resource()', make_resource),
+            ('response Resource()', parse_response_resource),
+            ('Resource.for_response()', derive_response_resource),
+            ('request / response cycle', cycle)]:
+        count, size = allocations(func)
+        print('{name:<40} {count:>6.1f} blocks {size:>8.1f} bytes kept'
+              .format(name=name, count=count, size=size))
+        report(name, best_of(func, number=2000))
+
+
+if __name__ == '__main__':
+    main()
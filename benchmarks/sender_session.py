@@ -0,0 +1,45 @@
+"""
+Signing requests with Sender versus a reusable SenderSession.
+
+Usage::
+
+    python -m benchmarks.sender_session
+"""
+from __future__ import print_function
+
+from mohawk import Sender, SenderSession
+
+from . import best_of, report
+
+CREDENTIALS = {'id': 'some-sender',
+               'key': 'some complicated SEKRET',
+               'algorithm': 'sha256'}
+URL = 'https://site.com:8443/purchases?page=2'
+CONTENT = b'{"a": 1}'
+CONTENT_TYPE = 'application/json'
+
+
+def main():
+    session = SenderSession(CREDENTIALS)
+    bound_session = SenderSession(CREDENTIALS,
+                                  base_url='https://site.com:8443')
+
+    cases = [
+        ('Sender()', lambda: Sender(CREDENTIALS, URL, 'POST',
+                                    content=CONTENT,
+                                    content_type=CONTENT_TYPE)),
+        ('SenderSession.request()', lambda: session.request(
+            URL, 'POST', content=CONTENT, content_type=CONTENT_TYPE)),
+        ('SenderSession.request() with base_url',
+         lambda: bound_session.request(
+             '/purchases?page=2', 'POST',
+             content=CONTENT, content_type=CONTENT_TYPE)),
+    ]
+    for name, func in cases:
+        usec = best_of(func, number=20000)
+        report(name, usec)
+        print('{0:>56} {1:>10.0f} requests/sec'.format('', 1e6 / usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Constant time comparison of MACs with the old per-character loop and
+with hmac.compare_digest().
+
+Usage::
+
+    python -m benchmarks.strings_match
+"""
+from __future__ import print_function
+
+from base64 import b64encode
+import hashlib
+import hmac
+
+from mohawk.util import strings_match, _strings_match_loop
+
+from . import best_of, report
+
+
+def main():
+    for algorithm in ('sha1', 'sha256', 'sha512'):
+        mac = b64encode(hmac.new(b'key', b'message',
+                                 getattr(hashlib, algorithm)).digest())
+        # A computed MAC is bytes and a parsed header value is text.
+        their_mac = mac.decode('ascii')
+        report('loop ({0})'.format(algorithm),
+               best_of(lambda: _strings_match_loop(mac, their_mac),
+                       number=50000))
+        report('compare_digest ({0})'.format(algorithm),
+               best_of(lambda: strings_match(mac, their_mac),
+                       number=50000))
+
+
+if __name__ == '__main__':
+    main()
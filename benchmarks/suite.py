@@ -0,0 +1,219 @@
+"""
+Benchmarks every public entry point and writes the results as JSON.
+
+Each case is run across algorithms, payload sizes and header shapes.
+Store the output of a release as a baseline and compare a later run
+against it with :mod:`benchmarks.compare`.
+
+Usage::
+
+    python -m benchmarks.suite [--output results.json] [--quick]
+                               [--filter SUBSTRING]
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import logging
+import platform
+import sys
+import time
+import timeit
+
+import mohawk
+from mohawk import Receiver, Sender
+from mohawk.base import Resource
+from mohawk.bewit import BewitVerifier, check_bewit, get_bewit
+from mohawk.util import calculate_payload_hash, parse_authorization_header
+
+from . import report
+
+ALGORITHMS = ('sha1', 'sha256', 'sha512')
+PAYLOAD_SIZES = (0, 1024, 64 * 1024, 1024 * 1024)
+SHAPES = {
+    'minimal': {},
+    'ext-app-dlg': {'ext': 'some external data',
+                    'app': 'some-app',
+                    'dlg': 'some-delegate'},
+}
+URL = 'https://site.com/foo?bar=1'
+CONTENT_TYPE = 'application/octet-stream'
+SCHEMA_VERSION = 1
+
+
+def credentials_for(algorithm):
+    return {'id': 'some-sender',
+            'key': 'a long, complicated secret',
+            'algorithm': algorithm}
+
+
+def header_cases(algorithm, size, shape):
+    credentials = credentials_for(algorithm)
+    content = b'x' * size
+    shape_kw = SHAPES[shape]
+
+    def lookup(id):
+        return credentials
+
+    def sign():
+        return Sender(credentials, URL, 'POST', content=content,
+                      content_type=CONTENT_TYPE, **shape_kw)
+
+    sender = sign()
+    request_header = sender.request_header
+
+    def verify():
+        return Receiver(lookup, request_header, URL, 'POST',
+                        content=content, content_type=CONTENT_TYPE)
+
+    receiver = verify()
+
+    def respond():
+        return receiver.respond(content=content, content_type=CONTENT_TYPE,
+                                ext=shape_kw.get('ext'))
+
+    response_header = respond()
+
+    def accept_response():
+        sender.accept_response(response_header, content=content,
+                               content_type=CONTENT_TYPE)
+
+    return [('sender.request_header', sign),
+            ('receiver.verify', verify),
+            ('receiver.respond', respond),
+            ('sender.accept_response', accept_response)]
+
+
+def bewit_cases(algorithm, shape):
+    credentials = credentials_for(algorithm)
+    ext = SHAPES[shape].get('ext')
+
+    def lookup(id):
+        return credentials
+
+    def make_bewit():
+        return get_bewit(Resource(url=URL, method='GET',
+                                  credentials=credentials,
+                                  timestamp=int(time.time()) + 3600,
+                                  nonce='', ext=ext))
+
+    url = URL + '&bewit=' + make_bewit()
+    verifier = BewitVerifier(lookup)
+    return [('get_bewit', make_bewit),
+            ('check_bewit', lambda: check_bewit(url, lookup)),
+            ('BewitVerifier.verify', lambda: verifier.verify(url))]
+
+
+def parse_cases(shape):
+    header = Sender(credentials_for('sha256'), URL, 'GET', content='',
+                    content_type='', **SHAPES[shape]).request_header
+    return [('parse_authorization_header',
+             lambda: parse_authorization_header(header))]
+
+
+def payload_cases(algorithm, size):
+    content = b'x' * size
+    payload = io.BytesIO(content)
+
+    def hash_file():
+        payload.seek(0)
+        return calculate_payload_hash(payload, algorithm, CONTENT_TYPE)
+
+    return [('calculate_payload_hash.bytes',
+             lambda: calculate_payload_hash(content, algorithm,
+                                            CONTENT_TYPE)),
+            ('calculate_payload_hash.file', hash_file)]
+
+
+def cases():
+    """Yields (name, params, func) for every benchmark case."""
+    for algorithm in ALGORITHMS:
+        for size in PAYLOAD_SIZES:
+            for shape in SHAPES:
+                params = dict(algorithm=algorithm, size=size, shape=shape)
+                for name, func in header_cases(algorithm, size, shape):
+                    yield name, params, func
+            params = dict(algorithm=algorithm, size=size)
+            for name, func in payload_cases(algorithm, size):
+                yield name, params, func
+        for shape in SHAPES:
+            params = dict(algorithm=algorithm, shape=shape)
+            for name, func in bewit_cases(algorithm, shape):
+                yield name, params, func
+    for shape in SHAPES:
+        for name, func in parse_cases(shape):
+            yield name, dict(shape=shape), func
+
+
+def case_key(name, params):
+    return name + ''.join('[{0}={1}]'.format(key, params[key])
+                          for key in sorted(params))
+
+
+def measure(func, min_time=0.1, repeat=5):
+    """
+    Returns the best time per call of func, in microseconds.
+
+    The number of calls per repeat is chosen so that each repeat takes
+    about min_time seconds.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number=number)
+        if elapsed >= min_time / 10 or number >= 10 ** 7:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def run(min_time=0.1, repeat=5, filter=None):
+    results = {}
+    for name, params, func in cases():
+        key = case_key(name, params)
+        if filter and filter not in key:
+            continue
+        usec = measure(func, min_time=min_time, repeat=repeat)
+        report(key, usec)
+        results[key] = {'name': name, 'params': params, 'usec': usec}
+    return {
+        'schema': SCHEMA_VERSION,
+        'meta': {'mohawk': getattr(mohawk, '__version__', None),
+                 'python': platform.python_version(),
+                 'implementation': platform.python_implementation(),
+                 'platform': platform.platform(),
+                 'time': int(time.time())},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', '-o',
+                        help='Write JSON results to this file.')
+    parser.add_argument('--quick', action='store_true',
+                        help='Run shorter, noisier measurements.')
+    parser.add_argument('--filter',
+                        help='Only run cases whose key contains this.')
+    args = parser.parse_args(argv)
+
+    # Nonces are not checked here so don't warn about it on every call.
+    logging.getLogger('mohawk').setLevel(logging.ERROR)
+    if args.quick:
+        data = run(min_time=0.02, repeat=3, filter=args.filter)
+    else:
+        data = run(filter=args.filter)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(data, output, indent=2, sort_keys=True)
+            output.write('\n')
+        print('wrote {0} results to {1}'.format(len(data['results']),
+                                                args.output),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
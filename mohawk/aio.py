@@ -0,0 +1,283 @@
+"""
+Hawk authorization for :mod:`asyncio` applications.
+
+This module requires Python 3.5 or later.
+See :ref:`asyncio` for details.
+"""
+import asyncio
+import inspect
+import logging
+import sys
+
+from .base import default_ts_skew_in_seconds, EmptyValue
+from .exc import CredentialsLookupError, MissingAuthorization
+from .instrument import start_timer
+from .receiver import Receiver
+from .sender import Sender
+from .util import parse_authorization_header, validate_credentials
+
+__all__ = ['AsyncReceiver', 'AsyncSender']
+log = logging.getLogger(__name__)
+
+#: Content of at least this many bytes (and any file-like content)
+#: is hashed in an executor so that it does not block the event loop.
+EXECUTOR_THRESHOLD = 64 * 1024
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _gen_content_hash(resource, executor):
+    content = resource.content
+    if resource.precomputed_content_hash is None and (
+            hasattr(content, 'read') or
+            (content and len(content) >= EXECUTOR_THRESHOLD)):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(executor,
+                                          resource.gen_content_hash)
+    return resource.gen_content_hash()
+
+
+class AsyncAuthority(object):
+
+    async def _authorize_async(self, mac_type, parsed_header, resource,
+                               **auth_kw):
+        # This runs the steps of HawkAuthority._authorize() but hashes
+        # large content in an executor and awaits seen_nonce.
+        steps = self._authorize_steps(mac_type, parsed_header, resource,
+                                      **auth_kw)
+        result = None
+        while True:
+            try:
+                name, work = steps.send(result)
+            except StopIteration:
+                break
+            if name == 'hash':
+                result = await _gen_content_hash(resource, self.executor)
+            else:
+                result = await _resolve(work())
+
+
+class AsyncReceiver(AsyncAuthority, Receiver):
+    """
+    A :class:`mohawk.Receiver` for :mod:`asyncio` applications.
+
+    Create one with :meth:`accept`, which takes the same arguments as
+    :class:`mohawk.Receiver` and raises the same exceptions::
+
+        receiver = await AsyncReceiver.accept(credentials_map,
+                                              request_header,
+                                              url, method, ...)
+
+    Calling ``AsyncReceiver(...)`` directly raises a TypeError so that a
+    request cannot be left unverified by a missing ``await``.
+    So does :meth:`mohawk.Receiver.verify_many`, which would call the
+    lookups without awaiting them. Gather :meth:`accept` calls instead.
+
+    ``credentials_map`` and ``seen_nonce`` can be coroutine functions
+    (or any callables that return awaitables) as well as plain callables.
+    """
+
+    def __init__(self, *args, **kw):
+        raise TypeError('{0} verifies a request asynchronously; use '
+                        '"await {0}.accept(...)"'
+                        .format(self.__class__.__name__))
+
+    @classmethod
+    def verify_many(cls, *args, **kw):
+        raise TypeError('{0} cannot verify a batch synchronously; use '
+                        '"await asyncio.gather({0}.accept(...), ...)"'
+                        .format(cls.__name__))
+
+    @classmethod
+    async def accept(cls,
+                     credentials_map,
+                     request_header,
+                     url,
+                     method,
+                     content=EmptyValue,
+                     content_type=EmptyValue,
+                     seen_nonce=None,
+                     localtime_offset_in_seconds=0,
+                     accept_untrusted_content=False,
+                     timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                     content_hash=None,
+                     block_size=None,
+                     executor=None,
+                     sink=None,
+                     **auth_kw):
+        """
+        Verifies a request and returns its receiver.
+
+        The arguments are the same as for :class:`mohawk.Receiver`, plus:
+
+        :param executor=None:
+            A :class:`concurrent.futures.Executor` for hashing large or
+            file-like content. If None, the event loop's default executor
+            is used.
+        :type executor=None: :class:`concurrent.futures.Executor`
+
+        :param sink=None:
+            A :class:`mohawk.instrument.Sink` to report how long each
+            stage of the verification takes. See :ref:`instrumentation`.
+        :type sink=None: :class:`mohawk.instrument.Sink`
+        """
+        # __init__() refuses to make an unverified receiver.
+        self = cls.__new__(cls)
+        self._setup(credentials_map, seen_nonce, block_size=block_size)
+        self.executor = executor
+        self.sink = sink
+        auth_kw.update(
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            accept_untrusted_content=accept_untrusted_content)
+        await self._accept(request_header, url, method, content,
+                           content_type, content_hash, auth_kw)
+        return self
+
+    async def _accept(self, request_header, url, method, content,
+                      content_type, content_hash, auth_kw):
+        log.debug('accepting request %s', request_header)
+
+        timer = start_timer(self.sink, 'receiver')
+        try:
+            if timer is not None:
+                timer.begin('parse')
+
+            if not request_header:
+                raise MissingAuthorization()
+
+            parsed_header = parse_authorization_header(request_header)
+
+            if timer is not None:
+                timer.begin('lookup')
+            credentials = await self._lookup_credentials_async(
+                self.credentials_map, parsed_header['id'])
+
+            if timer is not None:
+                timer.begin('resource')
+            resource = self._request_resource(parsed_header, credentials,
+                                              url, method,
+                                              content=content,
+                                              content_type=content_type,
+                                              content_hash=content_hash)
+
+            await self._authorize_async('header', parsed_header, resource,
+                                        timer=timer, **auth_kw)
+        except Exception as exc:
+            if timer is not None:
+                timer.done(exc)
+            raise
+
+        if timer is not None:
+            timer.done()
+
+        self.parsed_header = parsed_header
+        self.resource = resource
+
+    @staticmethod
+    async def _lookup_credentials_async(credentials_map, id):
+        try:
+            credentials = await _resolve(credentials_map(id))
+        except LookupError:
+            etype, val, tb = sys.exc_info()
+            log.debug('Catching %s: %s', etype, val)
+            raise CredentialsLookupError(
+                'Could not find credentials for ID {0}'
+                .format(id))
+        validate_credentials(credentials)
+        return credentials
+
+    async def respond(self,
+                      content=EmptyValue,
+                      content_type=EmptyValue,
+                      always_hash_content=True,
+                      ext=None,
+                      content_hash=None):
+        """
+        Respond to the request.
+
+        This is a coroutine version of :meth:`mohawk.Receiver.respond`.
+        """
+        log.debug('generating response header')
+
+        resource = self._response_resource(
+            content=content,
+            content_type=content_type,
+            always_hash_content=always_hash_content,
+            ext=ext,
+            content_hash=content_hash)
+        return self._make_response_header(
+            resource, await _gen_content_hash(resource, self.executor))
+
+
+class AsyncSender(AsyncAuthority, Sender):
+    """
+    A :class:`mohawk.Sender` for :mod:`asyncio` applications.
+
+    It takes the same arguments as :class:`mohawk.Sender` and signs the
+    request right away, like :class:`mohawk.Sender` does.
+    Only :meth:`accept_response` is a coroutine.
+
+    ``seen_nonce`` can be a coroutine function (or any callable that
+    returns an awaitable) as well as a plain callable.
+
+    :param executor=None:
+        A :class:`concurrent.futures.Executor` for hashing large or
+        file-like response content. If None, the event loop's default
+        executor is used.
+    :type executor=None: :class:`concurrent.futures.Executor`
+    """
+
+    def __init__(self, *args, executor=None, **kw):
+        self.executor = executor
+        super(AsyncSender, self).__init__(*args, **kw)
+
+    async def accept_response(self,
+                              response_header,
+                              content=EmptyValue,
+                              content_type=EmptyValue,
+                              accept_untrusted_content=False,
+                              localtime_offset_in_seconds=0,
+                              timestamp_skew_in_seconds=(
+                                  default_ts_skew_in_seconds),
+                              content_hash=None,
+                              sink=None,
+                              **auth_kw):
+        """
+        Accept a response to this request.
+
+        This is a coroutine version of :meth:`mohawk.Sender.accept_response`.
+        """
+        log.debug('accepting response %s', response_header)
+
+        timer = start_timer(sink, 'accept_response')
+        try:
+            if timer is not None:
+                timer.begin('parse')
+            parsed_header = parse_authorization_header(response_header)
+
+            if timer is not None:
+                timer.begin('resource')
+            resource = self._response_resource(parsed_header, content,
+                                               content_type, content_hash)
+
+            await self._authorize_async(
+                'response', parsed_header, resource,
+                # Per Node lib, a responder macs the *sender's* timestamp.
+                their_timestamp=resource.timestamp,
+                timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                localtime_offset_in_seconds=localtime_offset_in_seconds,
+                accept_untrusted_content=accept_untrusted_content,
+                timer=timer,
+                **auth_kw)
+        except Exception as exc:
+            if timer is not None:
+                timer.done(exc)
+            raise
+
+        if timer is not None:
+            timer.done()
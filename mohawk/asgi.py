@@ -0,0 +1,416 @@
+"""
+ASGI middleware for Hawk authentication.
+
+This module requires Python 3.5 or later.
+See :ref:`asgi` for details.
+"""
+import asyncio
+import collections
+import logging
+from urllib.parse import quote
+
+from .aio import AsyncReceiver, EXECUTOR_THRESHOLD
+from .base import default_ts_skew_in_seconds, EmptyValue, RequestTarget
+from .exc import HawkFail, MisComputedContentHash
+from .util import PayloadHasher, strings_match
+from .wsgi import _PATH_SAFE, _split_host
+
+__all__ = ['HawkMiddleware', 'request_target']
+log = logging.getLogger(__name__)
+
+
+class HawkMiddleware(object):
+    """
+    ASGI middleware that only lets Hawk authenticated requests through.
+
+    The request header is verified before the application is called.
+    Credentials and nonces are looked up as in
+    :class:`mohawk.aio.AsyncReceiver` so ``credentials_map`` and
+    ``seen_nonce`` can be coroutine functions.
+
+    The request body is hashed as the application receives it.
+    The ``http.request`` message with the last chunk of the body is only
+    passed to the application once the body has matched the hash in the
+    header. If it does not match, receiving that message raises
+    :class:`mohawk.exc.MisComputedContentHash` instead and, whatever the
+    application does, the client gets a ``401 Unauthorized`` response.
+    Whatever the application has not received by the time it starts its
+    response is hashed and discarded.
+
+    .. important::
+
+        The application sees all but the last chunk of the body before
+        it has been verified. Don't act on them until you have received
+        the last one, or pass ``verify_body_first=True``.
+
+    The :class:`mohawk.aio.AsyncReceiver` for the request is available to
+    the application as ``scope['mohawk.receiver']``.
+    Responses are signed with a ``Server-Authorization`` header unless
+    the application sets one itself.
+
+    Other scope types, such as ``websocket`` and ``lifespan``, are passed
+    through to the application.
+
+    :param app: The ASGI application to protect.
+    :type app: callable
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID.
+        See :class:`mohawk.aio.AsyncReceiver`.
+    :type credentials_map: callable
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :class:`mohawk.aio.AsyncReceiver`.
+    :type seen_nonce=None: callable
+
+    :param bypass=():
+        Requests to skip authentication for. Each item is either a path
+        prefix, such as ``'/health'``, or a callable that takes the ASGI
+        scope and returns True to skip it.
+    :type bypass=(): sequence
+
+    :param sign_responses=True:
+        When True, sign responses. The response body is held back until
+        the application has sent all of it so that it can be hashed.
+        When False, responses are streamed through.
+    :type sign_responses=True: bool
+
+    :param verify_body_first=False:
+        When True, receive and verify the whole request body before the
+        application is called. The application then receives it from
+        memory.
+    :type verify_body_first=False: bool
+
+    :param accept_untrusted_content=False:
+        When True, allow requests that do not hash their body.
+        See :class:`mohawk.Receiver`.
+    :type accept_untrusted_content=False: bool
+
+    :param localtime_offset_in_seconds=0:
+        See :class:`mohawk.Receiver`.
+    :type localtime_offset_in_seconds=0: float
+
+    :param timestamp_skew_in_seconds=60:
+        See :class:`mohawk.Receiver`.
+    :type timestamp_skew_in_seconds=60: float
+
+    :param executor=None:
+        A :class:`concurrent.futures.Executor` for hashing chunks of
+        :data:`mohawk.aio.EXECUTOR_THRESHOLD` bytes or more.
+        If None, the event loop's default executor is used.
+    :type executor=None: :class:`concurrent.futures.Executor`
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink`. See :class:`mohawk.Receiver`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
+    """
+
+    def __init__(self, app, credentials_map, seen_nonce=None, bypass=(),
+                 sign_responses=True, verify_body_first=False,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 executor=None, sink=None):
+        self.app = app
+        self.credentials_map = credentials_map
+        self.seen_nonce = seen_nonce
+        self.bypass_prefixes = tuple(b for b in bypass if isinstance(b, str))
+        self.bypass_checks = [b for b in bypass if not isinstance(b, str)]
+        self.sign_responses = sign_responses
+        self.verify_body_first = verify_body_first
+        self.accept_untrusted_content = accept_untrusted_content
+        self.localtime_offset_in_seconds = localtime_offset_in_seconds
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.executor = executor
+        self.sink = sink
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self._bypass(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = _headers(scope)
+        content_type = headers.get('content-type', '')
+        try:
+            receiver = await _StreamingReceiver.accept(
+                self.credentials_map,
+                headers.get('authorization'),
+                _request_target(scope, headers),
+                scope['method'],
+                content=b'',
+                content_type=content_type,
+                seen_nonce=self.seen_nonce,
+                accept_untrusted_content=self.accept_untrusted_content,
+                localtime_offset_in_seconds=self.localtime_offset_in_seconds,
+                timestamp_skew_in_seconds=self.timestamp_skew_in_seconds,
+                executor=self.executor,
+                sink=self.sink)
+
+            their_hash = receiver.parsed_header.get('hash')
+            if their_hash is None and _has_body(headers) and \
+                    not self.accept_untrusted_content:
+                raise MisComputedContentHash(
+                    'request has a body but did not hash it')
+        except HawkFail as exc:
+            await _unauthorized(send, exc)
+            return
+
+        scope = dict(scope)
+        scope['mohawk.receiver'] = receiver
+        body = None
+        if their_hash is not None:
+            body = _HashingReceive(
+                receive,
+                PayloadHasher(receiver.resource.credentials['algorithm'],
+                              content_type),
+                their_hash, self.executor)
+            receive = body.receive
+            if self.verify_body_first and not await body.finish(keep=True):
+                await _unauthorized(send, body.error)
+                return
+
+        response = _Response(send, receiver, body, self.sign_responses,
+                             self.executor)
+        try:
+            await self.app(scope, receive, response.send)
+        except MisComputedContentHash as exc:
+            if body is None or exc is not body.error or response.sent:
+                raise
+            await _unauthorized(send, exc)
+            return
+        await response.flush()
+
+    def _bypass(self, scope):
+        if self.bypass_prefixes and \
+                scope.get('path', '').startswith(self.bypass_prefixes):
+            return True
+        for check in self.bypass_checks:
+            if check(scope):
+                return True
+        return False
+
+
+def request_target(scope):
+    """
+    Returns a :class:`mohawk.base.RequestTarget` for an ASGI request.
+
+    The path is taken from ``raw_path`` if the server provides it
+    because that is the path that the client signed.
+    Otherwise, it is quoted from ``root_path`` and ``path``.
+
+    :param scope: ASGI ``http`` scope.
+    :type scope: dict
+    """
+    return _request_target(scope, _headers(scope))
+
+
+def _request_target(scope, headers):
+    scheme = scope.get('scheme') or 'http'
+    host = headers.get('host')
+    if host:
+        host, port = _split_host(host)
+    else:
+        host, port = scope.get('server') or ('localhost', None)
+
+    raw = scope.get('raw_path')
+    if raw:
+        path = raw.decode('latin-1')
+    else:
+        path = quote((scope.get('root_path', '') +
+                      scope['path']).encode('utf8'), safe=_PATH_SAFE) or '/'
+    query = scope.get('query_string', b'').decode('latin-1')
+    return RequestTarget(scheme, host, port=port, path=path, query=query)
+
+
+class _StreamingReceiver(AsyncReceiver):
+    # A receiver that trusts the hash in the header for now because
+    # HawkMiddleware checks the body against it as the body streams in.
+
+    def _request_resource(self, parsed_header, credentials, url, method,
+                          content=EmptyValue, content_type=EmptyValue,
+                          content_hash=None):
+        if 'hash' in parsed_header:
+            content = EmptyValue
+            content_hash = parsed_header['hash']
+        return super(_StreamingReceiver, self)._request_resource(
+            parsed_header, credentials, url, method,
+            content=content, content_type=content_type,
+            content_hash=content_hash)
+
+
+class _HashingReceive(object):
+    # Wraps an ASGI receive callable to hash the body as it arrives.
+
+    def __init__(self, receive, hasher, expected_hash, executor):
+        self._receive = receive
+        self._hasher = hasher
+        self._expected_hash = expected_hash
+        self._executor = executor
+        # Messages that finish() received for the application.
+        self._buffered = collections.deque()
+        self._verified = False
+        self.error = None
+
+    async def receive(self):
+        if self._buffered:
+            return self._buffered.popleft()
+        if self.error is not None:
+            raise self.error
+        message = await self._receive()
+        if message['type'] == 'http.request' and not self._verified:
+            await _update(self._hasher, message.get('body', b''),
+                          self._executor)
+            if not message.get('more_body', False):
+                # This was the end of the body.
+                self._verify()
+        return message
+
+    def _verify(self):
+        self._verified = True
+        if not strings_match(self._hasher.digest(), self._expected_hash):
+            self.error = MisComputedContentHash(
+                'request body did not match the hash in the header')
+            raise self.error
+
+    async def finish(self, keep=False):
+        # Receives whatever the application did not and returns True
+        # if the body matched. The body is only kept for the application
+        # if keep is True, otherwise it is discarded as it is hashed.
+        discarded = False
+        while not self._verified and self.error is None:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                self.error = MisComputedContentHash(
+                    'client disconnected before sending the whole body')
+            else:
+                try:
+                    await _update(self._hasher, message.get('body', b''),
+                                  self._executor)
+                    if not message.get('more_body', False):
+                        self._verify()
+                except MisComputedContentHash:
+                    pass
+                if not keep:
+                    discarded = True
+                    continue
+            self._buffered.append(message)
+        if discarded and self.error is None:
+            # Don't leave an application that is still receiving waiting
+            # for the rest of the body.
+            self._buffered.append({'type': 'http.request', 'body': b'',
+                                   'more_body': False})
+        return self.error is None
+
+
+class _Response(object):
+    # Wraps an ASGI send callable to sign the response.
+
+    def __init__(self, send, receiver, body, sign, executor):
+        self._send = send
+        self._receiver = receiver
+        self._body = body
+        self._sign = sign
+        self._executor = executor
+        # The http.response.start message while the body is held back.
+        self._start = None
+        self._held = []
+        self._hasher = None
+        self._content_type = ''
+        self._rejected = False
+        # True once anything has been sent to the server.
+        self.sent = False
+
+    async def send(self, message):
+        if self._rejected:
+            return
+        if message['type'] == 'http.response.start':
+            if self._body is not None and not await self._body.finish():
+                self._rejected = True
+                self.sent = True
+                await _unauthorized(self._send, self._body.error)
+                return
+            if self._sign and not any(
+                    name.lower() == b'server-authorization'
+                    for name, value in message.get('headers', ())):
+                self._start = message
+                for name, value in message.get('headers', ()):
+                    if name.lower() == b'content-type':
+                        self._content_type = value.decode('latin-1')
+                self._hasher = PayloadHasher(
+                    self._receiver.resource.credentials['algorithm'],
+                    self._content_type)
+                return
+        elif message['type'] == 'http.response.body' and \
+                self._start is not None:
+            await _update(self._hasher, message.get('body', b''),
+                          self._executor)
+            self._held.append(message)
+            if message.get('more_body', False):
+                return
+            header = await self._receiver.respond(
+                content_type=self._content_type, content_hash=self._hasher)
+            start = dict(self._start)
+            start['headers'] = list(start.get('headers', ())) + [
+                (b'server-authorization', header.encode('latin-1'))]
+            self._start = None
+            await self._pass_on(start)
+            return
+        await self._pass_on(message)
+
+    async def _pass_on(self, message):
+        if self._start is not None:
+            # A message that cannot be signed, such as an extension's.
+            await self.flush()
+        self.sent = True
+        await self._send(message)
+        held, self._held = self._held, []
+        for message in held:
+            await self._send(message)
+
+    async def flush(self):
+        # Sends what is held back without a signature.
+        if self._start is not None:
+            start, self._start = self._start, None
+            await self._pass_on(start)
+
+
+async def _update(hasher, chunk, executor):
+    # Hashes a chunk without blocking the event loop for long.
+    if len(chunk) >= EXECUTOR_THRESHOLD:
+        await asyncio.get_event_loop().run_in_executor(
+            executor, hasher.update, chunk)
+    else:
+        hasher.update(chunk)
+
+
+def _headers(scope):
+    # Returns the request headers as a dict of str.
+    headers = {}
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').lower()
+        value = value.decode('latin-1')
+        if name in headers:
+            headers[name] += ',' + value
+        else:
+            headers[name] = value
+    return headers
+
+
+def _has_body(headers):
+    length = headers.get('content-length', '').strip()
+    if length:
+        return length != '0'
+    return 'transfer-encoding' in headers
+
+
+async def _unauthorized(send, exc):
+    # Never send the exception message; it may help an attacker.
+    log.info('rejecting request: %s', exc.__class__.__name__)
+    www_authenticate = getattr(exc, 'www_authenticate', None) or 'Hawk'
+    await send({'type': 'http.response.start',
+                'status': 401,
+                'headers': [(b'content-type', b'text/plain'),
+                            (b'www-authenticate',
+                             www_authenticate.encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': b'Unauthorized'})
@@ -1,3 +1,4 @@
+import functools
 import logging
 import math
 import pprint
@@ -11,14 +12,17 @@ from .exc import (AlreadyProcessed,
                   TokenExpired,
                   MissingContent)
 from .util import (calculate_mac,
-                   calculate_payload_hash,
                    calculate_ts_mac,
+                   loggable_payload,
+                   PayloadHasher,
                    prepare_header_val,
                    random_string,
                    strings_match,
-                   utc_now)
+                   utc_now,
+                   _payload_hasher)
 
 default_ts_skew_in_seconds = 60
+default_ports = {'http': 80, 'https': 443}
 log = logging.getLogger(__name__)
 
 
@@ -42,16 +46,65 @@ class HawkEmptyValue(object):
 EmptyValue = HawkEmptyValue()
 
 
-class HawkAuthority:
-
-    def _authorize(self, mac_type, parsed_header, resource,
-                   their_timestamp=None,
-                   timestamp_skew_in_seconds=default_ts_skew_in_seconds,
-                   localtime_offset_in_seconds=0,
-                   accept_untrusted_content=False):
+class HawkAuthority(object):
+
+    def _authorize(self, mac_type, parsed_header, resource, **auth_kw):
+        steps = self._authorize_steps(mac_type, parsed_header, resource,
+                                      **auth_kw)
+        result = None
+        while True:
+            try:
+                _, work = steps.send(result)
+            except StopIteration:
+                break
+            result = work()
+
+    def _authorize_steps(self, mac_type, parsed_header, resource,
+                         their_timestamp=None,
+                         timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                         localtime_offset_in_seconds=0,
+                         accept_untrusted_content=False,
+                         timer=None):
+        # This is a generator of the work that _authorize() has to wait
+        # for, as (name, callable) pairs. The result of each callable is
+        # sent back in. mohawk.aio awaits the same steps instead.
 
         now = utc_now(offset_in_seconds=localtime_offset_in_seconds)
 
+        if timer is not None:
+            timer.begin('mac')
+        self._check_mac(mac_type, parsed_header, resource)
+
+        if self._should_check_hash(parsed_header, resource,
+                                   accept_untrusted_content):
+            if timer is not None:
+                timer.begin('hash')
+            content_hash = yield 'hash', resource.gen_content_hash
+            if timer is not None:
+                timer.payload(resource)
+            self._check_hash(parsed_header, resource, content_hash)
+
+        if resource.seen_nonce:
+            if timer is not None:
+                timer.begin('nonce')
+            nonce, ts = self._nonce(mac_type, parsed_header, resource)
+            seen = yield 'nonce', functools.partial(
+                resource.seen_nonce, resource.credentials['id'], nonce, ts)
+            self._check_nonce(nonce, ts, resource, seen)
+        else:
+            log.warning('seen_nonce was None; not checking nonce. '
+                        'You may be vulnerable to replay attacks')
+
+        if timer is not None:
+            timer.begin('timestamp')
+        self._check_timestamp(parsed_header, resource, now,
+                              their_timestamp=their_timestamp,
+                              timestamp_skew_in_seconds=(
+                                  timestamp_skew_in_seconds))
+
+        log.debug('authorized OK')
+
+    def _check_mac(self, mac_type, parsed_header, resource):
         their_hash = parsed_header.get('hash', '')
         their_mac = parsed_header.get('mac', '')
         mac = calculate_mac(mac_type, resource, their_hash)
@@ -60,57 +113,66 @@ class HawkAuthority:
                               'theirs: {theirs}'
                               .format(ours=mac, theirs=their_mac))
 
-        check_hash = True
-
+    def _should_check_hash(self, parsed_header, resource,
+                           accept_untrusted_content):
         if 'hash' not in parsed_header:
             # The request did not hash its content.
-            if not resource.content and not resource.content_type:
+            if not resource.has_payload():
                 # It is acceptable to not receive a hash if there is no content
                 # to hash.
                 log.debug('NOT calculating/verifying payload hash '
                           '(no hash in header, request body is empty)')
-                check_hash = False
+                return False
             elif accept_untrusted_content:
                 # Allow the request, even if it has content. Missing content or
                 # content_type values will be coerced to the empty string for
                 # hashing purposes.
                 log.debug('NOT calculating/verifying payload hash '
                           '(no hash in header, accept_untrusted_content=True)')
-                check_hash = False
-
-        if check_hash:
-            if not their_hash:
-                log.info('request unexpectedly did not hash its content')
-
-            content_hash = resource.gen_content_hash()
-
-            if not strings_match(content_hash, their_hash):
-                # The hash declared in the header is incorrect.
-                # Content could have been tampered with.
-                log.debug('mismatched content: {content}'
-                          .format(content=repr(resource.content)))
-                log.debug('mismatched content-type: {typ}'
-                          .format(typ=repr(resource.content_type)))
-                raise MisComputedContentHash(
-                    'Our hash {ours} ({algo}) did not '
-                    'match theirs {theirs}'
-                    .format(ours=content_hash,
-                            theirs=their_hash,
-                            algo=resource.credentials['algorithm']))
-
-        if resource.seen_nonce:
-            if resource.seen_nonce(resource.credentials['id'],
-                                   parsed_header['nonce'],
-                                   parsed_header['ts']):
-                raise AlreadyProcessed('Nonce {nonce} with timestamp {ts} '
-                                       'has already been processed for {id}'
-                                       .format(nonce=parsed_header['nonce'],
-                                               ts=parsed_header['ts'],
-                                               id=resource.credentials['id']))
-        else:
-            log.warning('seen_nonce was None; not checking nonce. '
-                        'You may be vulnerable to replay attacks')
+                return False
+        return True
 
+    def _check_hash(self, parsed_header, resource, content_hash):
+        their_hash = parsed_header.get('hash', '')
+        if not their_hash:
+            log.info('request unexpectedly did not hash its content')
+
+        if not strings_match(content_hash, their_hash):
+            # The hash declared in the header is incorrect.
+            # Content could have been tampered with.
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('mismatched content: %r',
+                          loggable_payload(resource.content))
+                log.debug('mismatched content-type: %r',
+                          resource.content_type)
+            raise MisComputedContentHash(
+                'Our hash {ours} ({algo}) did not '
+                'match theirs {theirs}'
+                .format(ours=content_hash,
+                        theirs=their_hash,
+                        algo=resource.credentials['algorithm']))
+
+    def _nonce(self, mac_type, parsed_header, resource):
+        if mac_type == 'response':
+            # A response header has no nonce or timestamp of its own. It
+            # is signed with the ones of the request.
+            nonce = resource.nonce
+            if isinstance(nonce, six.binary_type):
+                # Pass the nonce the way it was parsed from the request.
+                nonce = nonce.decode('ascii')
+            return nonce, resource.timestamp
+        return parsed_header['nonce'], parsed_header['ts']
+
+    def _check_nonce(self, nonce, ts, resource, seen):
+        if seen:
+            raise AlreadyProcessed('Nonce {nonce} with timestamp {ts} '
+                                   'has already been processed for {id}'
+                                   .format(nonce=nonce, ts=ts,
+                                           id=resource.credentials['id']))
+
+    def _check_timestamp(self, parsed_header, resource, now,
+                         their_timestamp=None,
+                         timestamp_skew_in_seconds=default_ts_skew_in_seconds):
         their_ts = int(their_timestamp or parsed_header['ts'])
 
         if math.fabs(their_ts - now) > timestamp_skew_in_seconds:
@@ -126,8 +188,6 @@ class HawkAuthority:
                                localtime_in_seconds=now,
                                www_authenticate=www_authenticate)
 
-        log.debug('authorized OK')
-
     def _make_header(self, resource, mac, additional_keys=None):
         keys = additional_keys
         if not keys:
@@ -136,47 +196,101 @@ class HawkAuthority:
             # exclude a bunch of keys.
             keys = ('id', 'ts', 'nonce', 'ext', 'app', 'dlg')
 
-        header = u'Hawk mac="{mac}"'.format(mac=prepare_header_val(mac))
+        if isinstance(mac, six.binary_type):
+            # We calculated the MAC so it is base64 and safe to use as is.
+            mac = mac.decode('ascii')
+        parts = [u'Hawk mac="', mac]
 
         if resource.content_hash:
-            header = u'{header}, hash="{hash}"'.format(
-                header=header,
-                hash=prepare_header_val(resource.content_hash))
+            parts.extend((u'", hash="', resource.header_val('hash')))
 
-        if 'id' in keys:
-            header = u'{header}, id="{id}"'.format(
-                header=header,
-                id=prepare_header_val(resource.credentials['id']))
+        for key in ('id', 'ts', 'nonce'):
+            if key in keys:
+                parts.extend((u'", ', key, u'="', resource.header_val(key)))
 
-        if 'ts' in keys:
-            header = u'{header}, ts="{ts}"'.format(
-                header=header, ts=prepare_header_val(resource.timestamp))
+        # These are optional so we need to check if they have values first.
 
-        if 'nonce' in keys:
-            header = u'{header}, nonce="{nonce}"'.format(
-                header=header, nonce=prepare_header_val(resource.nonce))
+        for key in ('ext', 'app', 'dlg'):
+            if key in keys and getattr(resource, key):
+                parts.extend((u'", ', key, u'="', resource.header_val(key)))
 
-        # These are optional so we need to check if they have values first.
+        parts.append(u'"')
+        header = u''.join(parts)
 
-        if 'ext' in keys and resource.ext:
-            header = u'{header}, ext="{ext}"'.format(
-                header=header, ext=prepare_header_val(resource.ext))
+        log.debug('Hawk header for URL=%s method=%s: %s',
+                  resource.url, resource.method, header)
+        return header
 
-        if 'app' in keys and resource.app:
-            header = u'{header}, app="{app}"'.format(
-                header=header, app=prepare_header_val(resource.app))
 
-        if 'dlg' in keys and resource.dlg:
-            header = u'{header}, dlg="{dlg}"'.format(
-                header=header, dlg=prepare_header_val(resource.dlg))
+class RequestTarget(object):
+    """
+    The parts of a request URL.
 
-        log.debug('Hawk header for URL={url} method={method}: {header}'
-                  .format(url=resource.url, method=resource.method,
-                          header=header))
-        return header
+    Pass this instead of an absolute URL when your web framework has
+    already split the URL up. This is signed the same as the equivalent
+    URL but it does not need to be parsed.
 
+    :param scheme: URL scheme, such as ``http`` or ``https``.
+    :type scheme: str
 
-class Resource:
+    :param host:
+        Host name, without the port. An IPv6 address can be given with
+        or without brackets.
+    :type host: str
+
+    :param port=None:
+        Port number. If None, it is 80 for http and 443 for https,
+        just like for a URL without a port.
+    :type port=None: int
+
+    :param path='': Path of the URL, such as ``/foo``.
+    :type path='': str
+
+    :param query='': Query string of the URL, without the ``?``.
+    :type query='': str
+    """
+    __slots__ = ('scheme', 'host', 'port', 'path', 'query')
+
+    def __init__(self, scheme, host, port=None, path='', query=''):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.path = path
+        self.query = query
+
+    @property
+    def name(self):
+        """The path and query string."""
+        if self.query:
+            return '%s?%s' % (self.path, self.query)
+        return self.path
+
+    def split(self):
+        """Returns ``(name, host, port)`` like :func:`split_url`."""
+        port = self.port
+        if port is None:
+            port = default_ports.get(self.scheme.lower())
+        # urlparse() lower cases the host name and takes the brackets
+        # off an IPv6 address too.
+        host = (self.host or '').lower()
+        if host.startswith('[') and host.endswith(']'):
+            host = host[1:-1]
+        return self.name or '', host, str(port)
+
+    def __str__(self):
+        netloc = self.host
+        if self.port is not None:
+            netloc = '%s:%s' % (netloc, self.port)
+        url = '%s://%s%s' % (self.scheme, netloc, self.path)
+        if self.query:
+            url = '%s?%s' % (url, self.query)
+        return url
+
+    def __repr__(self):
+        return '<RequestTarget %s>' % self
+
+
+class Resource(object):
     """
     Normalized request / response resource.
 
@@ -186,8 +300,10 @@ class Resource:
         See :ref:`sending-request` for an example.
     :type credentials_map: dict
 
-    :param url: Absolute URL of the request / response.
-    :type url: str
+    :param url:
+        Absolute URL of the request / response,
+        or a :class:`mohawk.base.RequestTarget`.
+    :type url: str or :class:`mohawk.base.RequestTarget`
 
     :param method: Method of the request / response. E.G. POST, GET
     :type method: str
@@ -198,6 +314,17 @@ class Resource:
     :param content_type=EmptyValue: content-type header value for request / response.
     :type content_type=EmptyValue: str
 
+    :param block_size=None:
+        Size of the blocks to read when ``content`` is a file-like object.
+        If None, a size is chosen based on the type of file.
+    :type block_size=None: int
+
+    :param content_hash=None:
+        A payload hash to use instead of hashing ``content``.
+        This can be a :class:`mohawk.util.PayloadHasher` that has hashed the
+        whole body or the result of its ``digest()`` method.
+    :type content_hash=None: str or :class:`mohawk.util.PayloadHasher`
+
     :param always_hash_content=True:
         When True, ``content`` and ``content_type`` must be provided.
         Read :ref:`skipping-content-checks` to learn more.
@@ -233,41 +360,125 @@ class Resource:
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
 
+    __slots__ = ('credentials', 'method', 'url', 'name', 'host', 'port',
+                 'timestamp', 'nonce', 'ext', 'app', 'dlg', 'content',
+                 'content_type', 'precomputed_content_hash',
+                 'always_hash_content', 'seen_nonce', 'block_size',
+                 'content_length', '_content_hash', '_header_vals')
+
+    # Resource attributes that have a different name in a Hawk header.
+    _header_attrs = {'ts': 'timestamp'}
+
     def __init__(self, **kw):
-        self.credentials = kw.pop('credentials')
-        self.credentials['id'] = prepare_header_val(self.credentials['id'])
-        self.method = kw.pop('method').upper()
-        self.content = kw.pop('content', EmptyValue)
-        self.content_type = kw.pop('content_type', EmptyValue)
-        self.always_hash_content = kw.pop('always_hash_content', True)
-        self.ext = kw.pop('ext', None)
-        self.app = kw.pop('app', None)
-        self.dlg = kw.pop('dlg', None)
-
-        self.timestamp = str(kw.pop('timestamp', None) or utc_now())
-
-        self.nonce = kw.pop('nonce', None)
-        if self.nonce is None:
-            self.nonce = random_string(6)
+        credentials = kw.pop('credentials')
+        credentials['id'] = prepare_header_val(credentials['id'])
+        method = kw.pop('method').upper()
+        content = kw.pop('content', EmptyValue)
+        content_type = kw.pop('content_type', EmptyValue)
+        block_size = kw.pop('block_size', None)
+        content_hash = kw.pop('content_hash', None)
+        always_hash_content = kw.pop('always_hash_content', True)
+        ext = kw.pop('ext', None)
+        app = kw.pop('app', None)
+        dlg = kw.pop('dlg', None)
+
+        timestamp = str(kw.pop('timestamp', None) or utc_now())
+
+        nonce = kw.pop('nonce', None)
+        if nonce is None:
+            nonce = random_string(6)
 
         # This is a lookup function for checking nonces.
-        self.seen_nonce = kw.pop('seen_nonce', None)
+        seen_nonce = kw.pop('seen_nonce', None)
 
-        self.url = kw.pop('url')
-        if not self.url:
+        url = kw.pop('url')
+        if not url:
             raise ValueError('url was empty')
-        url_parts = self.parse_url(self.url)
-        log.debug('parsed URL parts: \n{parts}'
-                  .format(parts=pprint.pformat(url_parts)))
-
-        self.name = url_parts['resource'] or ''
-        self.host = url_parts['hostname'] or ''
-        self.port = str(url_parts['port'])
+        if isinstance(url, RequestTarget):
+            name, host, port = url.split()
+        else:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug('parsed URL parts: \n%s',
+                          pprint.pformat(self.parse_url(url)))
+            name, host, port = split_url(url)
 
         if kw.keys():
             raise TypeError('Unknown keyword argument(s): {0}'
                             .format(kw.keys()))
 
+        self._init(credentials, method, url, name, host, port,
+                   timestamp, nonce, ext, app, dlg, content, content_type,
+                   content_hash, always_hash_content, seen_nonce, block_size)
+
+    def _init(self, credentials, method, url, name, host, port,
+              timestamp, nonce, ext, app, dlg, content, content_type,
+              content_hash, always_hash_content, seen_nonce, block_size):
+        if content_hash is not None and content is not EmptyValue:
+            raise ValueError('content and content_hash cannot both be given')
+        self.credentials = credentials
+        self.method = method
+        self.url = url
+        self.name = name
+        self.host = host
+        self.port = port
+        self.timestamp = timestamp
+        self.nonce = nonce
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+        self.content = content
+        self.content_type = content_type
+        self.precomputed_content_hash = content_hash
+        self.always_hash_content = always_hash_content
+        self.seen_nonce = seen_nonce
+        self.block_size = block_size
+        # The number of bytes that gen_content_hash() hashed, if known.
+        self.content_length = None
+        self._header_vals = None
+
+    @classmethod
+    def from_parts(cls, credentials, method, url, name, host, port,
+                   timestamp, nonce, ext=None, app=None, dlg=None,
+                   content=EmptyValue, content_type=EmptyValue,
+                   content_hash=None, always_hash_content=True,
+                   seen_nonce=None, block_size=None):
+        """
+        Creates a resource from values that have already been normalized.
+
+        This skips the work that the constructor does to check the
+        credentials ID and to parse ``url``, so the values must be like
+        the attributes of a resource made by the constructor:
+        ``method`` is upper case, ``name`` is the path and query string
+        of ``url``, and ``port`` and ``timestamp`` are strings.
+        """
+        resource = cls.__new__(cls)
+        resource._init(credentials, method, url, name, host, port,
+                       timestamp, nonce, ext, app, dlg, content, content_type,
+                       content_hash, always_hash_content, seen_nonce,
+                       block_size)
+        return resource
+
+    def for_response(self, content=EmptyValue, content_type=EmptyValue,
+                     content_hash=None, always_hash_content=True, ext=None,
+                     seen_nonce=None, credentials=None):
+        """
+        Returns a resource for the response to this request.
+
+        The response is signed with the URL, method, timestamp, nonce,
+        ``app`` and ``dlg`` of the request so they are copied from this
+        resource without parsing the URL again.
+        The arguments have the same meaning as for the constructor.
+        ``credentials`` default to the ones of this resource.
+        """
+        return self.from_parts(
+            credentials or self.credentials, self.method, self.url,
+            self.name, self.host, self.port, self.timestamp, self.nonce,
+            ext=ext, app=self.app, dlg=self.dlg,
+            content=content, content_type=content_type,
+            content_hash=content_hash,
+            always_hash_content=always_hash_content,
+            seen_nonce=seen_nonce, block_size=self.block_size)
+
     @property
     def content_hash(self):
         if not hasattr(self, '_content_hash'):
@@ -275,8 +486,64 @@ class Resource:
                 'Cannot access content_hash because it has not been generated')
         return self._content_hash
 
+    def header_val(self, key):
+        """
+        Returns the value of a Hawk header attribute, such as ``ts``, as text.
+
+        A value is checked for illegal characters the first time it is
+        requested, raising :class:`mohawk.exc.BadHeaderValue`.
+        The credentials ID was already checked when this resource was
+        created and a content hash that was calculated here is always
+        safe so they are not checked again.
+        """
+        vals = self._header_vals
+        if vals is None:
+            vals = self._header_vals = {}
+        elif key in vals:
+            return vals[key]
+
+        if key == 'hash':
+            val = self.content_hash
+            trusted = not isinstance(self.precomputed_content_hash,
+                                     (six.text_type, six.binary_type))
+        elif key == 'id':
+            val = self.credentials['id']
+            trusted = True
+        else:
+            val = getattr(self, self._header_attrs.get(key, key))
+            trusted = False
+
+        if not trusted:
+            val = prepare_header_val(val)
+        elif isinstance(val, six.binary_type):
+            val = val.decode('ascii')
+        vals[key] = val
+        return val
+
+    def has_payload(self):
+        """Returns True if there is a request / response body to hash."""
+        content_hash = self.precomputed_content_hash
+        if content_hash is None:
+            return bool(self.content or self.content_type)
+        if isinstance(content_hash, PayloadHasher):
+            return bool(content_hash.length or content_hash.content_type)
+        # We cannot tell whether a bare hash came from an empty body.
+        return True
+
     def gen_content_hash(self):
-        if self.content == EmptyValue or self.content_type == EmptyValue:
+        if self.precomputed_content_hash is not None:
+            self._content_hash = self.precomputed_content_hash
+            if isinstance(self._content_hash, PayloadHasher):
+                if (self._content_hash.algorithm !=
+                        self.credentials['algorithm']):
+                    raise ValueError(
+                        'content_hash was calculated with {ours} but the '
+                        'credentials use {theirs}'.format(
+                            ours=self._content_hash.algorithm,
+                            theirs=self.credentials['algorithm']))
+                self.content_length = self._content_hash.length
+                self._content_hash = self._content_hash.digest()
+        elif self.content == EmptyValue or self.content_type == EmptyValue:
             if self.always_hash_content:
                 # Be really strict about allowing developers to skip content
                 # hashing. If they get this far they may be unintentiionally
@@ -287,9 +554,11 @@ class Resource:
             log.debug('NOT hashing content')
             self._content_hash = None
         else:
-            self._content_hash = calculate_payload_hash(
+            hasher = _payload_hasher(
                 self.content, self.credentials['algorithm'],
-                self.content_type)
+                self.content_type, block_size=self.block_size)
+            self.content_length = hasher.length
+            self._content_hash = hasher.digest()
         return self.content_hash
 
     def parse_url(self, url):
@@ -307,8 +576,22 @@ class Resource:
                                               url_dict['query'])
 
         if url_parts.port is None:
-            if url_parts.scheme == 'http':
-                url_dict['port'] = 80
-            elif url_parts.scheme == 'https':
-                url_dict['port'] = 443
+            url_dict['port'] = default_ports.get(url_parts.scheme)
         return url_dict
+
+
+def split_url(url):
+    """
+    Returns the ``(name, host, port)`` of a URL as they are signed.
+
+    The name is the path and query string. The port is a string and
+    defaults to 80 for http and 443 for https.
+    """
+    url_parts = urlparse(url)
+    name = url_parts.path
+    if url_parts.query:
+        name = '%s?%s' % (name, url_parts.query)
+    port = url_parts.port
+    if port is None:
+        port = default_ports.get(url_parts.scheme)
+    return name or '', url_parts.hostname or '', str(port)
@@ -1,15 +1,23 @@
-from base64 import urlsafe_b64encode, b64decode
-from collections import namedtuple
+from base64 import b64decode, b64encode, urlsafe_b64encode
+from collections import deque, namedtuple
+import itertools
 import logging
 import re
+import sys
 
 import six
 
-from .base import Resource
-from .util import (calculate_mac,
+from .base import RequestTarget, Resource, split_url
+from .instrument import start_timer
+from .util import (HAWK_VER,
+                   calculate_mac,
+                   hmac_key_cache,
+                   normalize_header_attr,
+                   prepare_header_val,
                    strings_match,
                    utc_now,
-                   validate_header_attr)
+                   validate_header_attr,
+                   _normalized_template)
 from .exc import (CredentialsLookupError,
                   InvalidBewit,
                   MacMismatch,
@@ -17,6 +25,8 @@ from .exc import (CredentialsLookupError,
 
 log = logging.getLogger(__name__)
 
+_bewit_param = re.compile('[?&]bewit=([^&]+)')
+
 
 def get_bewit(resource):
     """
@@ -93,7 +103,7 @@ def strip_bewit(url):
         The url containing a bewit parameter
     :type url: str
     """
-    m = re.search('[?&]bewit=([^&]+)', url)
+    m = _bewit_param.search(url)
     if not m:
         raise InvalidBewit('no bewit data found')
     bewit = m.group(1)
@@ -101,13 +111,18 @@ def strip_bewit(url):
     return bewit, stripped_url
 
 
-def check_bewit(url, credential_lookup, now=None):
+def check_bewit(url, credential_lookup, now=None, sink=None):
     """
     Validates the given bewit.
 
     Returns True if the resource has a valid bewit parameter attached,
     or raises a subclass of HawkFail otherwise.
 
+    :param url:
+        The url containing a bewit parameter,
+        or a :class:`mohawk.base.RequestTarget` whose query does.
+    :type url: str or :class:`mohawk.base.RequestTarget`
+
     :param credential_lookup:
         Callable to look up the credentials dict by sender ID.
         The credentials dict must have the keys:
@@ -119,15 +134,43 @@ def check_bewit(url, credential_lookup, now=None):
         Unix epoch time for the current time to determine if bewit has expired.
         If None, then the current time as given by utc_now() is used.
     :type now=None: integer
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink` to report how long each stage
+        of the verification takes. See :ref:`instrumentation`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
     """
-    raw_bewit, stripped_url = strip_bewit(url)
+    timer = start_timer(sink, 'check_bewit')
+    try:
+        _check_bewit(url, credential_lookup, now, timer)
+    except Exception:
+        if timer is None:
+            raise
+        exc_info = sys.exc_info()
+        timer.done(exc_info[1])
+        six.reraise(*exc_info)
+
+    if timer is not None:
+        timer.done()
+    return True
+
+
+def _check_bewit(url, credential_lookup, now, timer):
+    if timer is not None:
+        timer.begin('parse')
+    raw_bewit, stripped_url = _strip_target(url)
     bewit = parse_bewit(raw_bewit)
+
+    if timer is not None:
+        timer.begin('lookup')
     try:
         credentials = credential_lookup(bewit.id)
     except LookupError:
         raise CredentialsLookupError('Could not find credentials for ID {0}'
                                      .format(bewit.id))
 
+    if timer is not None:
+        timer.begin('resource')
     res = Resource(url=stripped_url,
                    method='GET',
                    credentials=credentials,
@@ -135,6 +178,9 @@ def check_bewit(url, credential_lookup, now=None):
                    nonce='',
                    ext=bewit.ext,
                    )
+
+    if timer is not None:
+        timer.begin('mac')
     mac = calculate_mac('bewit', res, None)
     mac = mac.decode('ascii')
 
@@ -143,17 +189,340 @@ def check_bewit(url, credential_lookup, now=None):
                           .format(bewit_mac=bewit.mac,
                                   expected_mac=mac))
 
+    if timer is not None:
+        timer.begin('timestamp')
     # Check that the timestamp isn't expired
     if now is None:
         # TODO: Add offset/skew
         now = utc_now()
     if int(bewit.expiration) < now:
-        # TODO: Refactor TokenExpired to handle this better
-        raise TokenExpired('bewit with UTC timestamp {ts} has expired; '
-                           'it was compared to {now}'
-                           .format(ts=bewit.expiration, now=now),
-                           localtime_in_seconds=now,
-                           www_authenticate=''
-                           )
+        raise _expired(bewit.expiration, now)
 
-    return True
+
+def _strip_target(url):
+    if isinstance(url, RequestTarget):
+        raw_bewit, stripped_name = strip_bewit(url.name)
+        # Split the rest like urlparse() would split the stripped URL.
+        path, _, query = stripped_name.partition('?')
+        stripped_url = RequestTarget(url.scheme, url.host, port=url.port,
+                                     path=path, query=query)
+    else:
+        raw_bewit, stripped_url = strip_bewit(url)
+    return raw_bewit, stripped_url
+
+
+def _expired(expiration, now):
+    # TODO: Refactor TokenExpired to handle this better
+    return TokenExpired('bewit with UTC timestamp {ts} has expired; '
+                        'it was compared to {now}'
+                        .format(ts=expiration, now=now),
+                        localtime_in_seconds=now,
+                        www_authenticate='')
+
+
+class BewitResult(namedtuple('BewitResult',
+                             'id expiration ext credentials url')):
+    """
+    A bewit that :meth:`BewitVerifier.verify` found to be valid.
+
+    This has the following named attributes:
+        (id, expiration, ext, credentials, url)
+
+    ``expiration`` is the Unix epoch time as an integer, ``credentials``
+    is the dict returned by the credential lookup and ``url`` is the URL
+    without the bewit parameter.
+    """
+    __slots__ = ()
+
+
+class BewitVerifier(object):
+    """
+    Verifies bewits for many requests, such as asset downloads.
+
+    It accepts exactly the bewits that :func:`mohawk.bewit.check_bewit`
+    accepts but is faster:
+
+    - Expired bewits are rejected before the credentials are looked up
+      or any MAC is calculated.
+    - The keyed HMAC of each sender is kept until the credential lookup
+      returns a different dict or the key changes.
+    - The parts of the normalized string that only depend on the URL
+      are kept for the most recent URLs, so they are not parsed again.
+
+    It is safe to share a verifier between threads.
+
+    :param credential_lookup:
+        Callable to look up the credentials dict by sender ID.
+        See :func:`mohawk.bewit.check_bewit`.
+    :type credential_lookup: callable
+
+    :param max_cache_size=1024:
+        Maximum number of senders and of URLs to keep state for.
+    :type max_cache_size=1024: int
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink` to report how long each stage
+        of the verification takes. See :ref:`instrumentation`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
+    """
+
+    def __init__(self, credential_lookup, max_cache_size=1024, sink=None):
+        self.credential_lookup = credential_lookup
+        self.max_cache_size = max_cache_size
+        self.sink = sink
+        # Sender ID -> (credentials, key, algorithm, keyed HMAC).
+        self._senders = {}
+        # Stripped URL -> normalized string after the expiration.
+        self._urls = {}
+
+    def verify(self, url, now=None):
+        """
+        Returns a :class:`mohawk.bewit.BewitResult` if the URL has a valid
+        bewit parameter or raises a subclass of
+        :class:`mohawk.exc.HawkFail` otherwise.
+
+        :param url:
+            The url containing a bewit parameter,
+            or a :class:`mohawk.base.RequestTarget` whose query does.
+        :type url: str or :class:`mohawk.base.RequestTarget`
+
+        :param now=None:
+            Unix epoch time for the current time to determine if the bewit
+            has expired. If None, then the current time as given by
+            utc_now() is used.
+        :type now=None: integer
+        """
+        timer = start_timer(self.sink, 'check_bewit')
+        try:
+            result = self._verify(url, now, timer)
+        except Exception:
+            if timer is None:
+                raise
+            exc_info = sys.exc_info()
+            timer.done(exc_info[1])
+            six.reraise(*exc_info)
+
+        if timer is not None:
+            timer.done()
+        return result
+
+    def _verify(self, url, now, timer):
+        if timer is not None:
+            timer.begin('parse')
+        raw_bewit, stripped_url = _strip_target(url)
+        bewit = parse_bewit(raw_bewit)
+
+        if timer is not None:
+            timer.begin('timestamp')
+        try:
+            expiration = int(bewit.expiration)
+        except ValueError:
+            raise InvalidBewit('bewit expiration is not a number: {0}'
+                               .format(bewit.expiration))
+        if now is None:
+            now = utc_now()
+        if expiration < now:
+            raise _expired(bewit.expiration, now)
+
+        if timer is not None:
+            timer.begin('lookup')
+        try:
+            credentials = self.credential_lookup(bewit.id)
+        except LookupError:
+            raise CredentialsLookupError('Could not find credentials for ID {0}'
+                                         .format(bewit.id))
+
+        if timer is not None:
+            timer.begin('mac')
+        keyed_hmac = self._keyed_hmac(bewit.id, credentials)
+        normalized = _join((_bewit_prefix, bewit.expiration, '\n',
+                            self._url_part(stripped_url), bewit.ext, '\n'))
+        if not isinstance(normalized, six.binary_type):
+            normalized = normalized.encode('utf8')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(u'normalized resource for mac calc: %s',
+                      normalized.decode('utf8'))
+        keyed_hmac.update(normalized)
+        mac = b64encode(keyed_hmac.digest()).decode('ascii')
+
+        if not strings_match(mac, bewit.mac):
+            raise MacMismatch('bewit with mac {bewit_mac} did not match '
+                              'expected mac {expected_mac}'
+                              .format(bewit_mac=bewit.mac,
+                                      expected_mac=mac))
+
+        return BewitResult(bewit.id, expiration, bewit.ext,
+                           credentials, stripped_url)
+
+    def _keyed_hmac(self, id, credentials):
+        entry = self._senders.get(id)
+        if (entry is None or entry[0] is not credentials or
+                entry[1] != credentials['key'] or
+                entry[2] != credentials['algorithm']):
+            # Resource() checks the ID the same way.
+            credentials['id'] = prepare_header_val(credentials['id'])
+            entry = (credentials, credentials['key'],
+                     credentials['algorithm'],
+                     hmac_key_cache.hmac_for(credentials))
+            if len(self._senders) >= self.max_cache_size:
+                self._senders.clear()
+            self._senders[id] = entry
+        return entry[3].copy()
+
+    def _url_part(self, url):
+        if isinstance(url, RequestTarget):
+            return _url_part(*url.split())
+        part = self._urls.get(url)
+        if part is None:
+            if not url:
+                raise ValueError('url was empty')
+            part = _url_part(*split_url(url))
+            if len(self._urls) >= self.max_cache_size:
+                self._urls.clear()
+            self._urls[url] = part
+        return part
+
+
+# The nonce of a bewit is empty so the normalized string is this prefix,
+# the expiration, a new line and then a part that only depends on the URL.
+_bewit_prefix = 'hawk.' + str(HAWK_VER) + '.bewit\n'
+
+
+def _url_part(name, host, port):
+    # The same as what mohawk.util._normalize_bytes() puts between the
+    # nonce and the ext for a GET request without a content hash.
+    prefix, method, host_and_port = _normalized_template(
+        'bewit', 'GET', host, port)
+    return _join((method, name, host_and_port, '\n'))
+
+
+def _join(parts):
+    try:
+        return ''.join(parts)
+    except (TypeError, UnicodeDecodeError):
+        # Some values are UTF-8 bytes.
+        return ''.join([normalize_header_attr(p) for p in parts])
+
+
+def bewit_urls(credentials, expiration, urls, ext=None, executor=None,
+               chunk_size=1000):
+    """
+    Returns an iterator of the URLs with a bewit parameter added.
+
+    Each bewit is the same as what :func:`mohawk.bewit.get_bewit` would
+    generate for a GET request of the URL with an empty nonce, but the
+    credentials, the expiration and the ext are only prepared once.
+    The URLs are read and signed as the iterator is consumed, so this
+    works for batches that do not fit in memory::
+
+        for url in bewit_urls(credentials, utc_now() + 3600, urls):
+            out.write(url + '\\n')
+
+    A URL fragment stays at the end, after the bewit.
+
+    :param credentials:
+        A dict of credentials with the keys ``id``, ``key``,
+        and ``algorithm``.
+    :type credentials: dict
+
+    :param expiration:
+        Unix epoch time when the bewits expire.
+    :type expiration: int
+
+    :param urls:
+        Absolute URLs to sign.
+    :type urls: iterable of str
+
+    :param ext=None:
+        An external string that will be included in every bewit.
+    :type ext=None: str
+
+    :param executor=None:
+        A :class:`concurrent.futures.Executor`, such as a
+        ``ProcessPoolExecutor``, to sign chunks of URLs in.
+        The URLs still come back in order. If None, the URLs are signed
+        in the calling thread.
+    :type executor=None: :class:`concurrent.futures.Executor`
+
+    :param chunk_size=1000:
+        Number of URLs to send to the executor at once.
+    :type chunk_size=1000: int
+    """
+    # This checks the arguments before any URL is read.
+    signer = _BewitSigner(credentials, expiration, ext)
+    if executor is None:
+        return six.moves.map(signer.sign, urls)
+    return _bewit_urls_in(executor, credentials, expiration, ext, urls,
+                          chunk_size)
+
+
+# The most chunks of bewit_urls() that can be in an executor at once.
+_MAX_PENDING_CHUNKS = 64
+
+
+class _BewitSigner(object):
+    # Generates bewits like get_bewit() for one set of credentials,
+    # expiration and ext.
+
+    def __init__(self, credentials, expiration, ext):
+        if ext is None:
+            ext = ''
+        else:
+            validate_header_attr(ext, name='ext')
+        id = prepare_header_val(credentials['id'])
+        expiration = str(expiration)
+        # The normalized string starts with the expiration, the empty
+        # nonce and the method so they are in the HMAC state that every
+        # URL starts from.
+        self.keyed_hmac = hmac_key_cache.hmac_for(credentials)
+        self.keyed_hmac.update(
+            (_bewit_prefix + expiration + '\n\nGET\n').encode('utf8'))
+        self.ext = ext
+        self.inner_prefix = u'{id}\\{exp}\\'.format(id=id, exp=expiration)
+        self.inner_suffix = u'\\' + ext
+
+    def sign(self, url):
+        name, host, port = split_url(url)
+        _, _, host_and_port = _normalized_template('bewit', 'GET', host, port)
+        normalized = _join((name, host_and_port, '\n', self.ext, '\n'))
+        if not isinstance(normalized, six.binary_type):
+            normalized = normalized.encode('utf8')
+        keyed_hmac = self.keyed_hmac.copy()
+        keyed_hmac.update(normalized)
+        inner_bewit = (self.inner_prefix +
+                       b64encode(keyed_hmac.digest()).decode('ascii') +
+                       self.inner_suffix)
+        bewit = urlsafe_b64encode(inner_bewit.encode('ascii'))
+        url, hash_mark, fragment = url.partition('#')
+        separator = '&' if '?' in url else '?'
+        return (url + separator + 'bewit=' + bewit.decode('ascii') +
+                hash_mark + fragment)
+
+
+def _bewit_urls_in(executor, credentials, expiration, ext, urls,
+                   chunk_size):
+    urls = iter(urls)
+    pending = deque()
+    try:
+        while True:
+            chunk = list(itertools.islice(urls, chunk_size))
+            if not chunk:
+                break
+            pending.append(executor.submit(_sign_chunk, credentials,
+                                           expiration, ext, chunk))
+            if len(pending) >= _MAX_PENDING_CHUNKS:
+                for url in pending.popleft().result():
+                    yield url
+        while pending:
+            for url in pending.popleft().result():
+                yield url
+    finally:
+        # The caller stopped early.
+        for future in pending:
+            future.cancel()
+
+
+def _sign_chunk(credentials, expiration, ext, urls):
+    # This runs in the executor, which can be in another process.
+    signer = _BewitSigner(credentials, expiration, ext)
+    return [signer.sign(url) for url in urls]
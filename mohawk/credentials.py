@@ -0,0 +1,162 @@
+"""
+Helpers for looking up credentials.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .util import _move_to_end, hmac_key_cache, validate_credentials
+
+log = logging.getLogger(__name__)
+
+# Python 2 does not have a monotonic clock.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class CachedCredentialsMap(object):
+    """
+    A thread-safe caching wrapper for a credentials lookup callable.
+
+    Pass an instance wherever a ``credentials_map`` or ``credential_lookup``
+    callable is expected, such as :class:`mohawk.Receiver` or
+    :func:`mohawk.bewit.check_bewit`, so that the wrapped callable (which
+    might query a database) is not called for every request.
+
+    Only credentials that pass validation are cached. When the wrapped
+    callable raises ``LookupError`` for an unknown ID, that is cached too
+    so that unknown IDs cannot flood your backend; the wrapper raises a
+    new ``LookupError`` for them until the entry expires.
+    Other exceptions are not cached.
+
+    When several threads look up the same uncached ID at the same time,
+    only one of them calls the wrapped callable and the others wait for
+    its result.
+
+    When you rotate or revoke credentials, call :meth:`invalidate`.
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID.
+        See :class:`mohawk.Receiver`.
+    :type credentials_map: callable
+
+    :param max_size=1024:
+        Maximum number of IDs to cache. The least recently used entry is
+        evicted when the cache is full.
+    :type max_size=1024: int
+
+    :param ttl_in_seconds=300:
+        Seconds to cache credentials for.
+    :type ttl_in_seconds=300: float
+
+    :param negative_ttl_in_seconds=30:
+        Seconds to cache a ``LookupError`` for.
+        Set it to 0 to disable negative caching.
+    :type negative_ttl_in_seconds=30: float
+    """
+
+    def __init__(self, credentials_map, max_size=1024, ttl_in_seconds=300,
+                 negative_ttl_in_seconds=30):
+        self.credentials_map = credentials_map
+        self.max_size = max_size
+        self.ttl_in_seconds = ttl_in_seconds
+        self.negative_ttl_in_seconds = negative_ttl_in_seconds
+        # Each entry is an (expiry time, credentials) tuple where
+        # credentials of None means that the ID was not found.
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        """Returns the number of cached IDs, including unknown ones."""
+        with self._lock:
+            return len(self._entries)
+
+    def __call__(self, id):
+        pending = None
+        with self._lock:
+            entry = self._get(id)
+            generation = self._generation
+            if entry is None:
+                waiting_for = self._pending.get(id)
+                if waiting_for is None:
+                    pending = self._pending[id] = threading.Event()
+
+        if pending is not None:
+            try:
+                return self._lookup(id, generation)
+            finally:
+                with self._lock:
+                    del self._pending[id]
+                pending.set()
+
+        if entry is None:
+            # Another thread is looking up this ID.
+            waiting_for.wait()
+            with self._lock:
+                entry = self._get(id)
+                generation = self._generation
+            if entry is None:
+                # The other lookup failed without a result to cache.
+                return self._lookup(id, generation)
+
+        credentials = entry[1]
+        if credentials is None:
+            raise LookupError('Could not find credentials for ID {0} '
+                              '(cached)'.format(id))
+        return credentials
+
+    def _get(self, id):
+        entry = self._entries.get(id)
+        if entry is None:
+            return None
+        if entry[0] <= _clock():
+            del self._entries[id]
+            return None
+        _move_to_end(self._entries, id)
+        return entry
+
+    def _lookup(self, id, generation):
+        try:
+            credentials = self.credentials_map(id)
+        except LookupError:
+            log.debug('caching unknown credentials ID %s', id)
+            self._store(id, None, self.negative_ttl_in_seconds, generation)
+            raise
+        validate_credentials(credentials)
+        self._store(id, credentials, self.ttl_in_seconds, generation)
+        return credentials
+
+    def _store(self, id, credentials, ttl, generation):
+        if not ttl or self.max_size <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                # invalidate() was called during the lookup so the
+                # result might be stale.
+                return
+            self._entries[id] = (_clock() + ttl, credentials)
+            _move_to_end(self._entries, id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, id=None):
+        """
+        Drops cached credentials.
+
+        This also drops the keyed HMAC objects for them from
+        :data:`mohawk.util.hmac_key_cache`.
+
+        :param id=None:
+            Only drop the credentials for this ID.
+            If None, drop all of them.
+        :type id=None: str
+        """
+        with self._lock:
+            self._generation += 1
+            if id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(id, None)
+        hmac_key_cache.invalidate(id)
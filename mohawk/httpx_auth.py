@@ -0,0 +1,228 @@
+"""
+Hawk authentication for `HTTPX`_.
+
+This module imports :mod:`httpx`, which Mohawk does not depend on.
+It requires Python 3.
+See :ref:`client-adapters` for details.
+
+.. _`HTTPX`: https://www.python-httpx.org/
+"""
+import logging
+import tempfile
+
+import httpx
+
+from .base import default_ts_skew_in_seconds, EmptyValue
+from .exc import MissingAuthorization
+from .sender import SenderSession
+from .util import DEFAULT_BLOCK_SIZE, PayloadHasher, SPOOL_SIZE, _spool
+
+__all__ = ['HawkAuth']
+log = logging.getLogger(__name__)
+
+
+class HawkAuth(httpx.Auth):
+    """
+    Signs requests made with :mod:`httpx` and verifies the responses.
+
+    It works with both ``httpx.Client`` and ``httpx.AsyncClient``.
+    Attach it to a client so that all of its requests are signed with
+    the same :class:`mohawk.SenderSession`::
+
+        client = httpx.Client(auth=HawkAuth(credentials))
+
+    A streamed request body, such as a generator, is copied to a
+    temporary file while it is hashed because the hash has to be in the
+    header that goes out before the body.
+
+    The response body is hashed as it is read and verified like
+    :class:`mohawk.requests_auth.HawkAuth` does. Without streaming, that
+    happens before the client returns the response.
+
+    The arguments are the same as for
+    :class:`mohawk.requests_auth.HawkAuth`.
+    """
+
+    def __init__(self, credentials, verify_responses=True, ext=None,
+                 app=None, dlg=None, always_hash_content=True,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 spool_size=SPOOL_SIZE, sink=None):
+        self.session = SenderSession(credentials)
+        self.verify_responses = verify_responses
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+        self.always_hash_content = always_hash_content
+        self.spool_size = spool_size
+        self.accept_kw = dict(
+            accept_untrusted_content=accept_untrusted_content,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            sink=sink)
+
+    def sync_auth_flow(self, request):
+        content_hash = None
+        spool = None
+        if not _in_memory(request):
+            content_hash = self._hasher(request)
+            stream = request.stream
+            spool, size = _spool(stream, content_hash, self.spool_size)
+            _replace_stream(request, spool, size)
+            _close_spooled(stream)
+
+        sender = self._sign(request, content_hash)
+        response = yield request
+        _close_sent(spool, response)
+        if self._should_verify(response):
+            _verify_content(response, sender, self.accept_kw)
+
+    async def async_auth_flow(self, request):
+        content_hash = None
+        spool = None
+        if not _in_memory(request):
+            content_hash = self._hasher(request)
+            stream = request.stream
+            spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+            async for chunk in stream:
+                content_hash.update(chunk)
+                spool.write(chunk)
+            size = spool.tell()
+            spool.seek(0)
+            _replace_stream(request, spool, size)
+            _close_spooled(stream)
+
+        sender = self._sign(request, content_hash)
+        response = yield request
+        _close_sent(spool, response)
+        if self._should_verify(response):
+            _verify_content(response, sender, self.accept_kw,
+                            asynchronous=True)
+
+    def _hasher(self, request):
+        return PayloadHasher(self.session.credentials['algorithm'],
+                             request.headers.get('content-type', ''))
+
+    def _sign(self, request, content_hash):
+        sender = self.session.request(
+            str(request.url), request.method,
+            content=(EmptyValue if content_hash is not None
+                     else request.content),
+            content_type=request.headers.get('content-type', ''),
+            content_hash=content_hash,
+            always_hash_content=self.always_hash_content,
+            ext=self.ext, app=self.app, dlg=self.dlg)
+        request.headers['Authorization'] = sender.request_header
+        return sender
+
+    def _should_verify(self, response):
+        if not self.verify_responses:
+            return False
+        if 'server-authorization' in response.headers:
+            return True
+        if 200 <= response.status_code < 300:
+            raise MissingAuthorization(
+                'response is missing Server-Authorization')
+        return False
+
+
+class _SpooledStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    # A request body that was spooled while it was hashed.
+    # It can be sent again, for example after a redirect.
+
+    def __init__(self, spool):
+        self._spool = spool
+
+    def __iter__(self):
+        self._spool.seek(0)
+        return iter(lambda: self._spool.read(DEFAULT_BLOCK_SIZE), b'')
+
+    async def __aiter__(self):
+        for block in self:
+            yield block
+
+    def close(self):
+        self._spool.close()
+
+    async def aclose(self):
+        self.close()
+
+
+def _in_memory(request):
+    try:
+        request.content
+    except httpx.RequestNotRead:
+        return False
+    return True
+
+
+def _replace_stream(request, spool, size):
+    request.stream = _SpooledStream(spool)
+    request.headers.pop('transfer-encoding', None)
+    request.headers['content-length'] = str(size)
+
+
+def _close_spooled(stream):
+    # Sending the next_request of a redirect resends the body that was
+    # spooled for the previous request. It has just been copied so it
+    # is not needed any more.
+    if isinstance(stream, _SpooledStream):
+        stream.close()
+
+
+def _close_sent(spool, response):
+    # Redirects that the client follows have been sent by now but the
+    # body is still needed for the next_request of one that it did not.
+    if spool is not None and not response.has_redirect_location:
+        spool.close()
+
+
+def _verify_content(response, sender, accept_kw, asynchronous=False):
+    # Makes everything that reads the body, including response.read(),
+    # hash it and verify the response at the end.
+    header = response.headers['server-authorization']
+    hasher = PayloadHasher(sender.credentials['algorithm'],
+                           response.headers.get('content-type', ''))
+    verified = []
+
+    def update(chunk):
+        if not verified:
+            hasher.update(chunk)
+
+    def verify():
+        if not verified:
+            sender.accept_response(header, content_type=hasher.content_type,
+                                   content_hash=hasher, **accept_kw)
+            verified.append(True)
+
+    try:
+        content = response.content
+    except httpx.ResponseNotRead:
+        pass
+    else:
+        # The transport already read the body into memory.
+        update(content)
+        verify()
+        return
+
+    if asynchronous:
+        aiter_bytes = response.aiter_bytes
+
+        async def verifying_aiter_bytes(chunk_size=None):
+            async for chunk in aiter_bytes(chunk_size):
+                update(chunk)
+                yield chunk
+            verify()
+
+        response.aiter_bytes = verifying_aiter_bytes
+    else:
+        iter_bytes = response.iter_bytes
+
+        def verifying_iter_bytes(chunk_size=None):
+            for chunk in iter_bytes(chunk_size):
+                update(chunk)
+                yield chunk
+            verify()
+
+        response.iter_bytes = verifying_iter_bytes
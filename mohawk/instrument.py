@@ -0,0 +1,195 @@
+"""
+Per-stage timing of Hawk verification.
+
+Pass a sink as the ``sink`` argument of :class:`mohawk.Receiver`,
+:meth:`mohawk.Sender.accept_response` or :func:`mohawk.bewit.check_bewit`
+to find out how long each stage of verifying a message takes and how it
+ended. Without a sink nothing is timed.
+See :ref:`instrumentation` for details.
+"""
+import logging
+import time
+
+__all__ = ['Sink', 'CallbackSink', 'CounterSink', 'LoggingSink']
+
+#: A :class:`mohawk.instrument.Sink` for all verifications that are not
+#: given a ``sink`` of their own. If None, those are not timed.
+default_sink = None
+
+# Python 2 does not have perf_counter().
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class Sink(object):
+    """
+    Base class for instrumentation sinks.
+
+    Subclasses must implement :meth:`record`.
+    """
+
+    def record(self, operation, stage, seconds, error=None):
+        """
+        Records how long a stage took.
+
+        :param operation:
+            What was verified: ``'receiver'``, ``'accept_response'``
+            or ``'check_bewit'``, which is also used by
+            :class:`mohawk.bewit.BewitVerifier`.
+        :type operation: str
+
+        :param stage:
+            The stage, such as ``'parse'``, ``'lookup'``, ``'resource'``,
+            ``'mac'``, ``'hash'``, ``'nonce'`` or ``'timestamp'``.
+            Once the operation finishes, a ``'total'`` stage is recorded
+            for all of it.
+        :type stage: str
+
+        :param seconds:
+            How long the stage took.
+        :type seconds: float
+
+        :param error=None:
+            The exception that the stage raised, usually a
+            :class:`mohawk.exc.HawkFail` subclass.
+            It is None when the stage succeeded.
+            The ``'total'`` stage gets the same exception as the stage
+            that failed.
+        :type error=None: Exception
+        """
+        raise NotImplementedError()
+
+    def record_payload(self, operation, size):
+        """
+        Records the size of a payload that was hashed.
+
+        This is only called when the size is known. It does nothing
+        unless a subclass implements it.
+
+        :param operation: See :meth:`record`.
+        :type operation: str
+
+        :param size: Number of bytes.
+        :type size: int
+        """
+
+
+class CallbackSink(Sink):
+    """
+    A sink that passes every record to a callable.
+
+    :param callback:
+        Called like :meth:`mohawk.instrument.Sink.record`.
+    :type callback: callable
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def record(self, operation, stage, seconds, error=None):
+        self.callback(operation, stage, seconds, error)
+
+
+class CounterSink(Sink):
+    """
+    A sink for a statsd-like client.
+
+    Each stage is reported with ``client.timing(name, milliseconds)``
+    as ``{prefix}.{operation}.{stage}``. When an operation finishes,
+    ``client.incr(name)`` counts its outcome as
+    ``{prefix}.{operation}.ok`` or, for example,
+    ``{prefix}.{operation}.MacMismatch``.
+
+    :param client:
+        An object with ``timing()`` and ``incr()`` methods, such as a
+        ``statsd.StatsClient``.
+
+    :param prefix='mohawk':
+        Prefix of all metric names.
+    :type prefix='mohawk': str
+    """
+
+    def __init__(self, client, prefix='mohawk'):
+        self.client = client
+        self.prefix = prefix
+
+    def record(self, operation, stage, seconds, error=None):
+        name = '{0}.{1}'.format(self.prefix, operation)
+        self.client.timing('{0}.{1}'.format(name, stage), seconds * 1000.0)
+        if stage == 'total':
+            outcome = 'ok' if error is None else error.__class__.__name__
+            self.client.incr('{0}.{1}'.format(name, outcome))
+
+
+class LoggingSink(Sink):
+    """
+    A sink that logs every record.
+
+    :param logger=None:
+        Logger to log to. If None, the ``mohawk.instrument`` logger
+        is used.
+    :type logger=None: :class:`logging.Logger`
+
+    :param level=logging.INFO:
+        Level to log at.
+    :type level=logging.INFO: int
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def record(self, operation, stage, seconds, error=None):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(self.level, '%s %s took %.1f usec%s',
+                        operation, stage, seconds * 1e6,
+                        '' if error is None else
+                        ' and raised ' + error.__class__.__name__)
+
+
+class _StageTimer(object):
+    __slots__ = ('sink', 'operation', 'started', 'stage', 'stage_started')
+
+    def __init__(self, sink, operation):
+        self.sink = sink
+        self.operation = operation
+        self.started = self.stage_started = _clock()
+        self.stage = None
+
+    def begin(self, stage):
+        # Ends the current stage, if any, and starts a new one.
+        now = _clock()
+        if self.stage is not None:
+            self.sink.record(self.operation, self.stage,
+                             now - self.stage_started)
+        self.stage = stage
+        self.stage_started = now
+
+    def payload(self, resource):
+        # This is called after the content of the resource was hashed.
+        size = resource.content_length
+        if size is not None:
+            self.sink.record_payload(self.operation, size)
+
+    def done(self, error=None):
+        now = _clock()
+        if self.stage is not None:
+            self.sink.record(self.operation, self.stage,
+                             now - self.stage_started, error)
+            self.stage = None
+        self.sink.record(self.operation, 'total', now - self.started, error)
+
+
+def start_timer(sink, operation):
+    """
+    Returns a timer for the stages of an operation or None if there
+    is no sink.
+
+    Callers check for None before every call so that there is no
+    overhead without a sink.
+    """
+    if sink is None:
+        sink = default_sink
+        if sink is None:
+            return None
+    return _StageTimer(sink, operation)
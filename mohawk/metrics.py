@@ -0,0 +1,212 @@
+"""
+Authentication metrics in the Prometheus text format.
+
+:class:`mohawk.metrics.MetricsRegistry` is a
+:class:`mohawk.instrument.Sink` that counts outcomes, builds latency
+histograms and adds up hashed payload bytes. It has no dependencies.
+See :ref:`metrics` for details.
+"""
+import bisect
+import threading
+
+from .instrument import Sink
+
+__all__ = ['MetricsRegistry', 'CONTENT_TYPE', 'DEFAULT_BUCKETS']
+
+#: Content-Type of :meth:`mohawk.metrics.MetricsRegistry.render` output.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#: Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5)
+
+
+class _Shard(object):
+    # The metrics that one thread has recorded. Only that thread writes
+    # to a shard so recording does not need a lock.
+    __slots__ = ('thread', 'outcomes', 'histograms', 'payload_bytes')
+
+    def __init__(self, thread):
+        self.thread = thread
+        # (operation, outcome) -> count
+        self.outcomes = {}
+        # (operation, stage) -> [count per bucket..., count above the
+        # last bucket, sum of seconds]
+        self.histograms = {}
+        # operation -> bytes
+        self.payload_bytes = {}
+
+
+class MetricsRegistry(Sink):
+    """
+    An in-process registry of Hawk authentication metrics.
+
+    Pass it as the ``sink`` of a verification or make it the
+    :data:`mohawk.instrument.default_sink` to record all verifications.
+    Serve the output of :meth:`render` to your Prometheus scraper.
+
+    Each thread records into its own shard so threads never wait for each
+    other. :meth:`render` adds up the shards. The metrics of a thread
+    that has exited are kept.
+
+    These metrics are exported, with ``mohawk`` replaced by ``prefix``:
+
+    ``mohawk_verifications_total``
+        Counter of finished verifications by ``operation`` and
+        ``outcome``, which is ``ok`` or the name of the exception
+        raised, such as ``MacMismatch`` or ``TokenExpired``.
+
+    ``mohawk_verification_stage_seconds``
+        Histogram of how long each ``stage`` of an ``operation`` took.
+        The ``total`` stage covers the whole verification.
+
+    ``mohawk_payload_hashed_bytes_total``
+        Counter of payload bytes hashed by ``operation``.
+
+    :param buckets=DEFAULT_BUCKETS:
+        Upper bounds of the latency histogram buckets in seconds.
+    :type buckets=DEFAULT_BUCKETS: sequence of float
+
+    :param prefix='mohawk':
+        Prefix of the metric names.
+    :type prefix='mohawk': str
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='mohawk'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._retire_shards()
+                self._shards.append(shard)
+        return shard
+
+    def _retire_shards(self):
+        # Shards of exited threads will not change any more so fold
+        # them into one to keep the list short. Call with the lock held.
+        live = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                live.append(shard)
+            else:
+                _add(self._retired, shard)
+        self._shards = live
+
+    def record(self, operation, stage, seconds, error=None):
+        shard = self._shard()
+        key = (operation, stage)
+        histogram = shard.histograms.get(key)
+        if histogram is None:
+            histogram = shard.histograms[key] = (
+                [0] * (len(self.buckets) + 1) + [0.0])
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+        if stage == 'total':
+            key = (operation,
+                   'ok' if error is None else error.__class__.__name__)
+            shard.outcomes[key] = shard.outcomes.get(key, 0) + 1
+
+    def record_payload(self, operation, size):
+        payload_bytes = self._shard().payload_bytes
+        payload_bytes[operation] = payload_bytes.get(operation, 0) + size
+
+    def _collect(self):
+        # Returns a shard with the sum of all shards.
+        total = _Shard(None)
+        with self._lock:
+            self._retire_shards()
+            _add(total, self._retired)
+            live = self._shards
+        for shard in live:
+            _add(total, shard)
+        return total
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+
+        Serve it with a Content-Type of :data:`mohawk.metrics.CONTENT_TYPE`.
+        """
+        total = self._collect()
+        name = self.prefix + '_verifications_total'
+        lines = ['# HELP {0} Finished Hawk verifications.'.format(name),
+                 '# TYPE {0} counter'.format(name)]
+        for (operation, outcome), count in sorted(total.outcomes.items()):
+            lines.append('{0}{1} {2}'.format(
+                name, _labels(operation=operation, outcome=outcome), count))
+
+        name = self.prefix + '_verification_stage_seconds'
+        lines.extend([
+            '# HELP {0} Time spent in each stage of Hawk verification.'
+            .format(name),
+            '# TYPE {0} histogram'.format(name)])
+        for (operation, stage), histogram in sorted(
+                total.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    histogram):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _labels(operation=operation, stage=stage,
+                                  le=_number(bound)),
+                    cumulative))
+            labels = _labels(operation=operation, stage=stage)
+            lines.append('{0}_sum{1} {2}'.format(name, labels,
+                                                 _number(histogram[-1])))
+            lines.append('{0}_count{1} {2}'.format(name, labels, cumulative))
+
+        name = self.prefix + '_payload_hashed_bytes_total'
+        lines.extend(['# HELP {0} Payload bytes hashed for Hawk '
+                      'verification.'.format(name),
+                      '# TYPE {0} counter'.format(name)])
+        for operation, size in sorted(total.payload_bytes.items()):
+            lines.append('{0}{1} {2}'.format(
+                name, _labels(operation=operation), size))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _add(total, shard):
+    # Copy the dicts first because the shard's thread may be writing.
+    for key, count in dict(shard.outcomes).items():
+        total.outcomes[key] = total.outcomes.get(key, 0) + count
+    for key, histogram in dict(shard.histograms).items():
+        histogram = list(histogram)
+        summed = total.histograms.get(key)
+        if summed is None:
+            total.histograms[key] = histogram
+        else:
+            for i, value in enumerate(histogram):
+                summed[i] += value
+    for key, size in dict(shard.payload_bytes).items():
+        total.payload_bytes[key] = total.payload_bytes.get(key, 0) + size
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _labels(**labels):
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, value.replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items(),
+                                 key=lambda item: _label_order(item[0]))
+    ) + '}'
+
+
+def _label_order(key):
+    # "le" comes last, as in the Prometheus client libraries.
+    return (key == 'le', key)
@@ -0,0 +1,283 @@
+"""
+Nonce stores for protecting against replay attacks.
+
+Any callable with the signature ``seen_nonce(sender_id, nonce, timestamp)``
+can be passed as the ``seen_nonce`` argument of :class:`mohawk.Receiver`
+and :class:`mohawk.Sender`. The stores in this module are such callables.
+See :ref:`nonce` for details.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # This platform does not support POSIX file locks (e.g. Windows).
+    fcntl = None
+
+from .base import default_ts_skew_in_seconds
+from .util import utc_now
+
+log = logging.getLogger(__name__)
+
+
+class NonceStore(object):
+    """
+    Base class for nonce stores.
+
+    Instances are callable so that they can be passed as ``seen_nonce``.
+    Subclasses must implement :meth:`seen_nonce`.
+
+    A message is rejected with :class:`mohawk.exc.TokenExpired` when its
+    timestamp is more than ``timestamp_skew_in_seconds`` away from the
+    local time so a store only needs to remember nonces for that long.
+
+    .. important::
+
+        The ``timestamp_skew_in_seconds`` of a store must be greater than
+        or equal to the one used by your :class:`mohawk.Receiver`,
+        otherwise some replayed messages will not be detected.
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds until a message expires.
+    :type timestamp_skew_in_seconds=60: int
+    """
+
+    def __init__(self, timestamp_skew_in_seconds=default_ts_skew_in_seconds):
+        self.timestamp_skew_in_seconds = int(timestamp_skew_in_seconds)
+
+    def __call__(self, sender_id, nonce, timestamp):
+        return self.seen_nonce(sender_id, nonce, timestamp)
+
+    def seen_nonce(self, sender_id, nonce, timestamp):
+        """
+        Returns True if the nonce has been seen before.
+
+        Otherwise, the nonce is remembered and False is returned.
+        """
+        raise NotImplementedError()
+
+    def _is_expired(self, timestamp, now):
+        # A message outside of the timestamp window will be rejected
+        # anyway so there is no need to remember its nonce.
+        return abs(timestamp - now) > self.timestamp_skew_in_seconds
+
+
+class _Stripe(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.next_purge = 0
+
+
+class MemoryNonceStore(NonceStore):
+    """
+    A thread-safe nonce store that keeps nonces in process memory.
+
+    Nonces are sharded into lock stripes by sender ID and grouped into
+    buckets by timestamp. Whole buckets are dropped once their timestamps
+    have expired so memory only grows with the number of live nonces.
+
+    This store only protects a single process. If you run several worker
+    processes, use a store that they can share.
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds until a message expires.
+        See :class:`mohawk.nonce.NonceStore`.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param stripes=16:
+        Number of independently locked shards.
+    :type stripes=16: int
+
+    :param bucket_seconds=None:
+        Range of timestamps to group into a bucket. The default is a
+        quarter of ``timestamp_skew_in_seconds``.
+    :type bucket_seconds=None: int
+    """
+
+    def __init__(self, timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 stripes=16, bucket_seconds=None):
+        super(MemoryNonceStore, self).__init__(
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds)
+        self.bucket_seconds = int(
+            bucket_seconds or max(1, self.timestamp_skew_in_seconds // 4))
+        self._stripes = [_Stripe() for i in range(stripes)]
+
+    def count(self):
+        """Returns the number of nonces in the store."""
+        count = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                count += sum(len(b) for b in stripe.buckets.values())
+        return count
+
+    def seen_nonce(self, sender_id, nonce, timestamp):
+        timestamp = int(timestamp)
+        now = utc_now()
+        if self._is_expired(timestamp, now):
+            return False
+
+        stripe = self._stripes[hash(sender_id) % len(self._stripes)]
+        key = (sender_id, nonce, timestamp)
+        bucket_id = timestamp // self.bucket_seconds
+
+        with stripe.lock:
+            if now >= stripe.next_purge:
+                self._purge(stripe, now)
+            bucket = stripe.buckets.get(bucket_id)
+            if bucket is None:
+                bucket = stripe.buckets[bucket_id] = set()
+            elif key in bucket:
+                return True
+            bucket.add(key)
+            return False
+
+    def _purge(self, stripe, now):
+        oldest_live_bucket = ((now - self.timestamp_skew_in_seconds) //
+                              self.bucket_seconds)
+        for bucket_id in [b for b in stripe.buckets
+                          if b < oldest_live_bucket]:
+            del stripe.buckets[bucket_id]
+        stripe.next_purge = now + self.bucket_seconds
+
+
+class MmapNonceStore(NonceStore):
+    """
+    A nonce store that several processes on the same host can share.
+
+    Nonces are kept in a fixed size hash table in a memory-mapped file.
+    Each process (such as a pre-forked web server worker) opens the same
+    file so a replayed message is detected no matter which process it
+    reaches. Put the file on a memory-backed filesystem such as
+    ``/dev/shm`` to avoid disk I/O.
+
+    The table is divided into buckets of a few slots. A nonce can only be
+    stored in one bucket and each bucket is protected by a file lock
+    stripe. A slot is reused as soon as the timestamp of the nonce in it
+    expires. If every slot in a bucket is still live, the nonce is
+    treated as seen (and the message is rejected) rather than forgetting
+    a live nonce. Make sure ``slots`` comfortably exceeds the number of
+    requests you receive within twice the ``timestamp_skew_in_seconds``.
+
+    This store requires POSIX file locks so it is not available on Windows.
+
+    :param path:
+        Path to the table file. It will be created if it does not exist.
+    :type path: str
+
+    :param slots=1048576:
+        Number of nonces the table can hold.
+        Each slot takes 24 bytes on disk.
+        Every process must use the same value.
+    :type slots=1048576: int
+
+    :param timestamp_skew_in_seconds=60:
+        Max seconds until a message expires.
+        See :class:`mohawk.nonce.NonceStore`.
+    :type timestamp_skew_in_seconds=60: int
+
+    :param stripes=64:
+        Number of independently locked groups of buckets.
+    :type stripes=64: int
+    """
+    _magic = b'MOHAWKN1'
+    _header = struct.Struct('<8sQ')
+    _slot = struct.Struct('<q16s')
+    bucket_slots = 16
+
+    def __init__(self, path, slots=1 << 20,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 stripes=64):
+        if fcntl is None:
+            raise NotImplementedError(
+                'MmapNonceStore requires POSIX file locks')
+        super(MmapNonceStore, self).__init__(
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds)
+
+        self.path = path
+        self.buckets = max(1, slots // self.bucket_slots)
+        self.slots = self.buckets * self.bucket_slots
+        self.stripes = stripes
+        self._bucket = struct.Struct('<' + 'q16s' * self.bucket_slots)
+        self._thread_locks = [threading.Lock() for i in range(stripes)]
+
+        size = self._header.size + self.slots * self._slot.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._init_file(size)
+            self._map = mmap.mmap(self._fd, size)
+        except:
+            os.close(self._fd)
+            raise
+
+    def _init_file(self, size):
+        # Lock the whole file so that only one process initializes it.
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.write(self._fd, self._header.pack(self._magic, self.slots))
+                return
+
+            header = os.read(self._fd, self._header.size)
+            if (len(header) != self._header.size or
+                    self._header.unpack(header) != (self._magic, self.slots) or
+                    os.fstat(self._fd).st_size != size):
+                raise ValueError(
+                    '{path} is not a nonce table with {slots} slots'
+                    .format(path=self.path, slots=self.slots))
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        """Unmaps and closes the table file."""
+        self._map.close()
+        os.close(self._fd)
+
+    def seen_nonce(self, sender_id, nonce, timestamp):
+        timestamp = int(timestamp)
+        now = utc_now()
+        if self._is_expired(timestamp, now):
+            return False
+
+        key = u'{id}\n{nonce}\n{ts}'.format(id=sender_id, nonce=nonce,
+                                             ts=timestamp)
+        fingerprint = hashlib.sha1(key.encode('utf8')).digest()[:16]
+        bucket = struct.unpack('<Q', fingerprint[:8])[0] % self.buckets
+        offset = (self._header.size +
+                  bucket * self.bucket_slots * self._slot.size)
+        oldest_live_ts = now - self.timestamp_skew_in_seconds
+
+        stripe = bucket % self.stripes
+        with self._thread_locks[stripe]:
+            # POSIX record locks are held per process so threads are
+            # serialized by the thread lock above.
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                entries = self._bucket.unpack_from(self._map, offset)
+                free_slot = None
+                for i in range(self.bucket_slots):
+                    slot_ts = entries[i * 2]
+                    if slot_ts == timestamp and \
+                            entries[i * 2 + 1] == fingerprint:
+                        return True
+                    if free_slot is None and slot_ts < oldest_live_ts:
+                        free_slot = i
+
+                if free_slot is None:
+                    log.warning('nonce table {path} is full; treating '
+                                'nonce as seen'.format(path=self.path))
+                    return True
+
+                self._slot.pack_into(
+                    self._map, offset + free_slot * self._slot.size,
+                    timestamp, fingerprint)
+                return False
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
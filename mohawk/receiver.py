@@ -1,11 +1,14 @@
 import logging
 import sys
 
+import six
+
 from .base import (default_ts_skew_in_seconds,
                    HawkAuthority,
                    Resource,
                    EmptyValue)
 from .exc import CredentialsLookupError, MissingAuthorization
+from .instrument import start_timer
 from .util import (calculate_mac,
                    parse_authorization_header,
                    validate_credentials)
@@ -30,8 +33,10 @@ class Receiver(HawkAuthority):
         such as one created by :class:`mohawk.Sender`.
     :type request_header: str
 
-    :param url: Absolute URL of the request.
-    :type url: str
+    :param url:
+        Absolute URL of the request,
+        or a :class:`mohawk.base.RequestTarget`.
+    :type url: str or :class:`mohawk.base.RequestTarget`
 
     :param method: Method of the request. E.G. POST, GET
     :type method: str
@@ -56,11 +61,38 @@ class Receiver(HawkAuthority):
         :class:`mohawk.exc.TokenExpired` is raised.
     :type timestamp_skew_in_seconds=60: float
 
+    :param content_hash=None:
+        A :class:`mohawk.util.PayloadHasher` that hashed the request body
+        (or the result of its ``digest()`` method) to use instead of
+        ``content``. This lets you verify a streamed body.
+    :type content_hash=None: :class:`mohawk.util.PayloadHasher`
+
+    :param block_size=None:
+        Size of the blocks to read when hashing file-like request or
+        response content. If None, a size is chosen based on the type
+        of file.
+    :type block_size=None: int
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink` to report how long each stage
+        of the verification takes. See :ref:`instrumentation`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
+
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
     #: Value suitable for a ``Server-Authorization`` header.
     response_header = None
 
+    @property
+    def response_header_bytes(self):
+        """
+        :attr:`response_header` as ASCII bytes, for frameworks that write
+        raw headers.
+        """
+        if self.response_header is None:
+            return None
+        return self.response_header.encode('ascii')
+
     def __init__(self,
                  credentials_map,
                  request_header,
@@ -72,47 +104,173 @@ class Receiver(HawkAuthority):
                  localtime_offset_in_seconds=0,
                  accept_untrusted_content=False,
                  timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 content_hash=None,
+                 block_size=None,
+                 sink=None,
                  **auth_kw):
 
+        self._setup(credentials_map, seen_nonce, block_size=block_size)
+
+        log.debug('accepting request %s', request_header)
+
+        timer = start_timer(sink, 'receiver')
+        try:
+            if timer is not None:
+                timer.begin('parse')
+
+            if not request_header:
+                raise MissingAuthorization()
+
+            parsed_header = parse_authorization_header(request_header)
+
+            if timer is not None:
+                timer.begin('lookup')
+            credentials = self._lookup_credentials(credentials_map,
+                                                   parsed_header['id'])
+
+            self._accept_request(
+                parsed_header, credentials, url, method,
+                content=content,
+                content_type=content_type,
+                content_hash=content_hash,
+                timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                localtime_offset_in_seconds=localtime_offset_in_seconds,
+                accept_untrusted_content=accept_untrusted_content,
+                timer=timer,
+                **auth_kw)
+        except Exception:
+            if timer is None:
+                raise
+            exc_info = sys.exc_info()
+            timer.done(exc_info[1])
+            six.reraise(*exc_info)
+
+        if timer is not None:
+            timer.done()
+
+    @classmethod
+    def verify_many(cls,
+                    credentials_map,
+                    requests,
+                    seen_nonce=None,
+                    localtime_offset_in_seconds=0,
+                    accept_untrusted_content=False,
+                    timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                    **auth_kw):
+        """
+        Verify a batch of requests.
+
+        Credentials are looked up and validated once per sender ID
+        instead of once per request.
+        A failing request does not stop the rest of the batch from
+        being verified.
+
+        Returns a list of ``(receiver, exception)`` tuples in the same
+        order as ``requests``. For a verified request, ``receiver`` is a
+        :class:`mohawk.Receiver` ready to :meth:`respond` and ``exception``
+        is None. Otherwise, ``receiver`` is None and ``exception`` is the
+        exception that :class:`mohawk.Receiver` would have raised,
+        typically a :class:`mohawk.exc.HawkFail` subclass.
+
+        :param credentials_map:
+            Callable to look up the credentials dict by sender ID.
+            See :class:`mohawk.Receiver`.
+        :type credentials_map: callable
+
+        :param requests:
+            Iterable of ``(request_header, url, method, content,
+            content_type)`` tuples, each one as you would pass them
+            to :class:`mohawk.Receiver`.
+        :type requests: iterable
+
+        The remaining keyword arguments apply to every request in the
+        batch and have the same meaning as for :class:`mohawk.Receiver`.
+        """
+        requests = list(requests)
+        log.debug('verifying a batch of %d requests', len(requests))
+
+        results = [None] * len(requests)
+        parsed_headers = {}
+        ids = {}
+
+        for i, (request_header, url, method,
+                content, content_type) in enumerate(requests):
+            try:
+                if not request_header:
+                    raise MissingAuthorization()
+                parsed_header = parse_authorization_header(request_header)
+                ids.setdefault(parsed_header['id'], []).append(i)
+            except Exception:
+                results[i] = (None, sys.exc_info()[1])
+            else:
+                parsed_headers[i] = parsed_header
+
+        for id, indices in ids.items():
+            try:
+                credentials = cls._lookup_credentials(credentials_map, id)
+            except Exception:
+                exc = sys.exc_info()[1]
+                for i in indices:
+                    results[i] = (None, exc)
+                continue
+
+            for i in indices:
+                request_header, url, method, content, content_type = \
+                    requests[i]
+                receiver = cls.__new__(cls)
+                receiver._setup(credentials_map, seen_nonce)
+                try:
+                    receiver._accept_request(
+                        parsed_headers[i], credentials, url, method,
+                        content=content,
+                        content_type=content_type,
+                        timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                        localtime_offset_in_seconds=(
+                            localtime_offset_in_seconds),
+                        accept_untrusted_content=accept_untrusted_content,
+                        **auth_kw)
+                except Exception:
+                    results[i] = (None, sys.exc_info()[1])
+                else:
+                    results[i] = (receiver, None)
+
+        return results
+
+    def _setup(self, credentials_map, seen_nonce, block_size=None):
         self.response_header = None  # make into property that can raise exc?
         self.credentials_map = credentials_map
         self.seen_nonce = seen_nonce
+        self.block_size = block_size
 
-        log.debug('accepting request {header}'.format(header=request_header))
-
-        if not request_header:
-            raise MissingAuthorization()
-
-        parsed_header = parse_authorization_header(request_header)
-
+    @staticmethod
+    def _lookup_credentials(credentials_map, id):
         try:
-            credentials = self.credentials_map(parsed_header['id'])
+            credentials = credentials_map(id)
         except LookupError:
             etype, val, tb = sys.exc_info()
-            log.debug('Catching {etype}: {val}'.format(etype=etype, val=val))
+            log.debug('Catching %s: %s', etype, val)
             raise CredentialsLookupError(
                 'Could not find credentials for ID {0}'
-                .format(parsed_header['id']))
+                .format(id))
         validate_credentials(credentials)
-
-        resource = Resource(url=url,
-                            method=method,
-                            ext=parsed_header.get('ext', None),
-                            app=parsed_header.get('app', None),
-                            dlg=parsed_header.get('dlg', None),
-                            credentials=credentials,
-                            nonce=parsed_header['nonce'],
-                            seen_nonce=self.seen_nonce,
-                            content=content,
-                            timestamp=parsed_header['ts'],
-                            content_type=content_type)
-
-        self._authorize(
-            'header', parsed_header, resource,
-            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
-            localtime_offset_in_seconds=localtime_offset_in_seconds,
-            accept_untrusted_content=accept_untrusted_content,
-            **auth_kw)
+        return credentials
+
+    def _accept_request(self, parsed_header, credentials, url, method,
+                        content=EmptyValue,
+                        content_type=EmptyValue,
+                        content_hash=None,
+                        timer=None,
+                        **auth_kw):
+        if timer is not None:
+            timer.begin('resource')
+        resource = self._request_resource(parsed_header, credentials,
+                                          url, method,
+                                          content=content,
+                                          content_type=content_type,
+                                          content_hash=content_hash)
+
+        self._authorize('header', parsed_header, resource, timer=timer,
+                        **auth_kw)
 
         # Now that we verified an incoming request, we can re-use some of its
         # properties to build our response header.
@@ -120,11 +278,30 @@ class Receiver(HawkAuthority):
         self.parsed_header = parsed_header
         self.resource = resource
 
+    def _request_resource(self, parsed_header, credentials, url, method,
+                          content=EmptyValue,
+                          content_type=EmptyValue,
+                          content_hash=None):
+        return Resource(url=url,
+                        method=method,
+                        ext=parsed_header.get('ext', None),
+                        app=parsed_header.get('app', None),
+                        dlg=parsed_header.get('dlg', None),
+                        credentials=credentials,
+                        nonce=parsed_header['nonce'],
+                        seen_nonce=self.seen_nonce,
+                        content=content,
+                        timestamp=parsed_header['ts'],
+                        content_type=content_type,
+                        content_hash=content_hash,
+                        block_size=self.block_size)
+
     def respond(self,
                 content=EmptyValue,
                 content_type=EmptyValue,
                 always_hash_content=True,
-                ext=None):
+                ext=None,
+                content_hash=None):
         """
         Respond to the request.
 
@@ -147,24 +324,37 @@ class Receiver(HawkAuthority):
             signed so that the sender can trust it.
         :type ext=None: str
 
+        :param content_hash=None:
+            A :class:`mohawk.util.PayloadHasher` that hashed the response
+            body (or the result of its ``digest()`` method) to use instead
+            of ``content``.
+        :type content_hash=None: :class:`mohawk.util.PayloadHasher`
+
         .. _`Hawk`: https://github.com/hueniverse/hawk
         """
 
         log.debug('generating response header')
 
-        resource = Resource(url=self.resource.url,
-                            credentials=self.resource.credentials,
-                            ext=ext,
-                            app=self.parsed_header.get('app', None),
-                            dlg=self.parsed_header.get('dlg', None),
-                            method=self.resource.method,
-                            content=content,
-                            content_type=content_type,
-                            always_hash_content=always_hash_content,
-                            nonce=self.parsed_header['nonce'],
-                            timestamp=self.parsed_header['ts'])
-
-        mac = calculate_mac('response', resource, resource.gen_content_hash())
+        resource = self._response_resource(
+            content=content,
+            content_type=content_type,
+            always_hash_content=always_hash_content,
+            ext=ext,
+            content_hash=content_hash)
+        return self._make_response_header(resource,
+                                          resource.gen_content_hash())
+
+    def _response_resource(self, content, content_type, always_hash_content,
+                           ext, content_hash):
+        return self.resource.for_response(
+            content=content,
+            content_type=content_type,
+            content_hash=content_hash,
+            always_hash_content=always_hash_content,
+            ext=ext)
+
+    def _make_response_header(self, resource, content_hash):
+        mac = calculate_mac('response', resource, content_hash)
 
         self.response_header = self._make_header(resource, mac,
                                                  additional_keys=['ext'])
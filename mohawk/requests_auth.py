@@ -0,0 +1,204 @@
+"""
+Hawk authentication for `requests`_.
+
+This module imports :mod:`requests`, which Mohawk does not depend on.
+See :ref:`client-adapters` for details.
+
+.. _`requests`: https://requests.readthedocs.io/
+"""
+from __future__ import absolute_import
+
+import logging
+
+import six
+from requests.auth import AuthBase
+from requests.utils import stream_decode_response_unicode
+
+from .base import default_ts_skew_in_seconds, EmptyValue
+from .exc import MissingAuthorization
+from .sender import SenderSession
+from .util import (DEFAULT_BLOCK_SIZE,
+                   PayloadHasher,
+                   SPOOL_SIZE,
+                   _hash_seekable,
+                   _spool)
+
+__all__ = ['HawkAuth']
+log = logging.getLogger(__name__)
+
+
+class HawkAuth(AuthBase):
+    """
+    Signs requests made with :mod:`requests` and verifies the responses.
+
+    Attach it to a session so that all of its requests are signed with
+    the same :class:`mohawk.SenderSession`::
+
+        session = requests.Session()
+        session.auth = HawkAuth(credentials)
+
+    Streamed request bodies, such as generators and files, are hashed
+    without reading them into memory. A seekable file is hashed and then
+    rewound. Anything else is copied to a temporary file while it is
+    hashed, because the hash has to be in the header that goes out
+    before the body.
+
+    The response body is hashed as it is read. Once all of it has been
+    read, it is verified with :meth:`mohawk.Sender.accept_response`,
+    which raises a :class:`mohawk.exc.HawkFail` subclass if it does not
+    check out. Without ``stream=True`` that happens before
+    ``session.request()`` returns. A response with a successful status
+    (2xx) has to be signed. Other responses are verified if they are
+    signed. Requests that :mod:`requests` makes to follow redirects are
+    not signed.
+
+    :param credentials: Dict of credentials with keys ``id``, ``key``,
+                        and ``algorithm``. See :ref:`usage` for an example.
+    :type credentials: dict
+
+    :param verify_responses=True:
+        When False, responses are not verified.
+    :type verify_responses=True: bool
+
+    :param ext=None: See :class:`mohawk.Sender`.
+    :type ext=None: str
+
+    :param app=None: See :class:`mohawk.Sender`.
+    :type app=None: str
+
+    :param dlg=None: See :class:`mohawk.Sender`.
+    :type dlg=None: str
+
+    :param always_hash_content=True: See :class:`mohawk.Sender`.
+    :type always_hash_content=True: bool
+
+    :param accept_untrusted_content=False:
+        See :meth:`mohawk.Sender.accept_response`.
+    :type accept_untrusted_content=False: bool
+
+    :param localtime_offset_in_seconds=0:
+        See :meth:`mohawk.Sender.accept_response`.
+    :type localtime_offset_in_seconds=0: float
+
+    :param timestamp_skew_in_seconds=60:
+        See :meth:`mohawk.Sender.accept_response`.
+    :type timestamp_skew_in_seconds=60: float
+
+    :param spool_size=SPOOL_SIZE:
+        Bytes of a streamed request body to keep in memory before it is
+        spooled to a temporary file. See :data:`mohawk.util.SPOOL_SIZE`.
+    :type spool_size=SPOOL_SIZE: int
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink` for response verification.
+        See :ref:`instrumentation`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
+    """
+
+    def __init__(self, credentials, verify_responses=True, ext=None,
+                 app=None, dlg=None, always_hash_content=True,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 spool_size=SPOOL_SIZE, sink=None):
+        self.session = SenderSession(credentials)
+        self.verify_responses = verify_responses
+        self.ext = ext
+        self.app = app
+        self.dlg = dlg
+        self.always_hash_content = always_hash_content
+        self.spool_size = spool_size
+        self.accept_kw = dict(
+            accept_untrusted_content=accept_untrusted_content,
+            localtime_offset_in_seconds=localtime_offset_in_seconds,
+            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+            sink=sink)
+
+    def __call__(self, request):
+        content_type = request.headers.get('Content-Type', '')
+        content = request.body
+        content_hash = None
+        if content is None:
+            content = b''
+        elif isinstance(content, six.text_type):
+            # Send the bytes that are hashed.
+            content = request.body = content.encode('utf8')
+            request.headers['Content-Length'] = str(len(content))
+        elif not isinstance(content, six.binary_type):
+            content_hash = PayloadHasher(
+                self.session.credentials['algorithm'], content_type)
+            if not _hash_seekable(content_hash, content):
+                self._spool(request, content_hash)
+            content = EmptyValue
+
+        sender = self.session.request(
+            request.url, request.method,
+            content=content, content_type=content_type,
+            content_hash=content_hash,
+            always_hash_content=self.always_hash_content,
+            ext=self.ext, app=self.app, dlg=self.dlg)
+        request.headers['Authorization'] = sender.request_header
+
+        if self.verify_responses:
+            request.register_hook('response',
+                                  self._response_hook(request, sender))
+        return request
+
+    def _spool(self, request, hasher):
+        body = request.body
+        if hasattr(body, 'read'):
+            chunks = iter(lambda: body.read(DEFAULT_BLOCK_SIZE), b'')
+        else:
+            chunks = body
+        spool, size = _spool(chunks, hasher, self.spool_size)
+        request.body = spool
+        request.headers.pop('Transfer-Encoding', None)
+        request.headers['Content-Length'] = str(size)
+
+        def close(response, **kw):
+            # The body has been sent once there is a response.
+            spool.close()
+
+        request.register_hook('response', close)
+
+    def _response_hook(self, request, sender):
+        def verify(response, **kw):
+            if response.request is not request:
+                # This follows a redirect; it was not signed by us.
+                return response
+            header = response.headers.get('Server-Authorization')
+            if header is None:
+                if 200 <= response.status_code < 300:
+                    raise MissingAuthorization(
+                        'response is missing Server-Authorization')
+                return response
+            _verify_content(response, sender, header, self.accept_kw)
+            return response
+        return verify
+
+
+def _verify_content(response, sender, header, accept_kw):
+    # Makes everything that reads the body, including response.content,
+    # hash it and verify the response at the end.
+    hasher = PayloadHasher(sender.credentials['algorithm'],
+                           response.headers.get('Content-Type', ''))
+    verified = []
+    iter_content = response.iter_content
+
+    def verifying_iter_content(chunk_size=1, decode_unicode=False):
+        chunks = verified_chunks(iter_content(chunk_size=chunk_size))
+        if decode_unicode:
+            chunks = stream_decode_response_unicode(chunks, response)
+        return chunks
+
+    def verified_chunks(chunks):
+        for chunk in chunks:
+            if not verified:
+                hasher.update(chunk)
+            yield chunk
+        if not verified:
+            sender.accept_response(header, content_type=hasher.content_type,
+                                   content_hash=hasher, **accept_kw)
+            verified.append(True)
+
+    response.iter_content = verifying_iter_content
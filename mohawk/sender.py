@@ -1,14 +1,25 @@
 import logging
+import sys
+
+import six
+from six.moves.urllib.parse import urlparse
 
 from .base import (default_ts_skew_in_seconds,
                    HawkAuthority,
+                   RequestTarget,
                    Resource,
-                   EmptyValue)
+                   EmptyValue,
+                   split_url)
+from .instrument import start_timer
 from .util import (calculate_mac,
+                   hmac_key_cache,
                    parse_authorization_header,
+                   prepare_header_val,
+                   random_string,
+                   utc_now,
                    validate_credentials)
 
-__all__ = ['Sender']
+__all__ = ['Sender', 'SenderSession']
 log = logging.getLogger(__name__)
 
 
@@ -20,8 +31,10 @@ class Sender(HawkAuthority):
                         and ``algorithm``. See :ref:`usage` for an example.
     :type credentials: dict
 
-    :param url: Absolute URL of the request.
-    :type url: str
+    :param url:
+        Absolute URL of the request,
+        or a :class:`mohawk.base.RequestTarget`.
+    :type url: str or :class:`mohawk.base.RequestTarget`
 
     :param method: Method of the request. E.G. POST, GET
     :type method: str
@@ -63,11 +76,33 @@ class Sender(HawkAuthority):
         See :ref:`nonce` for details.
     :type seen_nonce=None: callable
 
+    :param content_hash=None:
+        A :class:`mohawk.util.PayloadHasher` that hashed the request body
+        (or the result of its ``digest()`` method) to use instead of
+        ``content``.
+    :type content_hash=None: :class:`mohawk.util.PayloadHasher`
+
+    :param block_size=None:
+        Size of the blocks to read when hashing file-like request or
+        response content. If None, a size is chosen based on the type
+        of file.
+    :type block_size=None: int
+
     .. _`Hawk`: https://github.com/hueniverse/hawk
     """
     #: Value suitable for an ``Authorization`` header.
     request_header = None
 
+    @property
+    def request_header_bytes(self):
+        """
+        :attr:`request_header` as ASCII bytes, for frameworks that write
+        raw headers.
+        """
+        if self.request_header is None:
+            return None
+        return self.request_header.encode('ascii')
+
     def __init__(self, credentials,
                  url,
                  method,
@@ -79,12 +114,15 @@ class Sender(HawkAuthority):
                  app=None,
                  dlg=None,
                  seen_nonce=None,
+                 content_hash=None,
+                 block_size=None,
                  # For easier testing:
                  _timestamp=None):
 
         self.reconfigure(credentials)
         self.request_header = None
         self.seen_nonce = seen_nonce
+        self.block_size = block_size
 
         log.debug('generating request header')
         self.req_resource = Resource(url=url,
@@ -97,7 +135,9 @@ class Sender(HawkAuthority):
                                      content=content,
                                      always_hash_content=always_hash_content,
                                      timestamp=_timestamp,
-                                     content_type=content_type)
+                                     content_type=content_type,
+                                     content_hash=content_hash,
+                                     block_size=block_size)
 
         mac = calculate_mac('header', self.req_resource,
                             self.req_resource.gen_content_hash())
@@ -110,6 +150,8 @@ class Sender(HawkAuthority):
                         accept_untrusted_content=False,
                         localtime_offset_in_seconds=0,
                         timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                        content_hash=None,
+                        sink=None,
                         **auth_kw):
         """
         Accept a response to this request.
@@ -140,40 +182,190 @@ class Sender(HawkAuthority):
             :class:`mohawk.exc.TokenExpired` is raised.
         :type timestamp_skew_in_seconds=60: float
 
+        :param content_hash=None:
+            A :class:`mohawk.util.PayloadHasher` that hashed the response
+            body (or the result of its ``digest()`` method) to use instead
+            of ``content``. This lets you verify a streamed body.
+        :type content_hash=None: :class:`mohawk.util.PayloadHasher`
+
+        :param sink=None:
+            A :class:`mohawk.instrument.Sink` to report how long each stage
+            of the verification takes. See :ref:`instrumentation`.
+        :type sink=None: :class:`mohawk.instrument.Sink`
+
         .. _`Hawk`: https://github.com/hueniverse/hawk
         """
-        log.debug('accepting response {header}'
-                  .format(header=response_header))
-
-        parsed_header = parse_authorization_header(response_header)
-
-        resource = Resource(ext=parsed_header.get('ext', None),
-                            content=content,
-                            content_type=content_type,
-                            # The following response attributes are
-                            # in reference to the original request,
-                            # not to the reponse header:
-                            timestamp=self.req_resource.timestamp,
-                            nonce=self.req_resource.nonce,
-                            url=self.req_resource.url,
-                            method=self.req_resource.method,
-                            app=self.req_resource.app,
-                            dlg=self.req_resource.dlg,
-                            credentials=self.credentials,
-                            seen_nonce=self.seen_nonce)
-
-        self._authorize(
-            'response', parsed_header, resource,
-            # Per Node lib, a responder macs the *sender's* timestamp.
-            # It does not create its own timestamp.
-            # I suppose a slow response could time out here. Maybe only check
-            # mac failures, not timeouts?
-            their_timestamp=resource.timestamp,
-            timestamp_skew_in_seconds=timestamp_skew_in_seconds,
-            localtime_offset_in_seconds=localtime_offset_in_seconds,
-            accept_untrusted_content=accept_untrusted_content,
-            **auth_kw)
+        log.debug('accepting response %s', response_header)
+
+        timer = start_timer(sink, 'accept_response')
+        try:
+            if timer is not None:
+                timer.begin('parse')
+            parsed_header = parse_authorization_header(response_header)
+
+            if timer is not None:
+                timer.begin('resource')
+            resource = self._response_resource(parsed_header, content,
+                                               content_type, content_hash)
+
+            self._authorize(
+                'response', parsed_header, resource,
+                # Per Node lib, a responder macs the *sender's* timestamp.
+                # It does not create its own timestamp.
+                # I suppose a slow response could time out here. Maybe only
+                # check mac failures, not timeouts?
+                their_timestamp=resource.timestamp,
+                timestamp_skew_in_seconds=timestamp_skew_in_seconds,
+                localtime_offset_in_seconds=localtime_offset_in_seconds,
+                accept_untrusted_content=accept_untrusted_content,
+                timer=timer,
+                **auth_kw)
+        except Exception:
+            if timer is None:
+                raise
+            exc_info = sys.exc_info()
+            timer.done(exc_info[1])
+            six.reraise(*exc_info)
+
+        if timer is not None:
+            timer.done()
+
+    def _response_resource(self, parsed_header, content, content_type,
+                           content_hash):
+        # The response is signed with the attributes of the original
+        # request, apart from ext.
+        return self.req_resource.for_response(
+            ext=parsed_header.get('ext', None),
+            content=content,
+            content_type=content_type,
+            content_hash=content_hash,
+            credentials=self.credentials,
+            seen_nonce=self.seen_nonce)
 
     def reconfigure(self, credentials):
         validate_credentials(credentials)
         self.credentials = credentials
+
+
+class SenderSession(object):
+    """
+    Signs many requests with the same credentials.
+
+    This does the work that does not change from request to request,
+    such as validating the credentials and keying the HMAC, once instead
+    of for every :class:`mohawk.Sender`.
+    If all requests go to the same host, bind the session to it with
+    ``base_url`` so that request URLs do not need to be parsed either.
+
+    Create a new session when the credentials change.
+
+    :param credentials: Dict of credentials with keys ``id``, ``key``,
+                        and ``algorithm``. See :ref:`usage` for an example.
+    :type credentials: dict
+
+    :param base_url=None:
+        Scheme, host and optional port of all requests,
+        such as ``https://api.example.com:8443``.
+        If given, :meth:`request` takes a path and query string
+        instead of an absolute URL.
+    :type base_url=None: str
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :ref:`nonce` for details.
+    :type seen_nonce=None: callable
+
+    :param block_size=None:
+        Size of the blocks to read when hashing file-like content.
+        See :class:`mohawk.Sender`.
+    :type block_size=None: int
+    """
+
+    def __init__(self, credentials, base_url=None, seen_nonce=None,
+                 block_size=None):
+        validate_credentials(credentials)
+        credentials['id'] = prepare_header_val(credentials['id'])
+        self.credentials = credentials
+        self.seen_nonce = seen_nonce
+        self.block_size = block_size
+        self._hmac = hmac_key_cache.hmac_for(credentials)
+
+        self._origin = None
+        if base_url is not None:
+            name, host, port = split_url(base_url)
+            if name not in ('', '/'):
+                raise ValueError('base_url cannot have a path or query: {0}'
+                                 .format(base_url))
+            self._origin = (urlparse(base_url).scheme, host, port)
+
+    def request(self,
+                url,
+                method,
+                content=EmptyValue,
+                content_type=EmptyValue,
+                always_hash_content=True,
+                nonce=None,
+                ext=None,
+                app=None,
+                dlg=None,
+                content_hash=None,
+                # For easier testing:
+                _timestamp=None):
+        """
+        Signs a request.
+
+        Returns a :class:`mohawk.Sender` whose
+        :attr:`mohawk.Sender.request_header` is set, ready to
+        :meth:`mohawk.Sender.accept_response`.
+
+        :param url:
+            Absolute URL of the request,
+            or a :class:`mohawk.base.RequestTarget`.
+            If the session has a ``base_url``, this is the path and
+            query string instead, such as ``/foo?bar=1``, and anything
+            else raises a ValueError.
+        :type url: str
+
+        The other arguments have the same meaning as for
+        :class:`mohawk.Sender`.
+        """
+        if self._origin is None:
+            if isinstance(url, RequestTarget):
+                name, host, port = url.split()
+            else:
+                name, host, port = split_url(url)
+        else:
+            if (not isinstance(url, six.string_types) or
+                    not url.startswith('/')):
+                raise ValueError('url must be a path starting with / when '
+                                 'the session has a base_url: {0!r}'
+                                 .format(url))
+            name = url
+            scheme, host, port = self._origin
+            path, _, query = url.partition('?')
+            url = RequestTarget(scheme, host, port, path, query)
+
+        if nonce is None:
+            nonce = random_string(6)
+
+        resource = Resource.from_parts(
+            self.credentials, method.upper(), url, name, host, port,
+            str(_timestamp or utc_now()), nonce,
+            ext=ext, app=app, dlg=dlg,
+            content=content,
+            content_type=content_type,
+            content_hash=content_hash,
+            always_hash_content=always_hash_content,
+            seen_nonce=self.seen_nonce,
+            block_size=self.block_size)
+
+        mac = calculate_mac('header', resource, resource.gen_content_hash(),
+                            keyed_hmac=self._hmac.copy())
+
+        sender = Sender.__new__(Sender)
+        sender.credentials = self.credentials
+        sender.seen_nonce = self.seen_nonce
+        sender.block_size = self.block_size
+        sender.req_resource = resource
+        sender.request_header = sender._make_header(resource, mac)
+        return sender
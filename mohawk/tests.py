@@ -1,14 +1,35 @@
 import sys
 import warnings
-from unittest import TestCase
-from base64 import b64decode, urlsafe_b64encode
+from unittest import skipIf, TestCase
+from base64 import b64decode, b64encode, urlsafe_b64encode
+import bz2
+import gzip
+import hashlib
+import hmac
+import inspect
+import io
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import types
 
 import mock
 from nose.tools import eq_, raises
 import six
 
-from . import Receiver, Sender
-from .base import Resource, EmptyValue
+from . import Receiver, Sender, SenderSession
+from .base import (EmptyValue,
+                   HawkAuthority,
+                   RequestTarget,
+                   Resource,
+                   split_url)
 from .exc import (AlreadyProcessed,
                   BadHeaderValue,
                   CredentialsLookupError,
@@ -22,13 +43,57 @@ from .exc import (AlreadyProcessed,
                   MissingContent)
 from .util import (parse_authorization_header,
                    utc_now,
+                   calculate_mac,
                    calculate_payload_hash,
                    calculate_ts_mac,
-                   validate_credentials)
+                   HmacKeyCache,
+                   hmac_key_cache,
+                   PayloadHasher,
+                   normalize_string,
+                   prepare_header_val,
+                   strings_match,
+                   validate_credentials,
+                   _block_size_for,
+                   _normalize_bytes,
+                   _payload_hasher,
+                   _stat_file,
+                   _parse_attributes,
+                   _parse_attributes_re,
+                   _strings_match_loop,
+                   DEFAULT_BLOCK_SIZE,
+                   FILE_BLOCK_SIZE,
+                   MMAP_THRESHOLD)
+from .credentials import CachedCredentialsMap
+from .instrument import CallbackSink, CounterSink, LoggingSink
+from .metrics import MetricsRegistry
+from .wsgi import HawkMiddleware, _HashingInput, request_target
+from .nonce import MemoryNonceStore, MmapNonceStore, NonceStore
 from .bewit import (get_bewit,
                     check_bewit,
                     strip_bewit,
-                    parse_bewit)
+                    parse_bewit,
+                    bewit_urls,
+                    BewitResult,
+                    BewitVerifier)
+
+try:
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from .requests_auth import HawkAuth as RequestsHawkAuth
+except ImportError:
+    requests = None
+
+try:
+    import httpx
+    from .httpx_auth import HawkAuth as HTTPXHawkAuth, _replace_stream
+except ImportError:
+    httpx = None
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from .aio import AsyncReceiver, AsyncSender, EXECUTOR_THRESHOLD
+    from . import asgi
 
 
 # Ensure deprecation warnings are turned to exceptions
@@ -613,6 +678,24 @@ class TestReceiver(Base):
         header = parse_authorization_header(self.receiver.response_header)
         eq_(header['ext'], ext)
 
+    def test_accept_response_with_nonce_store(self):
+        self.receive(sender_kw=dict(seen_nonce=MemoryNonceStore()))
+        self.respond()
+
+    @raises(AlreadyProcessed)
+    def test_accept_response_replayed(self):
+        self.receive(sender_kw=dict(seen_nonce=MemoryNonceStore()))
+        header = self.respond()
+        self.sender.accept_response(header, content='', content_type='')
+
+    def test_accept_response_checks_request_nonce(self):
+        seen_nonce = mock.Mock(return_value=False)
+        self.receive(sender_kw=dict(seen_nonce=seen_nonce))
+        self.respond()
+        request = parse_authorization_header(self.sender.request_header)
+        seen_nonce.assert_called_once_with(self.credentials['id'],
+                                           request['nonce'], request['ts'])
+
     @raises(MacMismatch)
     def test_respond_with_wrong_app(self):
         self.receive(sender_kw=dict(app='TAMPERED-WITH', dlg='delegation'))
@@ -784,6 +867,486 @@ class TestReceiver(Base):
                      sender=wrong_sender)
 
 
+@skipIf(sys.version_info < (3, 5), 'asyncio support requires Python 3.5')
+class TestAsync(Base):
+
+    def setUp(self):
+        super(TestAsync, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.content = b'some content'
+        self.content_type = 'text/plain'
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def resolved(self, func):
+        # This creates awaitable lookups without the async keyword
+        # so that this module still compiles on Python 2.
+        def lookup(*args):
+            future = self.loop.create_future()
+            try:
+                future.set_result(func(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+        return lookup
+
+    def send(self, **kw):
+        kw.setdefault('content', self.content)
+        kw.setdefault('content_type', self.content_type)
+        return AsyncSender(self.credentials, self.url, 'POST', **kw)
+
+    def receive(self, sender, **kw):
+        kw.setdefault('content', self.content)
+        kw.setdefault('content_type', self.content_type)
+        kw.setdefault('seen_nonce', self.resolved(self.seen_nonce))
+        credentials_map = kw.pop('credentials_map',
+                                 self.resolved(self.credentials_map))
+        return self.wait(AsyncReceiver.accept(
+            credentials_map, kw.pop('header', sender.request_header),
+            self.url, 'POST', **kw))
+
+    @raises(TypeError)
+    def test_direct_construction_fails(self):
+        # Forgetting to await must not give an unverified receiver.
+        sender = self.send()
+        AsyncReceiver(self.credentials_map, sender.request_header,
+                      self.url, 'POST', content=self.content,
+                      content_type=self.content_type)
+
+    @raises(TypeError)
+    def test_verify_many_fails(self):
+        # It would call the lookups without awaiting them.
+        sender = self.send()
+        AsyncReceiver.verify_many(
+            self.resolved(self.credentials_map),
+            [(sender.request_header, self.url, 'POST', self.content,
+              self.content_type)])
+
+    def test_nonce_is_awaited(self):
+        with self.assertRaises(AlreadyProcessed):
+            self.receive(self.send(),
+                         seen_nonce=self.resolved(lambda *args: True))
+
+    def test_verified_once(self):
+        seen_nonce = mock.Mock(return_value=False)
+        receiver = self.receive(self.send(), seen_nonce=seen_nonce)
+        eq_(seen_nonce.call_count, 1)
+        assert not inspect.isawaitable(receiver)
+
+    def test_sink(self):
+        records = []
+        sink = CallbackSink(lambda *args: records.append(args[:2]))
+        sender = self.send()
+        receiver = self.receive(sender, sink=sink)
+        eq_(records, [('receiver', 'parse'),
+                      ('receiver', 'lookup'),
+                      ('receiver', 'resource'),
+                      ('receiver', 'mac'),
+                      ('receiver', 'hash'),
+                      ('receiver', 'nonce'),
+                      ('receiver', 'timestamp'),
+                      ('receiver', 'total')])
+
+    def test_sink_failure(self):
+        records = []
+        sink = CallbackSink(lambda *args: records.append(args))
+        sender = self.send()
+        with self.assertRaises(MacMismatch):
+            self.receive(sender, sink=sink,
+                         header=sender.request_header.replace('mac="',
+                                                              'mac="x'))
+        eq_(records[-1][1], 'total')
+        assert isinstance(records[-1][3], MacMismatch)
+
+    def test_send_and_receive(self):
+        sender = self.send()
+        receiver = self.receive(sender)
+        assert isinstance(receiver, AsyncReceiver)
+        eq_(receiver.resource.credentials, self.credentials)
+
+        header = self.wait(receiver.respond(content=b'response',
+                                            content_type='text/plain'))
+        eq_(receiver.response_header, header)
+        self.wait(sender.accept_response(
+            header, content=b'response', content_type='text/plain'))
+
+    def test_plain_callables(self):
+        self.receive(self.send(), credentials_map=self.credentials_map,
+                     seen_nonce=self.seen_nonce)
+
+    def test_accept_response_with_nonce_store(self):
+        store = MemoryNonceStore()
+        sender = self.send(seen_nonce=self.resolved(store))
+        receiver = self.receive(sender)
+        header = self.wait(receiver.respond(content=b'response',
+                                            content_type='text/plain'))
+        self.wait(sender.accept_response(
+            header, content=b'response', content_type='text/plain'))
+        with self.assertRaises(AlreadyProcessed):
+            self.wait(sender.accept_response(
+                header, content=b'response', content_type='text/plain'))
+
+    @raises(MissingAuthorization)
+    def test_missing_header(self):
+        self.receive(self.send(), header=None)
+
+    @raises(CredentialsLookupError)
+    def test_unknown_id(self):
+        def credentials_map(id):
+            raise LookupError(id)
+        self.receive(self.send(),
+                     credentials_map=self.resolved(credentials_map))
+
+    @raises(InvalidCredentials)
+    def test_invalid_credentials(self):
+        self.receive(self.send(),
+                     credentials_map=self.resolved(lambda id: {}))
+
+    @raises(AlreadyProcessed)
+    def test_replayed_request(self):
+        self.receive(self.send(),
+                     seen_nonce=self.resolved(lambda *args: True))
+
+    @raises(MacMismatch)
+    def test_mac_mismatch(self):
+        sender = self.send()
+        self.wait(AsyncReceiver.accept(self.credentials_map,
+                                       sender.request_header,
+                                       self.url + '&tampered', 'POST',
+                                       content=self.content,
+                                       content_type=self.content_type))
+
+    @raises(MisComputedContentHash)
+    def test_tampered_content(self):
+        self.receive(self.send(), content=b'tampered')
+
+    @raises(TokenExpired)
+    def test_expired(self):
+        self.receive(self.send(), localtime_offset_in_seconds=-600)
+
+    def test_nonce_not_checked_for_bad_content(self):
+        seen_nonce = mock.Mock(return_value=False)
+        with self.assertRaises(MisComputedContentHash):
+            self.receive(self.send(), content=b'tampered',
+                         seen_nonce=seen_nonce)
+        assert not seen_nonce.called
+
+    def hash_in_executor(self, content, received_content=None):
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(executor, 'submit',
+                               wraps=executor.submit) as submit:
+            self.receive(self.send(content=content),
+                         content=received_content or content,
+                         executor=executor)
+        return submit.called
+
+    def test_large_content_is_hashed_in_executor(self):
+        assert self.hash_in_executor(b'x' * EXECUTOR_THRESHOLD)
+
+    def test_file_content_is_hashed_in_executor(self):
+        assert self.hash_in_executor(six.BytesIO(b'x'), six.BytesIO(b'x'))
+
+    def test_small_content_is_hashed_inline(self):
+        assert not self.hash_in_executor(b'x')
+
+
+class TestSenderSession(Base):
+
+    def setUp(self):
+        super(TestSenderSession, self).setUp()
+        self.url = 'https://site.com:8443/foo?bar=1'
+
+    def sign(self, session, url, **kw):
+        kw.setdefault('content', 'some content')
+        kw.setdefault('content_type', 'text/plain')
+        return session.request(url, 'post', nonce='abc123',
+                               _timestamp=1356420407, **kw)
+
+    def expected_header(self, **kw):
+        kw.setdefault('content', 'some content')
+        kw.setdefault('content_type', 'text/plain')
+        return Sender(self.credentials, self.url, 'POST', nonce='abc123',
+                      _timestamp=1356420407, **kw).request_header
+
+    def test_same_header_as_sender(self):
+        session = SenderSession(self.credentials)
+        eq_(self.sign(session, self.url).request_header,
+            self.expected_header())
+        eq_(self.sign(session, self.url, ext='ext', app='app',
+                      dlg='dlg').request_header,
+            self.expected_header(ext='ext', app='app', dlg='dlg'))
+
+    def test_base_url(self):
+        session = SenderSession(self.credentials,
+                                base_url='https://site.com:8443')
+        eq_(self.sign(session, '/foo?bar=1').request_header,
+            self.expected_header())
+
+    def test_base_url_default_port(self):
+        session = SenderSession(self.credentials,
+                                base_url='https://site.com/')
+        sender = self.sign(session, '/foo')
+        self.url = 'https://site.com/foo'
+        eq_(sender.request_header, self.expected_header())
+        eq_(str(sender.req_resource.url), 'https://site.com:443/foo')
+
+    def test_base_url_needs_a_path(self):
+        session = SenderSession(self.credentials,
+                                base_url='https://site.com:8443')
+        for url in ('https://site.com:8443/foo?bar=1', 'foo', '',
+                    RequestTarget('https', 'site.com', 8443, '/foo')):
+            with self.assertRaises(ValueError):
+                self.sign(session, url)
+
+    def test_request_target(self):
+        session = SenderSession(self.credentials)
+        target = RequestTarget('https', 'site.com', 8443, '/foo', 'bar=1')
+        eq_(self.sign(session, target).request_header,
+            self.expected_header())
+
+    @raises(ValueError)
+    def test_base_url_with_path(self):
+        SenderSession(self.credentials, base_url='https://site.com/foo')
+
+    @raises(InvalidCredentials)
+    def test_invalid_credentials(self):
+        SenderSession({'id': 'some-id'})
+
+    @raises(BadHeaderValue)
+    def test_invalid_id(self):
+        SenderSession(dict(self.credentials, id='bad"id'))
+
+    def test_hmac_is_keyed_once(self):
+        session = SenderSession(self.credentials)
+        with mock.patch('mohawk.util.hmac_key_cache') as cache:
+            self.sign(session, self.url)
+            self.sign(session, self.url)
+        assert not cache.hmac_for.called
+
+    def test_send_receive_respond(self):
+        session = SenderSession(self.credentials,
+                                base_url='https://site.com:8443')
+        for i in range(2):
+            sender = session.request('/foo?bar=1', 'POST', content='body',
+                                     content_type='text/plain')
+            receiver = Receiver(self.credentials_map, sender.request_header,
+                                self.url, 'POST', content='body',
+                                content_type='text/plain',
+                                seen_nonce=self.seen_nonce)
+            receiver.respond(content='response', content_type='text/plain')
+            sender.accept_response(receiver.response_header,
+                                   content='response',
+                                   content_type='text/plain')
+
+    @raises(MacMismatch)
+    def test_tampered_response(self):
+        session = SenderSession(self.credentials)
+        sender = session.request(self.url, 'GET', content='',
+                                 content_type='')
+        receiver = Receiver(self.credentials_map, sender.request_header,
+                            self.url, 'GET', content='', content_type='',
+                            seen_nonce=self.seen_nonce)
+        receiver.respond(content='response', content_type='text/plain')
+        sender.accept_response(receiver.response_header.replace('mac="',
+                                                                'mac="x'),
+                               content='response', content_type='text/plain')
+
+
+class TestVerifyMany(Base):
+
+    def setUp(self):
+        super(TestVerifyMany, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.lookups = []
+
+    def credentials_map(self, id):
+        self.lookups.append(id)
+        return super(TestVerifyMany, self).credentials_map(id)
+
+    def request(self, method='GET', content='', content_type='',
+                credentials=None, **kw):
+        sender = Sender(credentials or self.credentials, self.url, method,
+                        content=content, content_type=content_type, **kw)
+        return (sender.request_header, self.url, method,
+                content, content_type)
+
+    def verify_many(self, requests, **kw):
+        kw.setdefault('seen_nonce', self.seen_nonce)
+        return Receiver.verify_many(self.credentials_map, requests, **kw)
+
+    def test_all_ok(self):
+        results = self.verify_many([
+            self.request(),
+            self.request(method='POST', content='foo=bar',
+                         content_type='application/x-www-form-urlencoded'),
+        ])
+        eq_(len(results), 2)
+        for receiver, exc in results:
+            eq_(exc, None)
+            assert isinstance(receiver, Receiver), receiver
+
+    def test_can_respond(self):
+        req = self.request()
+        [(receiver, exc)] = self.verify_many([req])
+        receiver.respond(content='', content_type='')
+        assert receiver.response_header.startswith('Hawk mac=')
+
+    def test_one_lookup_per_id(self):
+        self.verify_many([self.request() for i in range(5)])
+        eq_(self.lookups, [self.credentials['id']])
+
+    def test_failures_do_not_stop_the_batch(self):
+        header, url, method, content, content_type = self.request()
+        other_creds = self.credentials.copy()
+        other_creds['id'] = 'unknown-id'
+
+        results = self.verify_many([
+            (header, url, method, 'TAMPERED', content_type),
+            (None, url, method, content, content_type),
+            ('Hawk mac="somemac", unparseable', url, method, content,
+             content_type),
+            self.request(credentials=other_creds),
+            (header, 'http://TAMPERED.com/', method, content, content_type),
+            self.request(),
+        ])
+
+        eq_([type(exc) for receiver, exc in results],
+            [MisComputedContentHash,
+             MissingAuthorization,
+             BadHeaderValue,
+             CredentialsLookupError,
+             MacMismatch,
+             type(None)])
+        eq_([receiver is None for receiver, exc in results],
+            [True, True, True, True, True, False])
+
+    def test_replay_within_batch(self):
+        seen = set()
+
+        def seen_nonce(id, nonce, ts):
+            key = (id, nonce, ts)
+            if key in seen:
+                return True
+            seen.add(key)
+            return False
+
+        req = self.request()
+        results = self.verify_many([req, req], seen_nonce=seen_nonce)
+        eq_(results[0][1], None)
+        eq_(type(results[1][1]), AlreadyProcessed)
+
+    def test_invalid_credentials(self):
+        results = Receiver.verify_many(lambda id: {}, [self.request()])
+        eq_(type(results[0][1]), InvalidCredentials)
+
+    def test_options_apply_to_every_request(self):
+        req = self.request(_timestamp=utc_now() - 120)
+        [(receiver, exc)] = self.verify_many([req])
+        eq_(type(exc), TokenExpired)
+
+        [(receiver, exc)] = self.verify_many([req],
+                                             timestamp_skew_in_seconds=240)
+        eq_(exc, None)
+
+    def test_empty_batch(self):
+        eq_(self.verify_many([]), [])
+
+
+def legacy_make_header(resource, mac, additional_keys=None):
+    # This is how HawkAuthority._make_header() used to build headers.
+    keys = additional_keys
+    if not keys:
+        keys = ('id', 'ts', 'nonce', 'ext', 'app', 'dlg')
+    header = u'Hawk mac="{mac}"'.format(mac=prepare_header_val(mac))
+    if resource.content_hash:
+        header = u'{header}, hash="{hash}"'.format(
+            header=header, hash=prepare_header_val(resource.content_hash))
+    if 'id' in keys:
+        header = u'{header}, id="{id}"'.format(
+            header=header, id=prepare_header_val(resource.credentials['id']))
+    if 'ts' in keys:
+        header = u'{header}, ts="{ts}"'.format(
+            header=header, ts=prepare_header_val(resource.timestamp))
+    if 'nonce' in keys:
+        header = u'{header}, nonce="{nonce}"'.format(
+            header=header, nonce=prepare_header_val(resource.nonce))
+    for key in ('ext', 'app', 'dlg'):
+        if key in keys and getattr(resource, key):
+            header = u'{header}, {key}="{val}"'.format(
+                header=header, key=key,
+                val=prepare_header_val(getattr(resource, key)))
+    return header
+
+
+class TestMakeHeader(Base):
+
+    def resource(self, **kw):
+        kw.setdefault('url', 'https://site.com/foo?bar=1')
+        kw.setdefault('method', 'POST')
+        kw.setdefault('credentials', self.credentials)
+        kw.setdefault('content', 'some content')
+        kw.setdefault('content_type', 'text/plain')
+        resource = Resource(**kw)
+        resource.gen_content_hash()
+        return resource
+
+    def test_same_as_legacy_header(self):
+        authority = HawkAuthority()
+        for mac in (b'bWFjIQ==', u'bWFjIQ=='):
+            for content in ('some content', EmptyValue):
+                for extra in ({}, {'ext': 'some ext'},
+                              {'ext': 'e', 'app': 'a', 'dlg': 'd'},
+                              {'app': 'a'}, {'nonce': b'abc123'},
+                              {'timestamp': 1356420407},
+                              {'content_hash': 'precomputed='}):
+                    if 'content_hash' in extra:
+                        content = EmptyValue
+                    resource = self.resource(content=content,
+                                             always_hash_content=False,
+                                             **extra)
+                    for keys in (None, ['ext'], ['id', 'ts']):
+                        eq_(authority._make_header(resource, mac, keys),
+                            legacy_make_header(resource, mac, keys))
+
+    def test_values_are_checked_once(self):
+        resource = self.resource(ext='some ext', app='app', dlg='dlg')
+        authority = HawkAuthority()
+        with mock.patch('mohawk.base.prepare_header_val',
+                        wraps=prepare_header_val) as prepare:
+            header = authority._make_header(resource, b'bWFjIQ==')
+            eq_(authority._make_header(resource, b'bWFjIQ=='), header)
+        # Only ts, nonce, ext, app, and dlg need checking and only once.
+        eq_([c[0][0] for c in prepare.call_args_list],
+            [resource.timestamp, resource.nonce, 'some ext', 'app', 'dlg'])
+
+    @raises(BadHeaderValue)
+    def test_bad_ext(self):
+        HawkAuthority()._make_header(self.resource(ext='bad"ext'), b'mac')
+
+    @raises(BadHeaderValue)
+    def test_bad_precomputed_hash(self):
+        resource = self.resource(content=EmptyValue,
+                                 content_hash='bad"hash')
+        HawkAuthority()._make_header(resource, b'mac')
+
+    def test_header_bytes(self):
+        sender = Sender(self.credentials, 'https://site.com/', 'GET',
+                        content='', content_type='')
+        eq_(sender.request_header_bytes,
+            sender.request_header.encode('ascii'))
+        receiver = Receiver(self.credentials_map, sender.request_header,
+                            'https://site.com/', 'GET', content='',
+                            content_type='', seen_nonce=self.seen_nonce)
+        eq_(receiver.response_header_bytes, None)
+        receiver.respond(content='', content_type='')
+        eq_(receiver.response_header_bytes,
+            receiver.response_header.encode('ascii'))
+
+
 class TestSendAndReceive(Base):
 
     def test(self):
@@ -824,6 +1387,130 @@ class TestSendAndReceive(Base):
                                content_type=content_type)
 
 
+class TestResource(Base):
+
+    def resource(self, **kw):
+        kw.setdefault('url', 'https://site.com/foo?bar=1')
+        kw.setdefault('method', 'get')
+        kw.setdefault('credentials', self.credentials)
+        kw.setdefault('timestamp', 1356420407)
+        kw.setdefault('nonce', 'abc123')
+        return Resource(**kw)
+
+    def attrs(self, resource):
+        return dict((name, getattr(resource, name))
+                    for name in Resource.__slots__
+                    if hasattr(resource, name))
+
+    def test_slots(self):
+        resource = self.resource()
+        assert not hasattr(resource, '__dict__')
+        with self.assertRaises(AttributeError):
+            resource.misspelled = True
+
+    def test_attributes(self):
+        resource = self.resource()
+        eq_(resource.method, 'GET')
+        eq_(resource.name, '/foo?bar=1')
+        eq_(resource.host, 'site.com')
+        eq_(resource.port, '443')
+        eq_(resource.timestamp, '1356420407')
+
+    def test_from_parts(self):
+        resource = self.resource(content='x', content_type='text/plain',
+                                 ext='ext', app='app', dlg='dlg')
+        from_parts = Resource.from_parts(
+            self.credentials, 'GET', 'https://site.com/foo?bar=1',
+            '/foo?bar=1', 'site.com', '443', '1356420407', 'abc123',
+            ext='ext', app='app', dlg='dlg',
+            content='x', content_type='text/plain')
+        eq_(self.attrs(from_parts), self.attrs(resource))
+
+    @raises(ValueError)
+    def test_from_parts_with_content_and_content_hash(self):
+        Resource.from_parts(
+            self.credentials, 'GET', 'https://site.com/', '/', 'site.com',
+            '443', '1356420407', 'abc123', content='x', content_hash='hash')
+
+    def test_for_response(self):
+        request = self.resource(app='app', dlg='dlg', ext='request ext',
+                                block_size=10)
+        response = request.for_response(content='x',
+                                        content_type='text/plain',
+                                        ext='response ext')
+        eq_(self.attrs(response),
+            self.attrs(self.resource(app='app', dlg='dlg',
+                                     ext='response ext', block_size=10,
+                                     content='x',
+                                     content_type='text/plain')))
+
+    def test_split_url(self):
+        eq_(split_url('http://site.com/foo'), ('/foo', 'site.com', '80'))
+        eq_(split_url('https://site.com'), ('', 'site.com', '443'))
+        eq_(split_url('https://site.com:8443/?a=b'),
+            ('/?a=b', 'site.com', '8443'))
+        eq_(split_url('ftp://site.com/foo'), ('/foo', 'site.com', 'None'))
+
+
+class TestRequestTarget(Base):
+
+    urls = [
+        ('http://site.com/foo', RequestTarget('http', 'site.com',
+                                              path='/foo')),
+        ('https://Site.COM', RequestTarget('https', 'Site.COM')),
+        ('HTTPS://site.com/', RequestTarget('HTTPS', 'site.com', path='/')),
+        ('https://site.com:8443/foo?a=b&c=d',
+         RequestTarget('https', 'site.com', 8443, '/foo', 'a=b&c=d')),
+        ('http://site.com:80/?a', RequestTarget('http', 'site.com', '80',
+                                                '/', 'a')),
+        ('ftp://site.com/foo', RequestTarget('ftp', 'site.com',
+                                             path='/foo')),
+        ('http://[::1]:8000/x', RequestTarget('http', '[::1]', 8000, '/x')),
+        ('https://[2001:DB8::1]/', RequestTarget('https', '[2001:DB8::1]',
+                                                 path='/')),
+    ]
+
+    def test_split_like_url(self):
+        for url, target in self.urls:
+            eq_(target.split(), split_url(url))
+
+    def test_str(self):
+        eq_(str(RequestTarget('https', 'site.com', 8443, '/foo', 'a=b')),
+            'https://site.com:8443/foo?a=b')
+        eq_(str(RequestTarget('http', 'site.com')), 'http://site.com')
+
+    def test_send_and_receive(self):
+        for url, target in self.urls:
+            for send_url, receive_url in ((url, target), (target, url)):
+                sender = Sender(self.credentials, send_url, 'GET',
+                                content='', content_type='')
+                Receiver(self.credentials_map, sender.request_header,
+                         receive_url, 'GET', content='', content_type='',
+                         seen_nonce=self.seen_nonce)
+
+    def test_check_bewit(self):
+        resource = Resource(url='https://site.com/foo?a=1', method='GET',
+                            credentials=self.credentials,
+                            timestamp=utc_now() + 60, nonce='')
+        bewit = get_bewit(resource)
+        eq_(self.check(RequestTarget('https', 'site.com', path='/foo',
+                                     query='a=1&bewit=' + bewit)), True)
+
+        for query in ('bewit={0}', 'bewit={0}&a=1', 'a=1&bewit={0}&b=2'):
+            query = query.format(bewit)
+            target = RequestTarget('https', 'site.com', path='/foo',
+                                   query=query)
+            # The outcome must be the same as for the URL.
+            eq_(self.check(target),
+                self.check('https://site.com/foo?' + query))
+
+    def check(self, url):
+        try:
+            return check_bewit(url, credential_lookup=self.credentials_map)
+        except HawkFail:
+            return sys.exc_info()[0]
+
+
 class TestBewit(Base):
 
     # Test cases copied from
@@ -1021,6 +1708,251 @@ class TestBewit(Base):
         check_bewit(url, credential_lookup=credential_lookup, now=1356420407 + 10)
 
 
+
+class TestBewitVerifier(Base):
+
+    def setUp(self):
+        super(TestBewitVerifier, self).setUp()
+        self.lookup = mock.Mock(side_effect=self.credentials_map)
+        self.verifier = BewitVerifier(self.lookup)
+
+    def bewit_url(self, url='https://site.com/foo?a=1', expiration=None,
+                  ext=None):
+        if expiration is None:
+            expiration = utc_now() + 60
+        resource = Resource(url=url, method='GET',
+                            credentials=self.credentials,
+                            timestamp=expiration, nonce='', ext=ext)
+        separator = '&' if '?' in url else '?'
+        return url + separator + 'bewit=' + get_bewit(resource)
+
+    def outcomes(self, url, now=None):
+        outcomes = []
+        for check in (lambda: check_bewit(url, self.credentials_map,
+                                          now=now),
+                      lambda: self.verifier.verify(url, now=now)):
+            try:
+                outcomes.append(bool(check()))
+            except HawkFail:
+                outcomes.append(sys.exc_info()[0])
+        return outcomes
+
+    def test_verify(self):
+        url = self.bewit_url(expiration=1356420407 + 300, ext='xandyandz')
+        result = self.verifier.verify(url, now=1356420407)
+        eq_(result, BewitResult(id=self.credentials['id'],
+                                expiration=1356420707, ext='xandyandz',
+                                credentials=self.credentials,
+                                url='https://site.com/foo?a=1'))
+
+    def test_hawk_test_vector(self):
+        # The bewit with ext from TestBewit.
+        bewit = urlsafe_b64encode(
+            b'123456\\1356420707\\'
+            b'kscxwNR2tJpP1T1zDLNPbB5UiKIU9tOSJXTUdG7X9h8=\\xandyandz')
+        url = ('https://example.com/somewhere/over/the/rainbow?bewit=' +
+               bewit.decode('ascii'))
+        credentials = {'id': '123456', 'key': '2983d45yun89q',
+                       'algorithm': 'sha256'}
+        verifier = BewitVerifier(lambda id: credentials)
+        eq_(verifier.verify(url, now=1356420407 + 10).ext, 'xandyandz')
+
+    def test_same_as_check_bewit(self):
+        valid = self.bewit_url('https://Site.COM:8443/foo/bar?a=1&b=2')
+        urls = [
+            valid,
+            self.bewit_url('http://site.com'),
+            self.bewit_url('http://site.com/', ext='some ext'),
+            self.bewit_url(expiration=utc_now() - 1),
+            valid.replace('/foo/bar', '/foo/baz'),
+            valid.replace(':8443', ':8444'),
+            self.bewit_url().replace('?a=1', '?a=2'),
+            'https://site.com/foo?a=1',
+            'https://site.com/foo?bewit=' +
+            urlsafe_b64encode(b'unknown\\9999999999\\mac\\')
+            .decode('ascii'),
+        ]
+        for url in urls:
+            eq_(*self.outcomes(url))
+            # Expiry is checked first so only the acceptance is the same.
+            check, verify = self.outcomes(url, now=utc_now() + 3600)
+            eq_(check is True, verify is True)
+
+        for query in ('a=1&bewit={0}', 'bewit={0}&a=1'):
+            query = query.format(self.bewit_url().split('bewit=')[1])
+            target = RequestTarget('https', 'site.com', path='/foo',
+                                   query=query)
+            eq_(*self.outcomes(target))
+
+    def test_result_url_of_request_target(self):
+        bewit = self.bewit_url().split('bewit=')[1]
+        target = RequestTarget('https', 'site.com', path='/foo',
+                               query='a=1&bewit=' + bewit)
+        eq_(str(self.verifier.verify(target).url),
+            'https://site.com/foo?a=1')
+
+    @raises(TokenExpired)
+    def test_expired_before_lookup(self):
+        url = self.bewit_url(expiration=utc_now() - 1)
+        try:
+            self.verifier.verify(url.replace('?a=1', '?a=2'))
+        finally:
+            eq_(self.lookup.call_count, 0)
+
+    @raises(InvalidBewit)
+    def test_expiration_not_a_number(self):
+        bewit = urlsafe_b64encode(b'my-hawk-id\\soon\\mac\\')
+        self.verifier.verify('https://site.com/?bewit=' +
+                             bewit.decode('ascii'))
+
+    @raises(CredentialsLookupError)
+    def test_unknown_credentials(self):
+        self.verifier = BewitVerifier({}.__getitem__)
+        self.verifier.verify(self.bewit_url())
+
+    @raises(MacMismatch)
+    def test_tampered_url(self):
+        self.verifier.verify(self.bewit_url().replace('?a=1', '?a=2'))
+
+    def test_keyed_hmac_is_reused(self):
+        with mock.patch('mohawk.bewit.hmac_key_cache') as cache:
+            cache.hmac_for.side_effect = hmac_key_cache.hmac_for
+            for i in range(3):
+                self.verifier.verify(self.bewit_url())
+            eq_(cache.hmac_for.call_count, 1)
+
+            # A new key replaces the old one.
+            self.credentials['key'] = 'a new key'
+            self.verifier.verify(self.bewit_url())
+            eq_(cache.hmac_for.call_count, 2)
+
+    @raises(MacMismatch)
+    def test_changed_key(self):
+        url = self.bewit_url()
+        self.verifier.verify(url)
+        self.lookup.side_effect = lambda id: dict(self.credentials,
+                                                  key='a new key')
+        self.verifier.verify(url)
+
+    def test_max_cache_size(self):
+        self.verifier = BewitVerifier(self.lookup, max_cache_size=2)
+        for path in ('/a', '/b', '/c'):
+            self.verifier.verify(self.bewit_url('https://site.com' + path))
+            assert len(self.verifier._urls) <= 2
+
+    def test_stages(self):
+        records = []
+        sink = CallbackSink(
+            lambda op, stage, seconds, error: records.append(
+                (op, stage, error.__class__ if error else None)))
+        self.verifier = BewitVerifier(self.lookup, sink=sink)
+        self.verifier.verify(self.bewit_url())
+        eq_(records, [('check_bewit', 'parse', None),
+                      ('check_bewit', 'timestamp', None),
+                      ('check_bewit', 'lookup', None),
+                      ('check_bewit', 'mac', None),
+                      ('check_bewit', 'total', None)])
+
+        del records[:]
+        with self.assertRaises(TokenExpired):
+            self.verifier.verify(self.bewit_url(expiration=utc_now() - 1))
+        eq_(records[-2:], [('check_bewit', 'timestamp', TokenExpired),
+                           ('check_bewit', 'total', TokenExpired)])
+
+
+
+class TestBewitURLs(Base):
+
+    def setUp(self):
+        super(TestBewitURLs, self).setUp()
+        self.expiration = utc_now() + 60
+        self.urls = ['https://site.com/foo',
+                     'https://Site.COM:8443/foo/bar?a=1&b=2',
+                     'http://site.com',
+                     'http://site.com/?',
+                     'https://site.com/some%20file.zip']
+
+    def get_bewit(self, url, ext=None):
+        return get_bewit(Resource(url=url, method='GET',
+                                  credentials=self.credentials,
+                                  timestamp=self.expiration,
+                                  nonce='', ext=ext))
+
+    def test_same_as_get_bewit(self):
+        for ext in (None, 'some ext'):
+            signed = list(bewit_urls(self.credentials, self.expiration,
+                                     self.urls, ext=ext))
+            eq_(len(signed), len(self.urls))
+            for url, signed_url in zip(self.urls, signed):
+                raw_bewit, stripped_url = strip_bewit(signed_url)
+                eq_(stripped_url, url)
+                eq_(raw_bewit, self.get_bewit(url, ext=ext))
+                eq_(check_bewit(signed_url, self.credentials_map), True)
+
+    def test_separator(self):
+        eq_([strip_bewit(url)[1] for url in bewit_urls(
+            self.credentials, self.expiration,
+            ['https://site.com/foo', 'https://site.com/foo?a=1'])],
+            ['https://site.com/foo', 'https://site.com/foo?a=1'])
+        url, = bewit_urls(self.credentials, self.expiration,
+                          ['https://site.com/foo?a=1'])
+        assert url.startswith('https://site.com/foo?a=1&bewit='), url
+
+    def test_fragment(self):
+        url, = bewit_urls(self.credentials, self.expiration,
+                          ['https://site.com/foo?a=1#part-2'])
+        assert url.endswith('#part-2'), url
+        # Browsers do not send the fragment.
+        url = url.split('#')[0]
+        eq_(check_bewit(url, self.credentials_map), True)
+        eq_(strip_bewit(url)[0], self.get_bewit('https://site.com/foo?a=1'))
+
+    def test_streams(self):
+        urls = ('https://site.com/{0}'.format(i) for i in itertools.count())
+        signed = bewit_urls(self.credentials, self.expiration, urls)
+        eq_(check_bewit(next(signed), self.credentials_map), True)
+        eq_(strip_bewit(next(signed))[1], 'https://site.com/1')
+
+    def test_key_is_prepared_once(self):
+        with mock.patch('mohawk.bewit.hmac_key_cache') as cache:
+            cache.hmac_for.side_effect = hmac_key_cache.hmac_for
+            list(bewit_urls(self.credentials, self.expiration, self.urls))
+            eq_(cache.hmac_for.call_count, 1)
+
+    @raises(BadHeaderValue)
+    def test_invalid_ext(self):
+        # This is raised before any URL is read.
+        bewit_urls(self.credentials, self.expiration, None,
+                   ext='xand\\yandz')
+
+    @raises(BadHeaderValue)
+    def test_invalid_id(self):
+        self.credentials['id'] = 'bad"id'
+        bewit_urls(self.credentials, self.expiration, None)
+
+    @skipIf(sys.version_info < (3, 5), 'requires concurrent.futures')
+    def test_process_pool(self):
+        urls = ['https://site.com/{0}'.format(i) for i in range(25)]
+        with ProcessPoolExecutor(2) as executor:
+            eq_(list(bewit_urls(self.credentials, self.expiration, urls,
+                                executor=executor, chunk_size=4)),
+                list(bewit_urls(self.credentials, self.expiration, urls)))
+
+    @skipIf(sys.version_info < (3, 5), 'requires concurrent.futures')
+    def test_executor_streams(self):
+        urls = ('https://site.com/{0}'.format(i) for i in itertools.count())
+        with ThreadPoolExecutor(2) as executor:
+            with mock.patch('mohawk.bewit._MAX_PENDING_CHUNKS', 3):
+                signed = bewit_urls(self.credentials, self.expiration, urls,
+                                    executor=executor, chunk_size=2)
+                eq_([strip_bewit(url)[1]
+                     for url in itertools.islice(signed, 5)],
+                    ['https://site.com/{0}'.format(i) for i in range(5)])
+                signed.close()
+        # Only the chunks that were in the executor were read.
+        eq_(next(urls), 'https://site.com/10')
+
+
 class TestPayloadHash(Base):
     def test_hash_file_read_blocks(self):
         payload = six.BytesIO(b"\x00\xffhello world\xff\x00")
@@ -1028,3 +1960,2576 @@ class TestPayloadHash(Base):
         payload.seek(0)
         h2 = calculate_payload_hash(payload, 'sha256', 'application/json', block_size=1024)
         self.assertEqual(h1, h2)
+
+    def test_default_block_size(self):
+        content = b"\x00\xffhello world\xff\x00" * 10000
+        eq_(calculate_payload_hash(six.BytesIO(content), 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_read_without_readinto(self):
+        content = b"\x00\xffhello world\xff\x00"
+        payload = mock.Mock(spec=['read'])
+        payload.read.side_effect = [content[:4], content[4:], b'']
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain', block_size=4),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+        payload.read.assert_called_with(4)
+
+    def test_readinto_short_reads(self):
+        content = b"\x00\xffhello world\xff\x00"
+        # six.BytesIO has no readinto() on Python 2.
+        payload = io.BytesIO(content)
+        with mock.patch.object(payload, 'read') as read:
+            h = calculate_payload_hash(payload, 'sha256', 'text/plain', block_size=3)
+        assert not read.called
+        eq_(h, calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_block_size_for_stream(self):
+        eq_(_block_size_for(_stat_file(six.BytesIO(b''))), DEFAULT_BLOCK_SIZE)
+
+    def test_block_size_for_file(self):
+        with tempfile.TemporaryFile() as payload:
+            payload.write(b'x' * (FILE_BLOCK_SIZE + 1))
+            payload.flush()
+            eq_(_block_size_for(_stat_file(payload)), FILE_BLOCK_SIZE)
+
+    def test_block_size_for_small_file(self):
+        with tempfile.TemporaryFile() as payload:
+            payload.write(b'x')
+            payload.flush()
+            assert _block_size_for(_stat_file(payload)) < FILE_BLOCK_SIZE
+
+    def test_block_size_for_pipe(self):
+        r, w = os.pipe()
+        try:
+            with os.fdopen(r, 'rb') as payload:
+                assert _block_size_for(_stat_file(payload)) >= DEFAULT_BLOCK_SIZE
+        finally:
+            os.close(w)
+
+    def test_block_size_for_closed_file(self):
+        payload = tempfile.TemporaryFile()
+        payload.close()
+        eq_(_block_size_for(_stat_file(payload)), DEFAULT_BLOCK_SIZE)
+
+    def big_file(self, content):
+        payload = tempfile.TemporaryFile()
+        self.addCleanup(payload.close)
+        payload.write(content)
+        payload.flush()
+        payload.seek(0)
+        return payload
+
+    def big_content(self):
+        return os.urandom(MMAP_THRESHOLD) * 2
+
+    def test_hash_mmap(self):
+        content = self.big_content()
+        payload = self.big_file(content)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+        # The position is restored so the body can still be read.
+        eq_(payload.tell(), 0)
+        eq_(payload.read(), content)
+
+    def test_hash_mmap_from_position(self):
+        content = self.big_content()
+        payload = self.big_file(b'header' + content)
+        payload.seek(6)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain',
+                                   block_size=1000),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+        eq_(payload.tell(), 6)
+
+    def test_hash_mmap_unflushed_writes(self):
+        content = self.big_content()
+        payload = tempfile.TemporaryFile()
+        self.addCleanup(payload.close)
+        payload.write(content[:10])
+        payload.flush()
+        payload.write(content[10:])
+        payload.seek(0)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_hash_mmap_failure_falls_back(self):
+        content = self.big_content()
+        payload = self.big_file(content)
+        with mock.patch('mohawk.util.mmap.mmap') as mmap:
+            mmap.side_effect = EnvironmentError('no mmap for you')
+            eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+                calculate_payload_hash(content, 'sha256', 'text/plain'))
+        assert mmap.called
+        eq_(payload.tell(), 0)
+
+    def test_small_file_is_read(self):
+        payload = self.big_file(b'small')
+        with mock.patch('mohawk.util.mmap.mmap') as mmap:
+            calculate_payload_hash(payload, 'sha256', 'text/plain')
+        assert not mmap.called
+        # The position is restored whatever the size of the file.
+        eq_(payload.tell(), 0)
+        eq_(payload.read(), b'small')
+
+    def test_position_is_restored(self):
+        for content in (b'small', self.big_content()):
+            for payload in (io.BytesIO(b'header' + content),
+                            io.BufferedReader(io.BytesIO(b'header' +
+                                                         content)),
+                            self.big_file(b'header' + content)):
+                payload.seek(6)
+                eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+                    calculate_payload_hash(content, 'sha256', 'text/plain'))
+                eq_(payload.tell(), 6)
+
+    def test_text_file_is_read(self):
+        content = u'Ivan Kristi\u0107\n' * MMAP_THRESHOLD
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'body.txt')
+        with io.open(path, 'w', encoding='utf8') as f:
+            f.write(content)
+        with io.open(path, 'r', encoding='utf8') as payload:
+            with mock.patch('mohawk.util.mmap.mmap') as mmap:
+                h = calculate_payload_hash(payload, 'sha256', 'text/plain')
+                eq_(payload.read(), content)
+        assert not mmap.called
+        eq_(h, calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_hash_mmap_is_used(self):
+        content = self.big_content()
+        payload = self.big_file(content)
+        with mock.patch('mohawk.util.mmap.mmap', wraps=mmap.mmap) as mapped:
+            calculate_payload_hash(payload, 'sha256', 'text/plain')
+        assert mapped.called
+
+    def compressed_file(self, opener, content):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'body')
+        f = opener(path, 'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        # Random bytes don't compress so the file is large enough to map.
+        assert os.path.getsize(path) >= MMAP_THRESHOLD
+        payload = opener(path, 'rb')
+        self.addCleanup(payload.close)
+        return payload
+
+    def test_gzip_file_is_read(self):
+        content = self.big_content()
+        payload = self.compressed_file(gzip.GzipFile, content)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_bz2_file_is_read(self):
+        content = self.big_content()
+        payload = self.compressed_file(bz2.BZ2File, content)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_named_temporary_file(self):
+        content = self.big_content()
+        payload = tempfile.NamedTemporaryFile()
+        self.addCleanup(payload.close)
+        payload.write(content)
+        payload.seek(0)
+        with mock.patch('mohawk.util.mmap.mmap', wraps=mmap.mmap) as mapped:
+            eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+                calculate_payload_hash(content, 'sha256', 'text/plain'))
+        assert mapped.called
+        eq_(payload.tell(), 0)
+
+    def test_pipe_is_read(self):
+        content = self.big_content()
+        r, w = os.pipe()
+
+        def write():
+            with os.fdopen(w, 'wb') as f:
+                f.write(content)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        with os.fdopen(r, 'rb') as payload:
+            h = calculate_payload_hash(payload, 'sha256', 'text/plain')
+        writer.join()
+        eq_(h, calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_spooled_file_stays_in_memory(self):
+        content = self.big_content()
+        payload = tempfile.SpooledTemporaryFile(max_size=len(content) * 2)
+        self.addCleanup(payload.close)
+        payload.write(content)
+        payload.seek(0)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+        assert not payload._rolled
+
+    def test_rolled_over_spooled_file(self):
+        content = self.big_content()
+        payload = tempfile.SpooledTemporaryFile(max_size=10)
+        self.addCleanup(payload.close)
+        payload.write(content)
+        payload.seek(0)
+        eq_(calculate_payload_hash(payload, 'sha256', 'text/plain'),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+        eq_(payload.tell(), 0)
+
+    def test_sender_and_receiver_block_size(self):
+        content = b"\x00\xffhello world\xff\x00"
+        url = 'http://site.com/upload'
+        with mock.patch('mohawk.base._payload_hasher',
+                        wraps=_payload_hasher) as calc:
+            sender = Sender(self.credentials, url, 'POST',
+                            content=six.BytesIO(content),
+                            content_type='text/plain', block_size=3)
+            receiver = Receiver(self.credentials_map, sender.request_header,
+                                url, 'POST', content=six.BytesIO(content),
+                                content_type='text/plain', block_size=5,
+                                seen_nonce=self.seen_nonce)
+            receiver.respond(content=six.BytesIO(content),
+                             content_type='text/plain')
+            sender.accept_response(receiver.response_header,
+                                   content=six.BytesIO(content),
+                                   content_type='text/plain')
+        eq_([c[1]['block_size'] for c in calc.call_args_list],
+            [3, 5, 5, 3])
+
+
+class TestHeaderParser(Base):
+    # These tests compare the single pass header parser with the
+    # regex parser that it replaced.
+
+    tokens = ['id', 'ts', 'nonce', 'mac', 'hash', 'ext', 'app', 'dlg',
+              'tsm', 'error', 'unknown', 'x', '=', '="', '"', '",', '", ',
+              ' ', '  ', ',', ', ', '\t', '\n', '\\', 'value', '1234',
+              "!#$%&'()*+-./:;<>?@[]^_`{|}~", u'\u0107', 'a b', '=""']
+    values = ['', 'value', '1234', 'a b', 'a=b', 'a, b',
+              "!#$%&'()*+-./:;<>?@[]^_`{|}~", '\\', '\t', u'\u0107']
+
+    def parse_outcome(self, parse, header):
+        try:
+            return parse(header)
+        except HawkFail:
+            etype, exc, tb = sys.exc_info()
+            return (etype, exc.args)
+
+    def regex_parse(self, header):
+        scheme, attributes_string = header.split(' ', 1)
+        return _parse_attributes_re(attributes_string)
+
+    def random_attributes(self, rng):
+        if rng.random() < 0.5:
+            # Start with something well formed and then mangle it.
+            keys = rng.sample(['id', 'ts', 'nonce', 'mac', 'hash',
+                               'ext', 'app', 'dlg'], rng.randint(1, 8))
+            parts = [u'{0}="{1}"'.format(key, rng.choice(self.values))
+                     for key in keys]
+            attributes = rng.choice([', ', ',', ' , ']).join(parts)
+            for i in range(rng.randint(0, 2)):
+                pos = rng.randint(0, len(attributes))
+                attributes = (attributes[:pos] + rng.choice(self.tokens) +
+                              attributes[pos:])
+            return attributes
+        return u''.join(rng.choice(self.tokens)
+                        for i in range(rng.randint(0, 20)))
+
+    def test_differential_fuzz(self):
+        rng = random.Random(1234)
+        fast_path_hits = 0
+        for i in range(5000):
+            header = u'Hawk ' + self.random_attributes(rng)
+            expected = self.parse_outcome(self.regex_parse, header)
+            eq_(self.parse_outcome(parse_authorization_header, header),
+                expected, 'header: {0!r}'.format(header))
+
+            fast = _parse_attributes(header.split(' ', 1)[1])
+            if fast is not None:
+                fast_path_hits += 1
+                eq_(fast, expected, 'header: {0!r}'.format(header))
+
+        # Make sure that the fuzzer exercised the single pass parser.
+        assert fast_path_hits > 200, fast_path_hits
+
+    def test_sender_headers(self):
+        sender = Sender(self.credentials, 'http://site.com/', 'GET',
+                        content='', content_type='',
+                        ext='some ext', app='app', dlg='dlg')
+        parsed = parse_authorization_header(sender.request_header)
+        eq_(parsed, self.regex_parse(sender.request_header))
+        eq_(parsed['ext'], 'some ext')
+
+    def test_trailing_comma(self):
+        eq_(parse_authorization_header('Hawk id="one", '), {'id': 'one'})
+
+    def test_no_attributes(self):
+        eq_(parse_authorization_header('Hawk '), {})
+
+    def test_space_before_comma(self):
+        eq_(parse_authorization_header('Hawk id="one" , ts="1"'),
+            {'id': 'one', 'ts': '1'})
+
+    def test_tab_separator(self):
+        eq_(parse_authorization_header('Hawk id="one",\tts="1"'),
+            {'id': 'one', 'ts': '1'})
+
+    @raises(BadHeaderValue)
+    def test_missing_separator(self):
+        parse_authorization_header('Hawk id="one" ts="1"')
+
+    @raises(BadHeaderValue)
+    def test_unterminated_value(self):
+        parse_authorization_header('Hawk id="one", ts="1')
+
+    def test_unknown_key_message(self):
+        try:
+            parse_authorization_header('Hawk id="one", foo="1"')
+        except HawkFail as exc:
+            eq_(type(exc), HawkFail)
+            assert "Unknown Hawk key 'foo'" in str(exc), str(exc)
+        else:
+            self.fail('should raise')
+
+    def test_no_pformat_unless_debugging(self):
+        # Test runners such as nose's logcapture enable DEBUG globally.
+        with mock.patch('mohawk.util.log.isEnabledFor',
+                        return_value=False), \
+                mock.patch('mohawk.util.pprint.pformat') as pformat:
+            parse_authorization_header('Hawk id="one"')
+        assert not pformat.called
+
+
+class TestLogging(Base):
+
+    def setUp(self):
+        super(TestLogging, self).setUp()
+        self.url = 'http://site.com/foo?bar=1'
+        self.content = 'secret=' + 'x' * 1000
+        self.content_type = 'application/x-www-form-urlencoded'
+        self.logger = logging.getLogger('mohawk')
+        self.orig_level = self.logger.level
+        self.messages = []
+
+        class Handler(logging.Handler):
+            def emit(handler, record):
+                self.messages.append(record.getMessage())
+
+        self.handler = Handler()
+
+    def tearDown(self):
+        self.logger.setLevel(self.orig_level)
+        self.logger.removeHandler(self.handler)
+
+    def send_and_receive(self, receive_content=None):
+        sender = Sender(self.credentials, self.url, 'POST',
+                        content=self.content,
+                        content_type=self.content_type)
+        receiver = Receiver(self.credentials_map, sender.request_header,
+                            self.url, 'POST',
+                            content=receive_content or self.content,
+                            content_type=self.content_type,
+                            seen_nonce=self.seen_nonce)
+        receiver.respond(content=self.content,
+                         content_type=self.content_type)
+        sender.accept_response(receiver.response_header,
+                               content=self.content,
+                               content_type=self.content_type)
+
+    def test_no_formatting_above_debug(self):
+        self.logger.setLevel(logging.INFO)
+        with mock.patch('mohawk.util.pprint.pformat') as util_pformat:
+            with mock.patch('mohawk.base.pprint.pformat') as base_pformat:
+                self.send_and_receive()
+        assert not util_pformat.called
+        assert not base_pformat.called
+
+    def test_payloads_are_logged_when_debugging(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.send_and_receive()
+        assert any(self.content in msg for msg in self.messages)
+
+    def test_redact_payloads(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        with mock.patch('mohawk.util.redact_payloads_in_logs', True):
+            self.send_and_receive()
+            try:
+                self.send_and_receive(receive_content='TAMPERED')
+            except MisComputedContentHash:
+                pass
+            else:
+                self.fail('should raise')
+
+        assert self.messages
+        for msg in self.messages:
+            assert 'secret=' not in msg, msg
+            assert 'TAMPERED' not in msg, msg
+        assert any('<redacted payload of length 1007>' in msg
+                   for msg in self.messages)
+
+
+class TestInstrumentation(Base):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        self.url = 'https://site.com/foo?bar=1'
+        self.records = []
+        self.sink = CallbackSink(
+            lambda *args: self.records.append(args))
+
+    def stages(self):
+        return [(op, stage, error.__class__ if error else None)
+                for op, stage, seconds, error in self.records]
+
+    def send(self, **kw):
+        return Sender(self.credentials, self.url, 'POST',
+                      content='content', content_type='text/plain', **kw)
+
+    def receive(self, header, **kw):
+        kw.setdefault('seen_nonce', self.seen_nonce)
+        return Receiver(self.credentials_map, header, self.url, 'POST',
+                        content='content', content_type='text/plain',
+                        sink=self.sink, **kw)
+
+    def test_receiver_stages(self):
+        self.receive(self.send().request_header)
+        eq_(self.stages(), [('receiver', 'parse', None),
+                            ('receiver', 'lookup', None),
+                            ('receiver', 'resource', None),
+                            ('receiver', 'mac', None),
+                            ('receiver', 'hash', None),
+                            ('receiver', 'nonce', None),
+                            ('receiver', 'timestamp', None),
+                            ('receiver', 'total', None)])
+        for record in self.records:
+            assert record[2] >= 0, record
+
+    def test_total_covers_stages(self):
+        self.receive(self.send().request_header)
+        total = self.records[-1][2]
+        assert total >= sum(r[2] for r in self.records[:-1]) * 0.99
+
+    def test_receiver_failed_stage(self):
+        header = self.send().request_header.replace('mac="', 'mac="x')
+        with self.assertRaises(MacMismatch):
+            self.receive(header)
+        eq_(self.stages(), [('receiver', 'parse', None),
+                            ('receiver', 'lookup', None),
+                            ('receiver', 'resource', None),
+                            ('receiver', 'mac', MacMismatch),
+                            ('receiver', 'total', MacMismatch)])
+
+    def test_receiver_unknown_id(self):
+        self.credentials_map = mock.Mock(side_effect=LookupError)
+        with self.assertRaises(CredentialsLookupError):
+            self.receive(self.send().request_header)
+        eq_(self.stages()[-2:], [('receiver', 'lookup',
+                                  CredentialsLookupError),
+                                 ('receiver', 'total',
+                                  CredentialsLookupError)])
+
+    def test_receiver_missing_header(self):
+        with self.assertRaises(MissingAuthorization):
+            self.receive('')
+        eq_(self.stages(), [('receiver', 'parse', MissingAuthorization),
+                            ('receiver', 'total', MissingAuthorization)])
+
+    def test_receiver_replay(self):
+        with self.assertRaises(AlreadyProcessed):
+            self.receive(self.send().request_header,
+                         seen_nonce=lambda *args: True)
+        eq_(self.stages()[-2:], [('receiver', 'nonce', AlreadyProcessed),
+                                 ('receiver', 'total', AlreadyProcessed)])
+
+    def test_accept_response_stages(self):
+        sender = self.send()
+        receiver = self.receive(sender.request_header)
+        receiver.respond(content='response', content_type='text/plain')
+        del self.records[:]
+        sender.accept_response(receiver.response_header,
+                               content='response', content_type='text/plain',
+                               sink=self.sink)
+        eq_(self.stages(), [('accept_response', 'parse', None),
+                            ('accept_response', 'resource', None),
+                            ('accept_response', 'mac', None),
+                            ('accept_response', 'hash', None),
+                            ('accept_response', 'timestamp', None),
+                            ('accept_response', 'total', None)])
+
+    def test_accept_response_failure(self):
+        sender = self.send()
+        receiver = self.receive(sender.request_header)
+        receiver.respond(content='response', content_type='text/plain')
+        del self.records[:]
+        with self.assertRaises(MisComputedContentHash):
+            sender.accept_response(receiver.response_header,
+                                   content='TAMPERED',
+                                   content_type='text/plain',
+                                   sink=self.sink)
+        eq_(self.stages()[-1], ('accept_response', 'total',
+                                MisComputedContentHash))
+
+    def bewit_url(self, expiration):
+        res = Resource(url=self.url, method='GET',
+                       credentials=self.credentials,
+                       timestamp=expiration, nonce='')
+        return self.url + '&bewit=' + get_bewit(res)
+
+    def test_check_bewit_stages(self):
+        url = self.bewit_url(utc_now() + 60)
+        assert check_bewit(url, self.credentials_map, sink=self.sink)
+        eq_(self.stages(), [('check_bewit', 'parse', None),
+                            ('check_bewit', 'lookup', None),
+                            ('check_bewit', 'resource', None),
+                            ('check_bewit', 'mac', None),
+                            ('check_bewit', 'timestamp', None),
+                            ('check_bewit', 'total', None)])
+
+    def test_check_bewit_expired(self):
+        url = self.bewit_url(utc_now() - 60)
+        with self.assertRaises(TokenExpired):
+            check_bewit(url, self.credentials_map, sink=self.sink)
+        eq_(self.stages()[-2:], [('check_bewit', 'timestamp', TokenExpired),
+                                 ('check_bewit', 'total', TokenExpired)])
+
+    def test_no_sink_no_timer(self):
+        with mock.patch('mohawk.instrument._StageTimer') as timer:
+            sender = self.send()
+            Receiver(self.credentials_map, sender.request_header, self.url,
+                     'POST', content='content', content_type='text/plain',
+                     seen_nonce=self.seen_nonce)
+            check_bewit(self.bewit_url(utc_now() + 60), self.credentials_map)
+        assert not timer.called
+
+    def test_counter_sink(self):
+        client = mock.Mock()
+        self.sink = CounterSink(client, prefix='auth')
+        self.receive(self.send().request_header)
+        header = self.send().request_header.replace('mac="', 'mac="x')
+        with self.assertRaises(MacMismatch):
+            self.receive(header)
+
+        timings = [c[0][0] for c in client.timing.call_args_list]
+        assert 'auth.receiver.mac' in timings, timings
+        assert 'auth.receiver.total' in timings, timings
+        eq_([c[0][0] for c in client.incr.call_args_list],
+            ['auth.receiver.ok', 'auth.receiver.MacMismatch'])
+
+    def test_logging_sink(self):
+        logger = mock.Mock()
+        logger.isEnabledFor.return_value = True
+        self.sink = LoggingSink(logger=logger, level=logging.DEBUG)
+        header = self.send().request_header.replace('mac="', 'mac="x')
+        with self.assertRaises(MacMismatch):
+            self.receive(header)
+        args = logger.log.call_args[0]
+        eq_(args[0], logging.DEBUG)
+        message = args[1] % args[2:]
+        assert message.startswith('receiver total took'), message
+        assert message.endswith('and raised MacMismatch'), message
+
+    def test_logging_sink_disabled_level(self):
+        logger = mock.Mock()
+        logger.isEnabledFor.return_value = False
+        self.sink = LoggingSink(logger=logger)
+        self.receive(self.send().request_header)
+        assert not logger.log.called
+
+
+class TestMetricsRegistry(Base):
+
+    def setUp(self):
+        super(TestMetricsRegistry, self).setUp()
+        self.url = 'https://site.com/foo?bar=1'
+        self.registry = MetricsRegistry()
+
+    def metrics(self, registry=None):
+        values = {}
+        for line in (registry or self.registry).render().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                values[name] = float(value)
+        return values
+
+    def receive(self, header=None, content='content', **kw):
+        if header is None:
+            header = Sender(self.credentials, self.url, 'POST',
+                            content=content,
+                            content_type='text/plain').request_header
+        kw.setdefault('sink', self.registry)
+        return Receiver(self.credentials_map, header, self.url, 'POST',
+                        content=content, content_type='text/plain',
+                        seen_nonce=self.seen_nonce, **kw)
+
+    def test_outcomes(self):
+        self.receive()
+        self.receive()
+        with self.assertRaises(MacMismatch):
+            self.receive(header=Sender(
+                self.credentials, self.url, 'POST', content='content',
+                content_type='text/plain',
+            ).request_header.replace('mac="', 'mac="x'))
+        metrics = self.metrics()
+        eq_(metrics['mohawk_verifications_total'
+                    '{operation="receiver",outcome="ok"}'], 2)
+        eq_(metrics['mohawk_verifications_total'
+                    '{operation="receiver",outcome="MacMismatch"}'], 1)
+
+    def test_histograms(self):
+        self.receive()
+        metrics = self.metrics()
+        labels = '{operation="receiver",stage="total"'
+        eq_(metrics['mohawk_verification_stage_seconds_count' +
+                    labels + '}'], 1)
+        eq_(metrics['mohawk_verification_stage_seconds_bucket' +
+                    labels + ',le="+Inf"}'], 1)
+        assert metrics['mohawk_verification_stage_seconds_sum' +
+                       labels + '}'] > 0
+        assert ('mohawk_verification_stage_seconds_count'
+                '{operation="receiver",stage="mac"}') in metrics
+
+    def test_buckets(self):
+        registry = MetricsRegistry(buckets=(0.1, 0.01))
+        for seconds in (0.005, 0.01, 0.05, 5):
+            registry.record('receiver', 'mac', seconds)
+        metrics = self.metrics(registry)
+        prefix = ('mohawk_verification_stage_seconds_bucket'
+                  '{operation="receiver",stage="mac",le=')
+        eq_(metrics[prefix + '"0.01"}'], 2)
+        eq_(metrics[prefix + '"0.1"}'], 3)
+        eq_(metrics[prefix + '"+Inf"}'], 4)
+        self.assertAlmostEqual(
+            metrics['mohawk_verification_stage_seconds_sum'
+                    '{operation="receiver",stage="mac"}'], 5.065)
+
+    def test_payload_bytes(self):
+        self.receive(content='x' * 100)
+        self.receive(content=u'\u00e9')
+        eq_(self.metrics()['mohawk_payload_hashed_bytes_total'
+                           '{operation="receiver"}'], 102)
+
+    def test_file_payload_bytes(self):
+        with tempfile.TemporaryFile() as payload:
+            payload.write(b'some file content')
+            payload.seek(5)
+            sender = Sender(self.credentials, self.url, 'POST',
+                            content=b'file content',
+                            content_type='text/plain')
+            Receiver(self.credentials_map, sender.request_header, self.url,
+                     'POST', content=payload, content_type='text/plain',
+                     seen_nonce=self.seen_nonce, sink=self.registry)
+        eq_(self.metrics()['mohawk_payload_hashed_bytes_total'
+                           '{operation="receiver"}'], 12)
+
+    def test_stream_payload_bytes(self):
+        class Stream(object):
+            # A body that can only be read once, like a socket.
+            def __init__(self, content):
+                self.read = six.BytesIO(content).read
+
+        sender = Sender(self.credentials, self.url, 'POST',
+                        content=b'streamed', content_type='text/plain')
+        Receiver(self.credentials_map, sender.request_header, self.url,
+                 'POST', content=Stream(b'streamed'),
+                 content_type='text/plain', seen_nonce=self.seen_nonce,
+                 sink=self.registry)
+        eq_(self.metrics()['mohawk_payload_hashed_bytes_total'
+                           '{operation="receiver"}'], 8)
+
+    def test_default_sink(self):
+        res = Resource(url=self.url, method='GET',
+                       credentials=self.credentials,
+                       timestamp=utc_now() + 60, nonce='')
+        url = self.url + '&bewit=' + get_bewit(res)
+        with mock.patch('mohawk.instrument.default_sink', self.registry):
+            check_bewit(url, self.credentials_map)
+            self.receive(sink=None)
+        check_bewit(url, self.credentials_map)
+        metrics = self.metrics()
+        eq_(metrics['mohawk_verifications_total'
+                    '{operation="check_bewit",outcome="ok"}'], 1)
+        eq_(metrics['mohawk_verifications_total'
+                    '{operation="receiver",outcome="ok"}'], 1)
+
+    def test_explicit_sink_wins(self):
+        other = MetricsRegistry()
+        with mock.patch('mohawk.instrument.default_sink', other):
+            self.receive()
+        eq_(self.metrics(other), {})
+        eq_(self.metrics()['mohawk_verifications_total'
+                           '{operation="receiver",outcome="ok"}'], 1)
+
+    def test_threads(self):
+        def record():
+            for i in range(100):
+                self.registry.record('receiver', 'total', 0.001)
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        record()
+        key = ('mohawk_verifications_total'
+               '{operation="receiver",outcome="ok"}')
+        eq_(self.metrics()[key], 500)
+        # Shards of exited threads are folded together but still counted.
+        eq_(len(self.registry._shards), 1)
+        eq_(self.metrics()[key], 500)
+
+    def test_prefix_and_escaping(self):
+        registry = MetricsRegistry(prefix='api_hawk')
+        registry.record('a"b\\c\nd', 'total', 0.001)
+        output = registry.render()
+        assert ('api_hawk_verifications_total'
+                '{operation="a\\"b\\\\c\\nd",outcome="ok"} 1'
+                in output), output
+
+
+class TestWSGIMiddleware(Base):
+
+    def setUp(self):
+        super(TestWSGIMiddleware, self).setUp()
+        self.calls = []
+
+    def app(self, environ, start_response):
+        # Echoes the request body.
+        self.calls.append(environ)
+        body = environ['wsgi.input'].read()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'you sent: ', body]
+
+    def middleware(self, app=None, **kw):
+        kw.setdefault('seen_nonce', self.seen_nonce)
+        return HawkMiddleware(app or self.app, self.credentials_map, **kw)
+
+    def request(self, method='POST', path='/foo?bar=1', body=b'body',
+                content_type='text/plain', sent_body=None, **kw):
+        self.sender = Sender(self.credentials,
+                             'https://site.com' + path, method,
+                             content=body if sent_body is None else sent_body,
+                             content_type=content_type, **kw)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path.partition('?')[0],
+            'QUERY_STRING': path.partition('?')[2],
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '8000',
+            'HTTP_HOST': 'site.com',
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_AUTHORIZATION': self.sender.request_header,
+            'wsgi.url_scheme': 'https',
+            'wsgi.input': io.BytesIO(body),
+        }
+        return environ
+
+    def call(self, middleware, environ):
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append((status, dict(headers)))
+
+        result = middleware(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        status, headers = started[-1]
+        return status, headers, body
+
+    def test_post(self):
+        status, headers, body = self.call(self.middleware(), self.request())
+        eq_(status, '200 OK')
+        eq_(body, b'you sent: body')
+        self.sender.accept_response(headers['Server-Authorization'],
+                                    content=body,
+                                    content_type='text/plain')
+        eq_(self.calls[0]['mohawk.receiver'].resource.credentials,
+            self.credentials)
+
+    def test_get(self):
+        status, headers, body = self.call(
+            self.middleware(),
+            self.request(method='GET', body=b'', content_type=''))
+        eq_(status, '200 OK')
+
+    def test_tampered_body(self):
+        status, headers, body = self.call(
+            self.middleware(), self.request(body=b'TAMPERED',
+                                            sent_body=b'body'))
+        eq_(status, '401 Unauthorized')
+        eq_(body, b'Unauthorized')
+        assert 'Server-Authorization' not in headers
+
+    def test_tampered_body_error_is_swallowed(self):
+        def app(environ, start_response):
+            try:
+                environ['wsgi.input'].read()
+            except MisComputedContentHash:
+                pass
+            start_response('200 OK', [])
+            return [b'ok']
+
+        status, headers, body = self.call(
+            self.middleware(app), self.request(body=b'TAMPERED',
+                                               sent_body=b'body'))
+        eq_(status, '401 Unauthorized')
+
+    def test_last_read_raises(self):
+        reads = []
+
+        def app(environ, start_response):
+            reads.append(environ['wsgi.input'].read(4))
+            try:
+                environ['wsgi.input'].read(4)
+            except MisComputedContentHash:
+                reads.append('raised')
+            start_response('200 OK', [])
+            return [b'ok']
+
+        self.call(self.middleware(app),
+                  self.request(body=b'TAMPERED', sent_body=b'body....'))
+        eq_(reads, [b'TAMP', 'raised'])
+
+    def unread_app(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    def test_unread_body_is_verified(self):
+        status, headers, body = self.call(
+            self.middleware(self.unread_app),
+            self.request(body=b'TAMPERED', sent_body=b'body'))
+        eq_(status, '401 Unauthorized')
+
+    def test_unread_body(self):
+        status, headers, body = self.call(self.middleware(self.unread_app),
+                                          self.request())
+        eq_(status, '200 OK')
+
+    def test_readline(self):
+        def app(environ, start_response):
+            lines = list(environ['wsgi.input'])
+            start_response('200 OK', [])
+            return lines
+
+        status, headers, body = self.call(
+            self.middleware(app), self.request(body=b'one\ntwo\nthree'))
+        eq_(status, '200 OK')
+        eq_(body, b'one\ntwo\nthree')
+
+    def test_missing_header(self):
+        environ = self.request()
+        del environ['HTTP_AUTHORIZATION']
+        status, headers, body = self.call(self.middleware(), environ)
+        eq_(status, '401 Unauthorized')
+        eq_(headers['WWW-Authenticate'], 'Hawk')
+        eq_(self.calls, [])
+
+    def test_bad_mac(self):
+        environ = self.request()
+        environ['HTTP_AUTHORIZATION'] = environ['HTTP_AUTHORIZATION'].replace(
+            'mac="', 'mac="x')
+        status, headers, body = self.call(self.middleware(), environ)
+        eq_(status, '401 Unauthorized')
+        eq_(self.calls, [])
+
+    def test_wrong_url(self):
+        environ = self.request()
+        environ['PATH_INFO'] = '/other'
+        status, headers, body = self.call(self.middleware(), environ)
+        eq_(status, '401 Unauthorized')
+
+    def test_expired(self):
+        status, headers, body = self.call(
+            self.middleware(), self.request(_timestamp=utc_now() - 120))
+        eq_(status, '401 Unauthorized')
+        assert headers['WWW-Authenticate'].startswith('Hawk ts="'), headers
+
+    def test_body_without_hash(self):
+        environ = self.request(always_hash_content=False, content_type='',
+                               sent_body=EmptyValue)
+        status, headers, body = self.call(self.middleware(), environ)
+        eq_(status, '401 Unauthorized')
+
+    def test_accept_untrusted_content(self):
+        environ = self.request(always_hash_content=False, content_type='',
+                               sent_body=EmptyValue)
+        status, headers, body = self.call(
+            self.middleware(accept_untrusted_content=True), environ)
+        eq_(status, '200 OK')
+        eq_(body, b'you sent: body')
+
+    def test_bypass(self):
+        environ = self.request(path='/health')
+        del environ['HTTP_AUTHORIZATION']
+        status, headers, body = self.call(
+            self.middleware(bypass=['/health']), environ)
+        eq_(status, '200 OK')
+        assert 'Server-Authorization' not in headers
+
+        environ = self.request(method='OPTIONS')
+        del environ['HTTP_AUTHORIZATION']
+        status, headers, body = self.call(
+            self.middleware(bypass=[
+                lambda environ: environ['REQUEST_METHOD'] == 'OPTIONS']),
+            environ)
+        eq_(status, '200 OK')
+
+    def test_unsigned_streaming_response(self):
+        def app(environ, start_response):
+            def generate():
+                start_response('200 OK', [('Content-Type', 'text/plain')])
+                yield b'you sent: '
+                yield environ['wsgi.input'].read()
+            return generate()
+
+        status, headers, body = self.call(self.middleware(
+            app, sign_responses=False, verify_body_first=True),
+            self.request())
+        eq_(status, '200 OK')
+        eq_(body, b'you sent: body')
+        assert 'Server-Authorization' not in headers
+
+    def test_unread_body_is_discarded(self):
+        def app(environ, start_response):
+            def generate():
+                start_response('200 OK', [('Content-Type', 'text/plain')])
+                yield b'you sent: '
+                yield environ['wsgi.input'].read()
+            return generate()
+
+        status, headers, body = self.call(self.middleware(
+            app, sign_responses=False), self.request())
+        eq_(status, '200 OK')
+        eq_(body, b'you sent: ')
+
+    def test_finish_discards_the_rest(self):
+        content = b'x' * (DEFAULT_BLOCK_SIZE * 3)
+        body = _HashingInput(io.BytesIO(content),
+                             PayloadHasher('sha256', 'text/plain'),
+                             calculate_payload_hash(content, 'sha256',
+                                                    'text/plain'),
+                             len(content))
+        eq_(body.read(10), content[:10])
+        assert body.finish()
+        eq_(body.read(), b'')
+
+    def test_finish_keeps_the_rest(self):
+        content = b'x' * (DEFAULT_BLOCK_SIZE * 3)
+        body = _HashingInput(io.BytesIO(content),
+                             PayloadHasher('sha256', 'text/plain'),
+                             calculate_payload_hash(content, 'sha256',
+                                                    'text/plain'),
+                             len(content))
+        eq_(body.read(10), content[:10])
+        assert body.finish(keep=True)
+        eq_(body.read(), content[10:])
+
+    def test_unread_tampered_body(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return [b'ok']
+
+        for sign_responses in (True, False):
+            status, headers, body = self.call(
+                self.middleware(app, sign_responses=sign_responses),
+                self.request(body=b'TAMPERED', sent_body=b'body'))
+            eq_(status, '401 Unauthorized')
+
+    def test_signed_generator_response(self):
+        def app(environ, start_response):
+            write = start_response('200 OK',
+                                   [('Content-Type', 'text/plain')])
+            write(b'written ')
+            return (chunk for chunk in [b'one ', b'two'])
+
+        status, headers, body = self.call(self.middleware(app),
+                                          self.request())
+        eq_(body, b'written one two')
+        self.sender.accept_response(headers['Server-Authorization'],
+                                    content=body,
+                                    content_type='text/plain')
+
+    def test_result_is_closed(self):
+        closed = []
+
+        class Result(list):
+            def close(self):
+                closed.append(True)
+
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return Result([b'ok'])
+
+        self.call(self.middleware(app), self.request())
+        eq_(closed, [True])
+        self.call(self.middleware(app, sign_responses=False), self.request())
+        eq_(closed, [True, True])
+
+    def test_app_signs_response(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Server-Authorization', 'custom')])
+            return [b'ok']
+
+        status, headers, body = self.call(self.middleware(app),
+                                          self.request())
+        eq_(headers['Server-Authorization'], 'custom')
+
+    def test_verify_body_first(self):
+        status, headers, body = self.call(
+            self.middleware(verify_body_first=True),
+            self.request(body=b'TAMPERED', sent_body=b'body'))
+        eq_(status, '401 Unauthorized')
+        eq_(self.calls, [])
+
+        status, headers, body = self.call(
+            self.middleware(verify_body_first=True), self.request())
+        eq_(status, '200 OK')
+        eq_(body, b'you sent: body')
+
+    def test_request_target(self):
+        environ = {'wsgi.url_scheme': 'http',
+                   'HTTP_HOST': 'Site.com:8080',
+                   'SCRIPT_NAME': '/app',
+                   'PATH_INFO': '/some path',
+                   'QUERY_STRING': 'a=1'}
+        eq_(request_target(environ).split(),
+            ('/app/some%20path?a=1', 'site.com', '8080'))
+
+    def test_request_target_raw_uri(self):
+        environ = {'wsgi.url_scheme': 'https',
+                   'HTTP_HOST': 'site.com',
+                   'PATH_INFO': '/a/b',
+                   'RAW_URI': '/a%2Fb?x=1'}
+        eq_(request_target(environ).split(),
+            ('/a%2Fb?x=1', 'site.com', '443'))
+
+    def test_request_target_ipv6(self):
+        environ = {'wsgi.url_scheme': 'http',
+                   'HTTP_HOST': '[::1]:8080',
+                   'PATH_INFO': '/'}
+        eq_(request_target(environ).split(), ('/', '::1', '8080'))
+
+    def test_request_target_server_name(self):
+        environ = {'wsgi.url_scheme': 'http',
+                   'SERVER_NAME': 'site.com',
+                   'SERVER_PORT': '8000',
+                   'PATH_INFO': ''}
+        eq_(request_target(environ).split(), ('/', 'site.com', '8000'))
+
+
+def driven(loop, generator_function):
+    # Turns a generator that yields awaitables into an ASGI app
+    # without the async keyword so that this module still compiles
+    # on Python 2. Yielding a generator runs it like "yield from".
+    def app(scope, receive, send):
+        done = loop.create_future()
+        stack = [generator_function(scope, receive, send)]
+
+        def step(value=None, exc=None):
+            while True:
+                try:
+                    if exc is not None:
+                        awaitable = stack[-1].throw(exc)
+                    else:
+                        awaitable = stack[-1].send(value)
+                except StopIteration:
+                    stack.pop()
+                    value = exc = None
+                except Exception as error:
+                    stack.pop()
+                    value, exc = None, error
+                else:
+                    if not isinstance(awaitable, types.GeneratorType):
+                        break
+                    stack.append(awaitable)
+                    value = exc = None
+                    continue
+                if not stack:
+                    if exc is not None:
+                        done.set_exception(exc)
+                    else:
+                        done.set_result(None)
+                    return
+            asyncio.ensure_future(
+                awaitable, loop=loop).add_done_callback(resume)
+
+        def resume(future):
+            try:
+                value = future.result()
+            except Exception as exc:
+                step(exc=exc)
+            else:
+                step(value)
+
+        step()
+        return done
+    return app
+
+
+@skipIf(sys.version_info < (3, 5), 'asyncio support requires Python 3.5')
+class TestASGIMiddleware(Base):
+
+    def setUp(self):
+        super(TestASGIMiddleware, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.calls = []
+        self.received = []
+
+    def wait(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def driven(self, generator_function):
+        return driven(self.loop, generator_function)
+
+    def read_body(self, receive):
+        body = []
+        while True:
+            message = yield receive()
+            self.received.append(message)
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        self.body = b''.join(body)
+
+    def respond(self, send, body, headers=()):
+        yield send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain')] +
+                    list(headers)})
+        yield send({'type': 'http.response.body', 'body': b'you sent: ',
+                    'more_body': True})
+        yield send({'type': 'http.response.body', 'body': body})
+
+    def echo(self, scope, receive, send):
+        self.calls.append(scope)
+        yield self.read_body(receive)
+        yield self.respond(send, self.body)
+
+    def ignore_body(self, scope, receive, send):
+        self.calls.append(scope)
+        yield self.respond(send, b'nothing')
+
+    def catch_body_error(self, scope, receive, send):
+        self.calls.append(scope)
+        try:
+            yield self.read_body(receive)
+        except MisComputedContentHash:
+            pass
+        yield self.respond(send, b'ignored error')
+
+    def middleware(self, app=None, **kw):
+        kw.setdefault('seen_nonce', self.seen_nonce)
+        return asgi.HawkMiddleware(self.driven(app or self.echo),
+                                   self.credentials_map, **kw)
+
+    def request(self, method='POST', path='/foo?bar=1', body=b'body',
+                content_type='text/plain', sent_body=None, chunk_size=None,
+                **kw):
+        self.sender = Sender(self.credentials,
+                             'https://site.com' + path, method,
+                             content=body if sent_body is None else sent_body,
+                             content_type=content_type, **kw)
+        scope = {
+            'type': 'http',
+            'method': method,
+            'scheme': 'https',
+            'path': path.partition('?')[0],
+            'query_string': path.partition('?')[2].encode('latin-1'),
+            'root_path': '',
+            'server': ('localhost', 8000),
+            'headers': [
+                (b'host', b'site.com'),
+                (b'content-type', content_type.encode('latin-1')),
+                (b'content-length', str(len(body)).encode('latin-1')),
+                (b'authorization',
+                 self.sender.request_header.encode('latin-1')),
+            ],
+        }
+        chunk_size = chunk_size or max(1, len(body))
+        messages = [{'type': 'http.request',
+                     'body': body[i:i + chunk_size],
+                     'more_body': i + chunk_size < len(body)}
+                    for i in range(0, max(1, len(body)), chunk_size)]
+        return scope, messages
+
+    def call(self, middleware, scope, messages=()):
+        incoming = list(messages)
+        self.sent = []
+
+        def receive():
+            future = self.loop.create_future()
+            future.set_result(incoming.pop(0) if incoming
+                              else {'type': 'http.disconnect'})
+            return future
+
+        def send(message):
+            self.sent.append(message)
+            future = self.loop.create_future()
+            future.set_result(None)
+            return future
+
+        self.wait(middleware(scope, receive, send))
+        start = self.sent[0]
+        eq_(start['type'], 'http.response.start')
+        headers = dict((name.decode('latin-1').lower(),
+                        value.decode('latin-1'))
+                       for name, value in start['headers'])
+        body = b''.join(message.get('body', b'')
+                        for message in self.sent[1:])
+        return start['status'], headers, body
+
+    def test_post(self):
+        status, headers, body = self.call(self.middleware(), *self.request())
+        eq_(status, 200)
+        eq_(body, b'you sent: body')
+        self.sender.accept_response(headers['server-authorization'],
+                                    content=body,
+                                    content_type='text/plain')
+        eq_(self.calls[0]['mohawk.receiver'].resource.credentials,
+            self.credentials)
+
+    def test_response_is_sent_in_order(self):
+        self.call(self.middleware(), *self.request())
+        eq_([message['type'] for message in self.sent],
+            ['http.response.start',
+             'http.response.body',
+             'http.response.body'])
+        eq_([message.get('more_body', False) for message in self.sent[1:]],
+            [True, False])
+
+    def test_get(self):
+        status, headers, body = self.call(
+            self.middleware(),
+            *self.request(method='GET', body=b'', content_type=''))
+        eq_(status, 200)
+        self.sender.accept_response(headers['server-authorization'],
+                                    content=body,
+                                    content_type='text/plain')
+
+    def test_chunked_body(self):
+        status, headers, body = self.call(
+            self.middleware(),
+            *self.request(body=b'x' * 100, chunk_size=7))
+        eq_(status, 200)
+        eq_(body, b'you sent: ' + b'x' * 100)
+        eq_(len(self.received), 15)
+
+    def test_tampered_body(self):
+        status, headers, body = self.call(
+            self.middleware(),
+            *self.request(body=b'tampered body', sent_body=b'original body',
+                          chunk_size=5))
+        eq_(status, 401)
+        eq_(headers['www-authenticate'], 'Hawk')
+        eq_(body, b'Unauthorized')
+        # The application never received the last chunk.
+        eq_(len(self.received), 2)
+        assert all(message['more_body'] for message in self.received)
+
+    def test_tampered_body_error_is_caught(self):
+        status, headers, body = self.call(
+            self.middleware(self.catch_body_error),
+            *self.request(body=b'tampered', sent_body=b'original'))
+        eq_(status, 401)
+        eq_(len(self.sent), 2)
+
+    def test_unread_body(self):
+        status, headers, body = self.call(
+            self.middleware(self.ignore_body), *self.request())
+        eq_(status, 200)
+        self.sender.accept_response(headers['server-authorization'],
+                                    content=body,
+                                    content_type='text/plain')
+
+    def test_unread_tampered_body(self):
+        status, headers, body = self.call(
+            self.middleware(self.ignore_body),
+            *self.request(body=b'tampered', sent_body=b'original'))
+        eq_(status, 401)
+        eq_(len(self.sent), 2)
+
+    def test_unread_tampered_body_unsigned(self):
+        status, headers, body = self.call(
+            self.middleware(self.ignore_body, sign_responses=False),
+            *self.request(body=b'tampered', sent_body=b'original'))
+        eq_(status, 401)
+
+    def test_unread_body_is_discarded(self):
+        def app(scope, receive, send):
+            yield send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/plain')]})
+            yield self.read_body(receive)
+            yield send({'type': 'http.response.body', 'body': self.body})
+
+        for sign_responses in (True, False):
+            self.received = []
+            status, headers, body = self.call(
+                self.middleware(app, sign_responses=sign_responses),
+                *self.request(body=b'x' * 100, chunk_size=10))
+            eq_(status, 200)
+            eq_(body, b'')
+            eq_(self.received, [{'type': 'http.request', 'body': b'',
+                                 'more_body': False}])
+
+    def test_verify_body_first(self):
+        status, headers, body = self.call(
+            self.middleware(verify_body_first=True),
+            *self.request(body=b'x' * 100, chunk_size=10))
+        eq_(status, 200)
+        eq_(body, b'you sent: ' + b'x' * 100)
+        eq_(len(self.received), 10)
+
+    def test_verify_body_first_tampered(self):
+        status, headers, body = self.call(
+            self.middleware(verify_body_first=True),
+            *self.request(body=b'tampered', sent_body=b'original'))
+        eq_(status, 401)
+        eq_(self.calls, [])
+
+    def test_disconnect_before_end_of_body(self):
+        scope, messages = self.request(body=b'x' * 10, chunk_size=5)
+        status, headers, body = self.call(
+            self.middleware(verify_body_first=True), scope, messages[:1])
+        eq_(status, 401)
+        eq_(self.calls, [])
+
+    def test_missing_header(self):
+        scope, messages = self.request()
+        scope['headers'] = [header for header in scope['headers']
+                            if header[0] != b'authorization']
+        status, headers, body = self.call(self.middleware(), scope, messages)
+        eq_(status, 401)
+        eq_(headers['www-authenticate'], 'Hawk')
+        eq_(self.calls, [])
+
+    def test_mac_mismatch(self):
+        scope, messages = self.request()
+        scope['path'] = '/tampered'
+        status, headers, body = self.call(self.middleware(), scope, messages)
+        eq_(status, 401)
+
+    def test_body_without_hash(self):
+        scope, messages = self.request(always_hash_content=False,
+                                       content_type='', sent_body=EmptyValue)
+        status, headers, body = self.call(self.middleware(), scope, messages)
+        eq_(status, 401)
+
+    def test_accept_untrusted_content(self):
+        scope, messages = self.request(always_hash_content=False,
+                                       content_type='', sent_body=EmptyValue)
+        status, headers, body = self.call(
+            self.middleware(accept_untrusted_content=True), scope, messages)
+        eq_(status, 200)
+        eq_(body, b'you sent: body')
+
+    def resolved(self, func):
+        def lookup(*args):
+            future = self.loop.create_future()
+            try:
+                future.set_result(func(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+        return lookup
+
+    def test_awaitable_lookups(self):
+        seen_nonce = mock.Mock(return_value=False)
+        middleware = asgi.HawkMiddleware(
+            self.driven(self.echo), self.resolved(self.credentials_map),
+            seen_nonce=self.resolved(seen_nonce))
+        status, headers, body = self.call(middleware, *self.request())
+        eq_(status, 200)
+        assert seen_nonce.called
+
+    def test_replayed_request(self):
+        status, headers, body = self.call(
+            self.middleware(seen_nonce=self.resolved(lambda *args: True)),
+            *self.request())
+        eq_(status, 401)
+        eq_(self.calls, [])
+
+    def test_unknown_id(self):
+        def credentials_map(id):
+            raise LookupError(id)
+        middleware = asgi.HawkMiddleware(self.driven(self.echo),
+                                         self.resolved(credentials_map))
+        status, headers, body = self.call(middleware, *self.request())
+        eq_(status, 401)
+
+    def test_unsigned_responses(self):
+        status, headers, body = self.call(
+            self.middleware(sign_responses=False), *self.request())
+        eq_(status, 200)
+        eq_(body, b'you sent: body')
+        assert 'server-authorization' not in headers
+
+    def test_application_signature_is_kept(self):
+        def app(scope, receive, send):
+            return self.respond(send, b'mine',
+                                [(b'Server-Authorization', b'Hawk mine')])
+        status, headers, body = self.call(self.middleware(app),
+                                          *self.request())
+        eq_(headers['server-authorization'], 'Hawk mine')
+
+    def test_application_error(self):
+        def app(scope, receive, send):
+            yield receive()
+            raise RuntimeError('oops')
+        with self.assertRaises(RuntimeError):
+            self.call(self.middleware(app), *self.request())
+        eq_(self.sent, [])
+
+    def test_bypass_prefix(self):
+        scope, messages = self.request(path='/health')
+        scope['headers'] = []
+        status, headers, body = self.call(
+            self.middleware(bypass=['/health']), scope, messages)
+        eq_(status, 200)
+        assert 'mohawk.receiver' not in self.calls[0]
+
+    def test_bypass_callable(self):
+        scope, messages = self.request()
+        scope['headers'] = []
+        status, headers, body = self.call(
+            self.middleware(bypass=[lambda scope: scope['method'] == 'POST']),
+            scope, messages)
+        eq_(status, 200)
+
+    def test_other_scopes(self):
+        scope = {'type': 'lifespan'}
+        app = mock.Mock(return_value=self.resolved(lambda: None)())
+        self.wait(asgi.HawkMiddleware(app, self.credentials_map)(
+            scope, None, None))
+        app.assert_called_with(scope, None, None)
+
+    def test_sink(self):
+        records = []
+        sink = CallbackSink(lambda *args: records.append(args[1]))
+        self.call(self.middleware(sink=sink), *self.request())
+        eq_(records[-1], 'total')
+
+    def hashed_in_executor(self, body, **kw):
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(executor, 'submit',
+                               wraps=executor.submit) as submit:
+            status, headers, body = self.call(
+                self.middleware(executor=executor),
+                *self.request(body=body, **kw))
+        eq_(status, 200)
+        return submit.call_count
+
+    def test_large_chunks_are_hashed_in_executor(self):
+        # One request chunk and one response chunk.
+        eq_(self.hashed_in_executor(b'x' * EXECUTOR_THRESHOLD), 2)
+
+    def test_small_chunks_are_hashed_inline(self):
+        eq_(self.hashed_in_executor(b'x' * EXECUTOR_THRESHOLD,
+                                    chunk_size=1024), 1)
+
+    def test_request_target(self):
+        scope = {'scheme': 'https',
+                 'headers': [(b'host', b'Site.com:8080')],
+                 'root_path': '/app',
+                 'path': '/some path',
+                 'query_string': b'a=1'}
+        eq_(asgi.request_target(scope).split(),
+            ('/app/some%20path?a=1', 'site.com', '8080'))
+
+    def test_request_target_raw_path(self):
+        scope = {'scheme': 'https',
+                 'headers': [(b'host', b'site.com')],
+                 'path': '/a/b',
+                 'raw_path': b'/a%2Fb',
+                 'query_string': b'x=1'}
+        eq_(asgi.request_target(scope).split(),
+            ('/a%2Fb?x=1', 'site.com', '443'))
+
+    def test_request_target_ipv6(self):
+        scope = {'scheme': 'http',
+                 'headers': [(b'host', b'[::1]:8080')],
+                 'path': '/'}
+        eq_(asgi.request_target(scope).split(), ('/', '::1', '8080'))
+
+    def test_request_target_server(self):
+        scope = {'headers': [], 'server': ('site.com', 8000), 'path': ''}
+        eq_(asgi.request_target(scope).split(), ('/', 'site.com', '8000'))
+
+
+class WSGIAdapter(object):
+    # A requests transport adapter that calls a WSGI application.
+
+    def __init__(self, app, tamper=None):
+        self.app = app
+        self.tamper = tamper
+        self.bodies = []
+
+    def send(self, request, **kw):
+        url = six.moves.urllib.parse.urlparse(request.url)
+        body = request.body
+        if body is None:
+            body = b''
+        elif hasattr(body, 'read'):
+            body = body.read()
+        elif not isinstance(body, six.binary_type):
+            body = b''.join(body)
+        self.bodies.append(body)
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'HTTP_HOST': url.netloc,
+            'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_AUTHORIZATION': request.headers.get('Authorization'),
+            'wsgi.url_scheme': url.scheme,
+            'wsgi.input': io.BytesIO(body),
+        }
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append((status, headers))
+
+        result = self.app(environ, start_response)
+        content = b''.join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        if self.tamper is not None:
+            content = self.tamper(content)
+
+        status, headers = started[-1]
+        response = requests.Response()
+        response.status_code = int(status.split()[0])
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = io.BytesIO(content)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@skipIf(requests is None, 'requests is not installed')
+class TestRequestsAuth(Base):
+
+    def setUp(self):
+        super(TestRequestsAuth, self).setUp()
+        self.url = 'https://site.com/foo?bar=1'
+
+    def app(self, environ, start_response):
+        body = environ['wsgi.input'].read()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'you sent: ', body]
+
+    def session(self, app=None, tamper=None, sign_responses=True, **kw):
+        server = HawkMiddleware(app or self.app, self.credentials_map,
+                                seen_nonce=self.seen_nonce,
+                                sign_responses=sign_responses)
+        self.adapter = WSGIAdapter(server, tamper=tamper)
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        session.auth = RequestsHawkAuth(self.credentials, **kw)
+        return session
+
+    def test_get(self):
+        response = self.session().get(self.url)
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: ')
+
+    def test_post(self):
+        response = self.session().post(
+            self.url, data=b'body', headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: body')
+
+    def test_text_body_is_sent_as_utf8(self):
+        response = self.session().post(
+            self.url, data=u'\u00e9t\u00e9',
+            headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(self.adapter.bodies, [u'\u00e9t\u00e9'.encode('utf8')])
+
+    def test_form_body(self):
+        response = self.session().post(self.url, data={'a': '1'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: a=1')
+
+    def test_generator_body_is_spooled(self):
+        def body():
+            yield b'a' * 10
+            yield b'b' * 10
+
+        with mock.patch('mohawk.util.tempfile.SpooledTemporaryFile',
+                        wraps=tempfile.SpooledTemporaryFile) as spooled:
+            response = self.session(spool_size=15).post(
+                self.url, data=body(),
+                headers={'Content-Type': 'text/plain'})
+        spooled.assert_called_with(max_size=15)
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: ' + b'a' * 10 + b'b' * 10)
+
+    def test_spooled_body_is_closed(self):
+        response = self.session().post(
+            self.url, data=(chunk for chunk in [b'a', b'b']),
+            headers={'Content-Type': 'text/plain'})
+        eq_(response.content, b'you sent: ab')
+        assert response.request.body.closed
+
+    def test_spooled_body_headers(self):
+        auth = RequestsHawkAuth(self.credentials)
+        request = requests.Request(
+            'POST', self.url, data=(chunk for chunk in [b'a', b'b'])).prepare()
+        eq_(request.headers['Transfer-Encoding'], 'chunked')
+        auth(request)
+        # The body is never sent so no response hook closes it.
+        self.addCleanup(request.body.close)
+        assert 'Transfer-Encoding' not in request.headers
+        eq_(request.headers['Content-Length'], '2')
+        eq_(request.body.read(), b'ab')
+
+    def test_file_body_is_rewound(self):
+        body = io.BytesIO(b'skipped:file body')
+        body.seek(8)
+        response = self.session().post(
+            self.url, data=body, headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: file body')
+
+    def test_tampered_response(self):
+        with self.assertRaises(MisComputedContentHash):
+            self.session(tamper=lambda content: content + b'!').get(self.url)
+
+    def test_tampered_streamed_response(self):
+        response = self.session(
+            tamper=lambda content: content + b'!').get(self.url, stream=True)
+        chunks = response.iter_content(4)
+        eq_(next(chunks), b'you ')
+        with self.assertRaises(MisComputedContentHash):
+            list(chunks)
+
+    def test_streamed_text_response(self):
+        response = self.session().get(self.url, stream=True)
+        response.encoding = 'utf8'
+        eq_(u''.join(response.iter_content(4, decode_unicode=True)),
+            u'you sent: ')
+
+    def test_unsigned_response(self):
+        with self.assertRaises(MissingAuthorization):
+            self.session(sign_responses=False).get(self.url)
+
+    def test_unsigned_error_response(self):
+        def app(environ, start_response):
+            start_response('404 Not Found', [])
+            return [b'']
+        response = self.session(app=app).get(self.url)
+        eq_(response.status_code, 404)
+
+    def test_rejected_request(self):
+        self.credentials_map = mock.Mock(side_effect=LookupError)
+        response = self.session().get(self.url)
+        eq_(response.status_code, 401)
+
+    def test_verify_responses_off(self):
+        response = self.session(sign_responses=False,
+                                verify_responses=False).get(self.url)
+        eq_(response.status_code, 200)
+
+    def test_session_is_reused(self):
+        session = self.session()
+        with mock.patch.object(session.auth.session, 'request',
+                               wraps=session.auth.session.request) as sign:
+            session.get(self.url)
+            session.get(self.url)
+        eq_(sign.call_count, 2)
+
+    def test_ext(self):
+        auth = RequestsHawkAuth(self.credentials, ext='some data')
+        request = auth(requests.Request('GET', self.url).prepare())
+        eq_(parse_authorization_header(
+            request.headers['Authorization'])['ext'], 'some data')
+
+
+@skipIf(httpx is None, 'httpx is not installed')
+class TestHTTPXAuth(Base):
+
+    def setUp(self):
+        super(TestHTTPXAuth, self).setUp()
+        self.url = 'https://site.com/foo?bar=1'
+
+    def app(self, environ, start_response):
+        body = environ['wsgi.input'].read()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'you sent: ', body]
+
+    def client(self, app=None, sign_responses=True, **kw):
+        server = HawkMiddleware(app or self.app, self.credentials_map,
+                                seen_nonce=self.seen_nonce,
+                                sign_responses=sign_responses)
+        client = httpx.Client(transport=httpx.WSGITransport(app=server),
+                              auth=HTTPXHawkAuth(self.credentials, **kw))
+        self.addCleanup(client.close)
+        return client
+
+    def tampered(self, request, content=b'tampered'):
+        # Signs the response for a different body.
+        receiver = Receiver(self.credentials_map,
+                            request.headers['Authorization'],
+                            str(request.url), request.method,
+                            content=b'', content_type='')
+        header = receiver.respond(content=b'original',
+                                  content_type='text/plain')
+        return httpx.Response(200, content=content, headers={
+            'Content-Type': 'text/plain', 'Server-Authorization': header})
+
+    def tampered_stream(self, request):
+        return self.tampered(request, content=iter([b'tam', b'pered']))
+
+    def test_get(self):
+        response = self.client().get(self.url)
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: ')
+
+    def test_post(self):
+        response = self.client().post(
+            self.url, content=b'body', headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: body')
+
+    def test_generator_body(self):
+        def body():
+            yield b'a' * 10
+            yield b'b' * 10
+        response = self.client().post(
+            self.url, content=body(), headers={'Content-Type': 'text/plain'})
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: ' + b'a' * 10 + b'b' * 10)
+
+    def test_spooled_body_is_closed(self):
+        with mock.patch('mohawk.httpx_auth._replace_stream',
+                        wraps=_replace_stream) as replace:
+            response = self.client().post(
+                self.url, content=iter([b'a', b'b']),
+                headers={'Content-Type': 'text/plain'})
+        eq_(response.content, b'you sent: ab')
+        assert replace.call_args[0][1].closed
+
+    def test_spooled_body_is_kept_for_redirect(self):
+        class Redirect(httpx.BaseTransport):
+            def handle_request(self, request):
+                return httpx.Response(
+                    307, headers={'Location': 'https://site.com/bar'})
+
+        client = httpx.Client(transport=Redirect(),
+                              auth=HTTPXHawkAuth(self.credentials))
+        self.addCleanup(client.close)
+        response = client.post(self.url, content=iter([b'a', b'b']),
+                               headers={'Content-Type': 'text/plain'})
+        stream = response.next_request.stream
+        assert not stream._spool.closed
+
+        response = self.client().send(response.next_request)
+        eq_(response.content, b'you sent: ab')
+        assert stream._spool.closed
+
+    def test_tampered_response(self):
+        client = httpx.Client(transport=httpx.MockTransport(self.tampered),
+                              auth=HTTPXHawkAuth(self.credentials))
+        self.addCleanup(client.close)
+        with self.assertRaises(MisComputedContentHash):
+            client.get(self.url)
+
+    def test_tampered_streamed_response(self):
+        client = httpx.Client(
+            transport=httpx.MockTransport(self.tampered_stream),
+            auth=HTTPXHawkAuth(self.credentials))
+        self.addCleanup(client.close)
+        with client.stream('GET', self.url) as response:
+            chunks = response.iter_bytes()
+            eq_(next(chunks), b'tam')
+            with self.assertRaises(MisComputedContentHash):
+                list(chunks)
+
+    def test_unsigned_response(self):
+        with self.assertRaises(MissingAuthorization):
+            self.client(sign_responses=False).get(self.url)
+
+    def test_unsigned_error_response(self):
+        def app(environ, start_response):
+            start_response('404 Not Found', [])
+            return [b'']
+        eq_(self.client(app=app).get(self.url).status_code, 404)
+
+    def test_verify_responses_off(self):
+        response = self.client(sign_responses=False,
+                               verify_responses=False).get(self.url)
+        eq_(response.status_code, 200)
+
+    @skipIf(sys.version_info < (3, 5), 'asyncio support requires Python 3.5')
+    def test_async_client(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        def echo(scope, receive, send):
+            body = []
+            while True:
+                message = yield receive()
+                body.append(message.get('body', b''))
+                if not message.get('more_body', False):
+                    break
+            yield send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/plain')]})
+            yield send({'type': 'http.response.body',
+                        'body': b'you sent: ' + b''.join(body)})
+
+        server = asgi.HawkMiddleware(driven(loop, echo),
+                                     self.credentials_map,
+                                     seen_nonce=self.seen_nonce)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server),
+                                   auth=HTTPXHawkAuth(self.credentials))
+        self.addCleanup(loop.run_until_complete, client.aclose())
+
+        response = loop.run_until_complete(client.post(
+            self.url, content=AsyncChunks([b'a', b'b'], loop),
+            headers={'Content-Type': 'text/plain'}))
+        eq_(response.status_code, 200)
+        eq_(response.content, b'you sent: ab')
+
+
+class AsyncChunks(object):
+    # An async iterable without the async keyword so that this module
+    # still compiles on Python 2.
+
+    def __init__(self, chunks, loop):
+        self.chunks = list(chunks)
+        self.loop = loop
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self.loop.create_future()
+        if self.chunks:
+            future.set_result(self.chunks.pop(0))
+        else:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+
+class TestMemoryNonceStore(Base):
+
+    def setUp(self):
+        super(TestMemoryNonceStore, self).setUp()
+        self.now = 1356420407
+        patcher = mock.patch('mohawk.nonce.utc_now')
+        self.addCleanup(patcher.stop)
+        patcher.start().side_effect = lambda: self.now
+        self.store = MemoryNonceStore(timestamp_skew_in_seconds=60)
+
+    def test_seen(self):
+        ts = str(self.now)
+        eq_(self.store('my-id', 'abc', ts), False)
+        eq_(self.store('my-id', 'abc', ts), True)
+
+    def test_different_ids(self):
+        eq_(self.store('my-id', 'abc', self.now), False)
+        eq_(self.store('other-id', 'abc', self.now), False)
+
+    def test_different_timestamps(self):
+        eq_(self.store('my-id', 'abc', self.now), False)
+        eq_(self.store('my-id', 'abc', self.now + 1), False)
+
+    def test_expired_timestamps_are_not_stored(self):
+        eq_(self.store('my-id', 'abc', self.now - 61), False)
+        eq_(self.store('my-id', 'abc', self.now + 61), False)
+        eq_(self.store.count(), 0)
+
+    def test_expired_nonces_are_dropped(self):
+        for i in range(10):
+            self.store('my-id', 'nonce-{0}'.format(i), self.now)
+        eq_(self.store.count(), 10)
+
+        self.now += 60
+        self.store('my-id', 'later', self.now)
+        eq_(self.store.count(), 11)
+
+        self.now += 16
+        self.store('my-id', 'even-later', self.now)
+        eq_(self.store.count(), 2)
+
+    def test_still_seen_within_skew(self):
+        ts = self.now
+        self.store('my-id', 'abc', ts)
+        self.now += 60
+        eq_(self.store('my-id', 'abc', ts), True)
+
+    def test_receiver(self):
+        sender = Sender(self.credentials, 'http://site.com/', 'GET',
+                        content='', content_type='', _timestamp=self.now)
+
+        def receive():
+            with mock.patch('mohawk.base.utc_now') as now:
+                now.return_value = self.now
+                Receiver(self.credentials_map, sender.request_header,
+                         'http://site.com/', 'GET', content='',
+                         content_type='', seen_nonce=self.store)
+
+        receive()
+        self.assertRaises(AlreadyProcessed, receive)
+
+    def test_threads(self):
+        results = []
+
+        def check():
+            results.append(self.store('my-id', 'abc', self.now))
+
+        threads = [threading.Thread(target=check) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_(sorted(results), [False] + [True] * 9)
+
+    @raises(NotImplementedError)
+    def test_base_class(self):
+        NonceStore()('my-id', 'abc', self.now)
+
+
+def _check_shared_nonce(path, results):
+    # This runs in a child process.
+    with mock.patch('mohawk.nonce.utc_now') as now:
+        now.return_value = 1356420407
+        store = MmapNonceStore(path, slots=1024)
+        results.put(store('my-id', 'abc', 1356420407))
+        store.close()
+
+
+class TestMmapNonceStore(Base):
+
+    def setUp(self):
+        super(TestMmapNonceStore, self).setUp()
+        if not hasattr(os, 'fork'):
+            self.skipTest('MmapNonceStore requires POSIX')
+        self.now = 1356420407
+        patcher = mock.patch('mohawk.nonce.utc_now')
+        self.addCleanup(patcher.stop)
+        patcher.start().side_effect = lambda: self.now
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'nonces')
+        self.store = self.open_store()
+
+    def open_store(self, **kw):
+        kw.setdefault('slots', 1024)
+        store = MmapNonceStore(self.path, **kw)
+        self.addCleanup(store.close)
+        return store
+
+    def test_seen(self):
+        ts = str(self.now)
+        eq_(self.store('my-id', 'abc', ts), False)
+        eq_(self.store('my-id', 'abc', ts), True)
+
+    def test_different_keys(self):
+        eq_(self.store('my-id', 'abc', self.now), False)
+        eq_(self.store('other-id', 'abc', self.now), False)
+        eq_(self.store('my-id', 'abc', self.now + 1), False)
+        eq_(self.store('my-id', 'def', self.now), False)
+
+    def test_shared_between_stores(self):
+        other_store = self.open_store()
+        eq_(self.store('my-id', 'abc', self.now), False)
+        eq_(other_store('my-id', 'abc', self.now), True)
+
+    def test_persists_after_reopening(self):
+        self.store('my-id', 'abc', self.now)
+        eq_(self.open_store()('my-id', 'abc', self.now), True)
+
+    def test_expired_timestamps_are_not_stored(self):
+        eq_(self.store('my-id', 'abc', self.now - 61), False)
+        eq_(self.store('my-id', 'abc', self.now - 61), False)
+
+    def test_full_bucket_fails_closed(self):
+        store = MmapNonceStore(self.path + '-small', slots=16)
+        self.addCleanup(store.close)
+        for i in range(16):
+            eq_(store('my-id', 'nonce-{0}'.format(i), self.now), False)
+        eq_(store('my-id', 'one-too-many', self.now), True)
+
+    def test_expired_slots_are_reused(self):
+        store = MmapNonceStore(self.path + '-small', slots=16)
+        self.addCleanup(store.close)
+        for i in range(16):
+            store('my-id', 'nonce-{0}'.format(i), self.now)
+
+        self.now += 61
+        eq_(store('my-id', 'one-more', self.now), False)
+        eq_(store('my-id', 'one-more', self.now), True)
+
+    @raises(ValueError)
+    def test_mismatched_size(self):
+        MmapNonceStore(self.path, slots=2048)
+
+    @raises(ValueError)
+    def test_not_a_nonce_table(self):
+        with open(self.path + '-other', 'wb') as f:
+            f.write(b'something else entirely')
+        MmapNonceStore(self.path + '-other', slots=1024)
+
+    def test_processes(self):
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_check_shared_nonce,
+                                         args=(self.path, results))
+                 for i in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        eq_(sorted(results.get() for proc in procs),
+            [False, True, True, True])
+        eq_(self.store('my-id', 'abc', self.now), True)
+
+
+class TestCachedCredentialsMap(Base):
+
+    def setUp(self):
+        super(TestCachedCredentialsMap, self).setUp()
+        self.lookup = mock.Mock(side_effect=self.credentials_map)
+        self.cache = CachedCredentialsMap(self.lookup, max_size=2,
+                                          ttl_in_seconds=10,
+                                          negative_ttl_in_seconds=5)
+        patcher = mock.patch('mohawk.credentials._clock')
+        self.clock = patcher.start()
+        self.clock.return_value = 1000.0
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        eq_(self.cache('my-hawk-id'), self.credentials)
+        eq_(self.cache('my-hawk-id'), self.credentials)
+        eq_(self.lookup.call_count, 1)
+
+    def test_expired(self):
+        self.cache('my-hawk-id')
+        self.clock.return_value += 10
+        self.cache('my-hawk-id')
+        eq_(self.lookup.call_count, 2)
+
+    def test_unknown_id_is_cached(self):
+        for i in range(2):
+            with self.assertRaises(LookupError):
+                self.cache('unknown')
+        eq_(self.lookup.call_count, 1)
+
+        self.clock.return_value += 5
+        with self.assertRaises(LookupError):
+            self.cache('unknown')
+        eq_(self.lookup.call_count, 2)
+
+    def test_negative_caching_disabled(self):
+        cache = CachedCredentialsMap(self.lookup, negative_ttl_in_seconds=0)
+        for i in range(2):
+            with self.assertRaises(LookupError):
+                cache('unknown')
+        eq_(self.lookup.call_count, 2)
+
+    def test_other_errors_are_not_cached(self):
+        self.lookup.side_effect = [ValueError('database is down'),
+                                   self.credentials]
+        with self.assertRaises(ValueError):
+            self.cache('my-hawk-id')
+        eq_(self.cache('my-hawk-id'), self.credentials)
+
+    def test_invalid_credentials_are_not_cached(self):
+        self.lookup.side_effect = [{'id': 'my-hawk-id'}, self.credentials]
+        with self.assertRaises(InvalidCredentials):
+            self.cache('my-hawk-id')
+        eq_(self.cache('my-hawk-id'), self.credentials)
+
+    def test_evicts_least_recently_used(self):
+        self.lookup.side_effect = lambda id: dict(self.credentials, id=id)
+        self.cache('one')
+        self.cache('two')
+        self.cache('one')
+        self.cache('three')
+        eq_(self.cache.count(), 2)
+        self.lookup.reset_mock()
+        self.cache('one')
+        assert not self.lookup.called
+        self.cache('two')
+        assert self.lookup.called
+
+    def test_invalidate(self):
+        self.lookup.side_effect = lambda id: dict(self.credentials, id=id)
+        self.cache('one')
+        self.cache('two')
+        with mock.patch('mohawk.credentials.hmac_key_cache') as key_cache:
+            self.cache.invalidate('one')
+        key_cache.invalidate.assert_called_with('one')
+        eq_(self.cache.count(), 1)
+
+        with mock.patch('mohawk.credentials.hmac_key_cache') as key_cache:
+            self.cache.invalidate()
+        key_cache.invalidate.assert_called_with(None)
+        eq_(self.cache.count(), 0)
+
+    def test_invalidate_during_lookup(self):
+        def lookup(id):
+            self.cache.invalidate(id)
+            return self.credentials
+
+        self.lookup.side_effect = lookup
+        eq_(self.cache('my-hawk-id'), self.credentials)
+        eq_(self.cache.count(), 0)
+
+    def test_concurrent_misses_are_collapsed(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def lookup(id):
+            started.set()
+            finish.wait(5)
+            return self.credentials
+
+        self.lookup.side_effect = lookup
+        results = []
+
+        def call():
+            results.append(self.cache('my-hawk-id'))
+
+        threads = [threading.Thread(target=call) for i in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        eq_(results, [self.credentials] * 5)
+        eq_(self.lookup.call_count, 1)
+
+    def test_waiters_retry_after_uncached_error(self):
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+
+        def lookup(id):
+            calls.append(id)
+            if len(calls) == 1:
+                started.set()
+                finish.wait(5)
+                raise ValueError('database is down')
+            return self.credentials
+
+        self.lookup.side_effect = lookup
+        errors = []
+
+        def fail():
+            try:
+                self.cache('my-hawk-id')
+            except ValueError:
+                errors.append(sys.exc_info()[1])
+
+        first = threading.Thread(target=fail)
+        first.start()
+        started.wait(5)
+        result = []
+        second = threading.Thread(
+            target=lambda: result.append(self.cache('my-hawk-id')))
+        second.start()
+        finish.set()
+        first.join()
+        second.join()
+
+        eq_(len(errors), 1)
+        eq_(result, [self.credentials])
+
+    def test_receiver(self):
+        sender = Sender(self.credentials, 'http://site.com/', 'GET',
+                        content='', content_type='')
+        for i in range(2):
+            Receiver(self.cache, sender.request_header, 'http://site.com/',
+                     'GET', content='', content_type='')
+        eq_(self.lookup.call_count, 1)
+
+    def test_check_bewit(self):
+        resource = Resource(url='https://example.com/somewhere',
+                            method='GET', credentials=self.credentials,
+                            timestamp=utc_now() + 60, nonce='')
+        url = resource.url + '?bewit=' + get_bewit(resource)
+        for i in range(2):
+            assert check_bewit(url, credential_lookup=self.cache)
+        eq_(self.lookup.call_count, 1)
+
+    @raises(CredentialsLookupError)
+    def test_receiver_unknown_id(self):
+        credentials = dict(self.credentials, id='unknown')
+        sender = Sender(credentials, 'http://site.com/', 'GET',
+                        content='', content_type='')
+        Receiver(self.cache, sender.request_header, 'http://site.com/',
+                 'GET', content='', content_type='')
+
+
+class TestNormalizeBytes(Base):
+
+    def resource(self, **kw):
+        kw.setdefault('url', 'https://site.com:8443/foo?bar=1')
+        kw.setdefault('method', 'POST')
+        kw.setdefault('credentials', self.credentials)
+        return Resource(**kw)
+
+    def test_same_as_normalize_string(self):
+        for kw in ({}, {'ext': 'some ext'}, {'ext': u'\u00e9t\u00e9'},
+                   {'app': 'app'}, {'app': 'app', 'dlg': 'dlg'},
+                   {'nonce': b'abc123', 'ext': b'bytes ext'},
+                   {'ext': u'\u00e9t\u00e9'.encode('utf8')},
+                   {'timestamp': 1356420407},
+                   {'url': 'http://site.com/'},
+                   {'method': 'get'}):
+            resource = self.resource(**kw)
+            for mac_type in ('header', 'response', 'bewit'):
+                for content_hash in (None, 'hash', b'hash'):
+                    eq_(_normalize_bytes(mac_type, resource, content_hash),
+                        normalize_string(mac_type, resource, content_hash)
+                        .encode('utf8'))
+
+    def test_bytes_hash_takes_fast_path(self):
+        # calculate_payload_hash() and the default nonce are bytes.
+        content_hash = calculate_payload_hash(b'content', 'sha256',
+                                              'text/plain')
+        resource = self.resource()
+        assert isinstance(resource.nonce, six.binary_type)
+        # Warm up the template so that building it does not call the mock.
+        with mock.patch('mohawk.util._normalized_templates', {}):
+            _normalize_bytes('header', resource, content_hash)
+            with mock.patch('mohawk.util.normalize_header_attr') as normalize:
+                normalized = _normalize_bytes('header', resource,
+                                              content_hash)
+                eq_(normalize.call_count, 0)
+        eq_(normalized, normalize_string('header', resource, content_hash)
+            .encode('utf8'))
+
+    def test_template_is_reused(self):
+        with mock.patch('mohawk.util._normalized_templates', {}) as cache:
+            _normalize_bytes('header', self.resource(nonce='a'), None)
+            _normalize_bytes('header', self.resource(nonce='b'), None)
+            eq_(len(cache), 1)
+            _normalize_bytes('response', self.resource(), None)
+            eq_(len(cache), 2)
+
+    def test_templates_are_bounded(self):
+        with mock.patch('mohawk.util._normalized_templates', {}) as cache:
+            with mock.patch('mohawk.util._MAX_NORMALIZED_TEMPLATES', 2):
+                for host in ('one.com', 'two.com', 'three.com'):
+                    resource = self.resource(url='https://' + host + '/')
+                    eq_(_normalize_bytes('header', resource, None),
+                        normalize_string('header', resource, None)
+                        .encode('utf8'))
+                    assert len(cache) <= 2
+
+
+class TestStringsMatch(Base):
+
+    def test_same_as_loop(self):
+        values = [u'', b'', u'abc', b'abc', u'abd', b'abd', u'ab',
+                  u'\u00e9', b'\xe9', u'\u0101', u'\u0101\u0101',
+                  u'\u0101\u0102', b'\xc4\x81', u'\u00e9\u0101',
+                  b'6R4rV5iE+NPoym+WwjeHzjAGXUtLNIxmo1vpMofpLAE=',
+                  u'6R4rV5iE+NPoym+WwjeHzjAGXUtLNIxmo1vpMofpLAE=',
+                  u'6R4rV5iE+NPoym+WwjeHzjAGXUtLNIxmo1vpMofpLAF=']
+        for a in values:
+            for b in values:
+                eq_(strings_match(a, b),
+                    len(a) == len(b) and _strings_match_loop(a, b),
+                    '{0!r} vs {1!r}'.format(a, b))
+
+    def test_mixed_types(self):
+        assert strings_match(u'abc', b'abc')
+        assert strings_match(b'abc', u'abc')
+        assert not strings_match(u'abc', b'abd')
+
+    def test_uses_compare_digest(self):
+        with mock.patch('mohawk.util._compare_digest') as compare:
+            compare.return_value = True
+            assert strings_match(u'abc', b'abc')
+        compare.assert_called_with(b'abc', b'abc')
+
+    def test_different_lengths(self):
+        with mock.patch('mohawk.util._compare_digest') as compare:
+            assert not strings_match(u'abc', u'abcd')
+        assert not compare.called
+
+    @skipIf(not hasattr(hmac, 'compare_digest'), 'needs compare_digest()')
+    def test_timing_does_not_depend_on_mismatch_position(self):
+        # A coarse check: an early mismatch must not be much faster than
+        # a late one. A short-circuiting comparison of 1 MB strings
+        # differs by orders of magnitude.
+        size = 1024 * 1024
+        expected = b'a' * size
+        early = b'b' + b'a' * (size - 1)
+        late = b'a' * (size - 1) + b'b'
+
+        def best(other):
+            times = []
+            for i in range(20):
+                start = time.time()
+                strings_match(expected, other)
+                times.append(time.time() - start)
+            return min(times)
+
+        late_time = best(late)
+        early_time = best(early)
+        assert early_time * 5 > late_time, (early_time, late_time)
+
+
+class TestHmacKeyCache(Base):
+
+    def setUp(self):
+        super(TestHmacKeyCache, self).setUp()
+        self.cache = HmacKeyCache(max_size=2)
+
+    def digest(self, credentials, msg=b'message'):
+        mac = self.cache.hmac_for(credentials)
+        mac.update(msg)
+        return mac.digest()
+
+    def expected_digest(self, credentials, msg=b'message'):
+        return hmac.new(credentials['key'].encode('ascii'), msg,
+                        getattr(hashlib, credentials['algorithm'])).digest()
+
+    def test_matches_uncached_hmac(self):
+        eq_(self.digest(self.credentials),
+            self.expected_digest(self.credentials))
+        # The second call is served from the cache.
+        eq_(self.digest(self.credentials),
+            self.expected_digest(self.credentials))
+        eq_(len(self.cache), 1)
+
+    def test_copies_are_independent(self):
+        first = self.cache.hmac_for(self.credentials)
+        first.update(b'one message')
+        eq_(self.digest(self.credentials),
+            self.expected_digest(self.credentials))
+
+    def test_binary_key(self):
+        credentials = self.credentials.copy()
+        credentials['key'] = credentials['key'].encode('ascii')
+        eq_(self.digest(credentials), self.expected_digest(self.credentials))
+
+    def test_rotated_key(self):
+        self.digest(self.credentials)
+        rotated = self.credentials.copy()
+        rotated['key'] = 'a brand new sekret'
+        eq_(self.digest(rotated), self.expected_digest(rotated))
+        eq_(len(self.cache), 1)
+
+    def test_algorithms_are_cached_separately(self):
+        sha512 = self.credentials.copy()
+        sha512['algorithm'] = 'sha512'
+        self.digest(self.credentials)
+        eq_(self.digest(sha512), self.expected_digest(sha512))
+        eq_(len(self.cache), 2)
+
+    def test_evicts_least_recently_used(self):
+        creds = []
+        for id in ('one', 'two', 'three'):
+            c = self.credentials.copy()
+            c['id'] = id
+            creds.append(c)
+
+        self.digest(creds[0])
+        self.digest(creds[1])
+        # Touch the first entry so that the second one is evicted.
+        self.digest(creds[0])
+        self.digest(creds[2])
+
+        eq_(len(self.cache), 2)
+        eq_(sorted(index[0] for index in self.cache._entries),
+            ['one', 'three'])
+
+    def test_invalidate_id(self):
+        other = self.credentials.copy()
+        other['id'] = 'other-id'
+        self.digest(self.credentials)
+        self.digest(other)
+
+        self.cache.invalidate(self.credentials['id'])
+        eq_([index[0] for index in self.cache._entries], ['other-id'])
+
+    def test_invalidate_all(self):
+        self.digest(self.credentials)
+        self.cache.invalidate()
+        eq_(len(self.cache), 0)
+
+    def test_disabled(self):
+        cache = HmacKeyCache(max_size=0)
+        mac = cache.hmac_for(self.credentials)
+        mac.update(b'message')
+        eq_(mac.digest(), self.expected_digest(self.credentials))
+        eq_(len(cache), 0)
+
+    def test_shrink(self):
+        for id in ('one', 'two'):
+            self.digest(dict(self.credentials, id=id))
+        self.cache.max_size = 1
+        self.digest(dict(self.credentials, id='three'))
+        eq_([index[0] for index in self.cache._entries], ['three'])
+
+    def test_without_native_hmac(self):
+        new_hmac = hmac.new
+
+        class Wrapper(object):
+            # An HMAC without a usable _hmac attribute.
+            _hmac = object()
+
+            def __init__(self, *args, **kw):
+                self._wrapped = new_hmac(*args, **kw)
+                self.digest_size = self._wrapped.digest_size
+
+            def copy(self):
+                return self._wrapped.copy()
+
+        expected = self.expected_digest(self.credentials)
+        with mock.patch('mohawk.util.hmac.new', Wrapper):
+            eq_(self.digest(self.credentials), expected)
+            eq_(self.digest(self.credentials), expected)
+            assert isinstance(self.cache._entries[
+                (self.credentials['id'], 'sha256')][1], Wrapper)
+
+    def test_calculate_mac_after_key_rotation(self):
+        res = Resource(url='http://site.com/', method='GET',
+                       credentials=self.credentials.copy(),
+                       timestamp=1, nonce='abc')
+        mac = calculate_mac('header', res, None)
+
+        res.credentials['key'] = 'a brand new sekret'
+        self.assertNotEqual(calculate_mac('header', res, None), mac)
+
+    def test_ts_mac(self):
+        expected = b64encode(self.expected_digest(
+            self.credentials, b'hawk.1.ts\n1234\n'))
+        eq_(calculate_ts_mac(1234, self.credentials), expected)
+        eq_(calculate_ts_mac(1234, self.credentials), expected)
+
+
+class TestPayloadHasher(Base):
+
+    def setUp(self):
+        super(TestPayloadHasher, self).setUp()
+        self.url = 'http://site.com/upload'
+        self.content = b'\x00\xffsome streamed content\xff\x00' * 100
+        self.content_type = 'application/octet-stream; charset=binary'
+
+    def hasher(self, chunks=None, algorithm='sha256'):
+        hasher = PayloadHasher(algorithm, self.content_type)
+        if chunks is None:
+            chunks = [self.content[i:i + 7]
+                      for i in range(0, len(self.content), 7)]
+        for chunk in chunks:
+            hasher.update(chunk)
+        return hasher
+
+    def test_matches_calculate_payload_hash(self):
+        for algorithm in ('sha1', 'sha256', 'sha512'):
+            eq_(self.hasher(algorithm=algorithm).digest(),
+                calculate_payload_hash(self.content, algorithm,
+                                       self.content_type))
+
+    def test_buffer_chunks(self):
+        view = memoryview(self.content)
+        hasher = self.hasher([view[:10], bytearray(self.content[10:20]),
+                              view[20:]])
+        eq_(hasher.digest(), self.hasher().digest())
+        eq_(hasher.length, len(self.content))
+
+    def test_text_chunks(self):
+        content = u'Ivan Kristi\u0107'
+        hasher = PayloadHasher('sha256', 'text/plain')
+        hasher.update(content[:5])
+        hasher.update(content[5:])
+        eq_(hasher.digest(),
+            calculate_payload_hash(content, 'sha256', 'text/plain'))
+
+    def test_empty(self):
+        eq_(PayloadHasher('sha256', '').digest(),
+            calculate_payload_hash('', 'sha256', ''))
+
+    def test_digest_can_be_called_mid_stream(self):
+        hasher = PayloadHasher('sha256', self.content_type)
+        hasher.update(self.content[:10])
+        hasher.digest()
+        hasher.update(self.content[10:])
+        eq_(hasher.digest(), self.hasher().digest())
+
+    def send(self, **kw):
+        kw.setdefault('content', self.content)
+        kw.setdefault('content_type', self.content_type)
+        return Sender(self.credentials, self.url, 'POST', **kw)
+
+    def receive(self, sender, **kw):
+        kw.setdefault('content_type', self.content_type)
+        return Receiver(self.credentials_map, sender.request_header,
+                        self.url, 'POST', seen_nonce=self.seen_nonce, **kw)
+
+    def test_receive_with_hasher(self):
+        self.receive(self.send(), content_hash=self.hasher())
+
+    def test_receive_with_digest(self):
+        self.receive(self.send(), content_hash=self.hasher().digest())
+
+    def test_send_with_hasher(self):
+        sender = self.send(content=EmptyValue, content_hash=self.hasher())
+        self.receive(sender, content=self.content)
+
+    @raises(MisComputedContentHash)
+    def test_receive_tampered(self):
+        hasher = self.hasher()
+        hasher.update(b'TAMPERED')
+        self.receive(self.send(), content_hash=hasher)
+
+    @raises(ValueError)
+    def test_receive_with_mismatched_algorithm(self):
+        self.receive(self.send(), content_hash=self.hasher(algorithm='sha1'))
+
+    @raises(ValueError)
+    def test_content_and_content_hash(self):
+        self.receive(self.send(), content=self.content,
+                     content_hash=self.hasher())
+
+    def test_respond_and_accept_with_hasher(self):
+        sender = self.send()
+        receiver = self.receive(sender, content_hash=self.hasher())
+        receiver.respond(content_hash=self.hasher(),
+                         content_type=self.content_type)
+        sender.accept_response(receiver.response_header,
+                               content_hash=self.hasher(),
+                               content_type=self.content_type)
+        sender.accept_response(receiver.response_header,
+                               content=self.content,
+                               content_type=self.content_type)
+
+    def test_empty_hasher_without_hash_in_header(self):
+        sender = self.send(content=EmptyValue, content_type=EmptyValue,
+                           always_hash_content=False)
+        self.receive(sender, content_type=EmptyValue,
+                     content_hash=PayloadHasher('sha256', ''))
+
+    @raises(MisComputedContentHash)
+    def test_unhashed_content_without_hash_in_header(self):
+        sender = self.send(content=EmptyValue, content_type=EmptyValue,
+                           always_hash_content=False)
+        self.receive(sender, content_hash=self.hasher())
+
+    def test_accept_untrusted_content_without_hash_in_header(self):
+        sender = self.send(content=EmptyValue, content_type=EmptyValue,
+                           always_hash_content=False)
+        self.receive(sender, content_hash=self.hasher(),
+                     accept_untrusted_content=True)
@@ -2,13 +2,19 @@ from base64 import b64encode, urlsafe_b64encode
 import calendar
 import hashlib
 import hmac
+import io
 import logging
 import math
+import mmap
 import os
 import pprint
 import re
+import stat
 import sys
+import tempfile
+import threading
 import time
+from collections import OrderedDict
 
 import six
 
@@ -21,7 +27,22 @@ from .exc import (
 HAWK_VER = 1
 HAWK_HEADER_RE = re.compile(r'(?P<key>\w+)=\"(?P<value>[^\"\\]*)\"\s*(?:,\s*|$)')
 MAX_LENGTH = 4096
+#: Block size for hashing file-like payloads that are not regular files.
+DEFAULT_BLOCK_SIZE = 64 * 1024
+#: Block size for hashing payloads that are regular files.
+FILE_BLOCK_SIZE = 1024 * 1024
+#: Regular files with at least this many bytes left to read are hashed
+#: through a memory map.
+MMAP_THRESHOLD = 256 * 1024
+#: Streamed request bodies that have to be hashed before they are sent
+#: are kept in memory up to this many bytes and in a temporary file
+#: beyond that.
+SPOOL_SIZE = 1024 * 1024
 log = logging.getLogger(__name__)
+
+#: When True, request and response bodies are replaced with a placeholder
+#: in debug logs. Set this if bodies may contain sensitive data.
+redact_payloads_in_logs = False
 allowable_header_keys = set(['id', 'ts', 'tsm', 'nonce', 'hash',
                              'error', 'ext', 'mac', 'app', 'dlg'])
 
@@ -46,54 +67,282 @@ def random_string(length):
     return urlsafe_b64encode(os.urandom(length))[:length]
 
 
-def calculate_payload_hash(payload, algorithm, content_type, block_size=1024):
-    """Calculates a hash for a given payload."""
-    p_hash = hashlib.new(algorithm)
-
-    parts = []
-    parts.append('hawk.' + str(HAWK_VER) + '.payload\n')
-    parts.append(parse_content_type(content_type) + '\n')
-    parts.append(payload or '')
-    parts.append('\n')
-
-    for i, p in enumerate(parts):
-        # Make sure we are about to hash binary strings.
-        if hasattr(p, "read"):
-            log.debug("part %i being handled as a file object", i)
-            while True:
-                block = p.read(block_size)
-                if not block:
-                    break
-                p_hash.update(block)
-        elif not isinstance(p, six.binary_type):
-            p = p.encode('utf8')
-            p_hash.update(p)
-        else:
-            p_hash.update(p)
-        parts[i] = p
+def loggable_payload(payload):
+    """
+    Returns a request / response body as it should appear in debug logs.
+
+    This is a placeholder with the size of the body when
+    :data:`mohawk.util.redact_payloads_in_logs` is True.
+    """
+    if not redact_payloads_in_logs or not payload:
+        return payload
+    if hasattr(payload, 'read'):
+        return '<redacted file-like payload>'
+    return '<redacted payload of length {length}>'.format(length=len(payload))
+
 
-    log.debug('calculating payload hash from:\n{parts}'
-              .format(parts=pprint.pformat(parts)))
+def calculate_payload_hash(payload, algorithm, content_type, block_size=None):
+    """
+    Calculates a hash for a given payload.
 
-    return b64encode(p_hash.digest())
+    File-like payloads are read in blocks of ``block_size`` bytes.
+    If ``block_size`` is None, it is chosen based on the type of file.
+    A seekable file is moved back to where it was so that the body can
+    still be read.
+    """
+    return _payload_hasher(payload, algorithm, content_type,
+                           block_size=block_size).digest()
 
 
-def calculate_mac(mac_type, resource, content_hash):
-    """Calculates a message authorization code (MAC)."""
-    normalized = normalize_string(mac_type, resource, content_hash)
-    log.debug(u'normalized resource for mac calc: {norm}'
-              .format(norm=normalized))
-    digestmod = getattr(hashlib, resource.credentials['algorithm'])
+def _payload_hasher(payload, algorithm, content_type, block_size=None):
+    # This is calculate_payload_hash() returning the PayloadHasher, which
+    # also knows how many bytes were hashed.
+    hasher = PayloadHasher(algorithm, content_type)
+    payload = payload or ''
 
-    # Make sure we are about to hash binary strings.
+    if hasattr(payload, "read"):
+        log.debug("payload being handled as a file object")
+        if not _hash_seekable(hasher, payload, block_size):
+            _hash_file(hasher, payload, block_size)
+    else:
+        hasher.update(payload)
+
+    if log.isEnabledFor(logging.DEBUG):
+        parts = [hasher.prefix, loggable_payload(payload), '\n']
+        log.debug('calculating payload hash from:\n%s',
+                  pprint.pformat(parts))
+
+    return hasher
+
+
+def _hash_file(hasher, payload, block_size):
+    st = _stat_file(payload)
+    if (st is not None and stat.S_ISREG(st.st_mode) and
+            _hash_mmap(hasher, payload, block_size)):
+        return
+
+    if block_size is None:
+        block_size = _block_size_for(st)
+
+    readinto = getattr(payload, 'readinto', None)
+    if readinto is None:
+        while True:
+            block = payload.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+        return
+
+    # Read into a reusable buffer so that a new bytes object
+    # is not allocated for every block.
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    while True:
+        size = readinto(buf)
+        if not size:
+            break
+        hasher.update(view[:size])
+
+
+def _spool(chunks, hasher, max_size=SPOOL_SIZE):
+    """
+    Hashes chunks of a streamed body while copying them to a temporary
+    file so that the body can be signed before it is sent.
 
-    if not isinstance(normalized, six.binary_type):
-        normalized = normalized.encode('utf8')
-    key = resource.credentials['key']
-    if not isinstance(key, six.binary_type):
-        key = key.encode('ascii')
+    Returns the file, rewound, and its size.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf8')
+        hasher.update(chunk)
+        spool.write(chunk)
+    size = spool.tell()
+    spool.seek(0)
+    return spool, size
+
+
+def _hash_seekable(hasher, payload, block_size=None):
+    """
+    Hashes a seekable file-like payload from its current position and
+    moves back to that position. Returns False if it is not seekable.
+    """
+    try:
+        position = payload.tell()
+    except (AttributeError, EnvironmentError, ValueError,
+            io.UnsupportedOperation):
+        return False
+    seekable = getattr(payload, 'seekable', None)
+    if seekable is not None and not seekable():
+        return False
+    _hash_file(hasher, payload, block_size)
+    payload.seek(position)
+    return True
+
+
+# Only these read the bytes of the file as they are stored on disk.
+# Compressed files such as gzip or bz2 also have a fileno() but read()
+# returns something other than what a map of the file would contain.
+_MAPPABLE_FILE_TYPES = (io.FileIO, io.BufferedReader, io.BufferedRandom)
+if six.PY2:
+    _MAPPABLE_FILE_TYPES += (file,)  # noqa: F821
+
+
+def _real_file(payload):
+    if isinstance(payload, tempfile.SpooledTemporaryFile):
+        # Calling fileno() on a spooled file would move it to disk.
+        return payload._file
+    if isinstance(payload, tempfile._TemporaryFileWrapper):
+        return payload.file
+    return payload
+
+
+def _stat_file(payload):
+    try:
+        return os.fstat(_real_file(payload).fileno())
+    except (AttributeError, EnvironmentError, ValueError,
+            io.UnsupportedOperation):
+        # This is not backed by a file descriptor, e.g. BytesIO.
+        return None
+
+
+def _block_size_for(st):
+    if st is None:
+        return DEFAULT_BLOCK_SIZE
+    if stat.S_ISREG(st.st_mode):
+        # Don't allocate a large buffer for a small file.
+        return max(io.DEFAULT_BUFFER_SIZE, min(FILE_BLOCK_SIZE, st.st_size))
+    # This is a pipe, socket or the like.
+    return max(DEFAULT_BLOCK_SIZE, st.st_blksize)
+
+
+def _hash_mmap(hasher, payload, block_size):
+    """
+    Hashes a regular file from its current position through a memory map.
+
+    The file position is left unchanged. Returns False if the file cannot
+    be memory-mapped.
+    """
+    payload = _real_file(payload)
+    if not isinstance(payload, _MAPPABLE_FILE_TYPES) or \
+            'b' not in getattr(payload, 'mode', 'b'):
+        # Text must be decoded the same way read() would decode it and
+        # anything else may not read the bytes that are on disk.
+        return False
+
+    if hasattr(payload, 'flush'):
+        # Make sure that buffered writes are visible in the map.
+        payload.flush()
+    try:
+        fd = payload.fileno()
+        position = payload.tell()
+        size = os.fstat(fd).st_size
+    except (EnvironmentError, ValueError, io.UnsupportedOperation):
+        return False
+    if size - position < MMAP_THRESHOLD:
+        # Reading a small file is cheaper than mapping it.
+        return False
+
+    try:
+        mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return False
+
+    block_size = block_size or FILE_BLOCK_SIZE
+    try:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            # Python 2 cannot make a memoryview of a map but slicing it
+            # still avoids a read() call per block.
+            view = mapped
+        try:
+            for offset in range(position, size, block_size):
+                hasher.update(view[offset:offset + block_size])
+        finally:
+            if hasattr(view, 'release'):
+                view.release()
+    finally:
+        mapped.close()
+    return True
+
+
+class PayloadHasher(object):
+    """
+    Calculates a payload hash incrementally.
+
+    This lets you hash a request or response body as it streams through
+    without holding all of it in memory. When the whole body has been
+    hashed, pass the hasher as the ``content_hash`` argument of
+    :class:`mohawk.Receiver`, :meth:`mohawk.Receiver.respond`,
+    :class:`mohawk.Sender` or :meth:`mohawk.Sender.accept_response`
+    instead of ``content``.
+
+    :param algorithm: Hash algorithm of the credentials, such as ``sha256``.
+    :type algorithm: str
 
-    result = hmac.new(key, normalized, digestmod)
+    :param content_type: content-type header value of the payload.
+    :type content_type: str
+    """
+
+    def __init__(self, algorithm, content_type):
+        self.algorithm = algorithm
+        self.content_type = content_type
+        #: Number of payload bytes hashed so far.
+        self.length = 0
+        self.prefix = ('hawk.' + str(HAWK_VER) + '.payload\n' +
+                       parse_content_type(content_type) + '\n')
+        self._hash = hashlib.new(algorithm)
+        self._hash.update(self.prefix.encode('utf8'))
+
+    def update(self, chunk):
+        """
+        Hashes the next chunk of the payload.
+
+        :param chunk:
+            Bytes of the payload. A ``bytearray`` or ``memoryview`` is
+            hashed without being copied. Text is encoded as UTF-8.
+        :type chunk: bytes
+        """
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf8')
+        self._hash.update(chunk)
+        if isinstance(chunk, memoryview):
+            self.length += len(chunk) * chunk.itemsize
+        else:
+            self.length += len(chunk)
+
+    def digest(self):
+        """
+        Returns the payload hash of everything hashed so far.
+
+        Like :func:`mohawk.util.calculate_payload_hash`, this returns
+        base64 encoded bytes.
+        """
+        final = self._hash.copy()
+        final.update(b'\n')
+        return b64encode(final.digest())
+
+
+def calculate_mac(mac_type, resource, content_hash, keyed_hmac=None):
+    """
+    Calculates a message authorization code (MAC).
+
+    ``keyed_hmac`` is an optional new HMAC object keyed with the
+    credentials of the resource. If it is None, one is taken from
+    :data:`mohawk.util.hmac_key_cache`.
+    """
+    normalized = _normalize_bytes(mac_type, resource, content_hash)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(u'normalized resource for mac calc: %s',
+                  normalized.decode('utf8'))
+
+    result = keyed_hmac
+    if result is None:
+        result = hmac_key_cache.hmac_for(resource.credentials)
+    result.update(normalized)
     return b64encode(result.digest())
 
 
@@ -101,20 +350,130 @@ def calculate_ts_mac(ts, credentials):
     """Calculates a message authorization code (MAC) for a timestamp."""
     normalized = ('hawk.{hawk_ver}.ts\n{ts}\n'
                   .format(hawk_ver=HAWK_VER, ts=ts))
-    log.debug(u'normalized resource for ts mac calc: {norm}'
-              .format(norm=normalized))
-    digestmod = getattr(hashlib, credentials['algorithm'])
+    log.debug(u'normalized resource for ts mac calc: %s', normalized)
 
     if not isinstance(normalized, six.binary_type):
         normalized = normalized.encode('utf8')
-    key = credentials['key']
-    if not isinstance(key, six.binary_type):
-        key = key.encode('ascii')
 
-    result = hmac.new(key, normalized, digestmod)
+    result = hmac_key_cache.hmac_for(credentials)
+    result.update(normalized)
     return b64encode(result.digest())
 
 
+class HmacKeyCache(object):
+    """
+    A bounded, thread-safe LRU cache of keyed HMAC objects.
+
+    Creating an HMAC object hashes the inner and outer key pads, which is
+    repeated work when the same credentials sign or verify many messages.
+    This cache keeps one keyed prototype per credentials ID, key
+    fingerprint and algorithm. Callers get a copy of the prototype that is
+    ready to be fed a message.
+
+    The key itself serves as the fingerprint. When a key is rotated, the
+    stale entry will not match and it is replaced on the next lookup.
+    Call :meth:`invalidate` to drop entries right away.
+
+    :param max_size=8192:
+        Maximum number of keyed prototypes to keep. The least recently
+        used entry is evicted when the cache is full. Set it to at least
+        the number of credentials IDs that are in use: when they take
+        turns in a cache that is too small, every lookup misses and is
+        slower than no cache at all.
+        A ``max_size`` of 0 disables caching.
+    :type max_size=8192: int
+    """
+
+    def __init__(self, max_size=8192):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hmac_for(self, credentials):
+        """
+        Returns a new HMAC object keyed with these credentials.
+
+        :param credentials:
+            A dict of credentials with the keys ``id``, ``key``, and
+            ``algorithm``.
+        :type credentials: dict
+        """
+        key = credentials['key']
+        if not isinstance(key, six.binary_type):
+            key = key.encode('ascii')
+        algorithm = credentials['algorithm']
+
+        if not self.max_size:
+            return hmac.new(key, digestmod=getattr(hashlib, algorithm))
+
+        index = (credentials['id'], algorithm)
+        with self._lock:
+            entry = self._entries.get(index)
+            if entry is not None and entry[0] == key:
+                _move_to_end(self._entries, index)
+                return entry[1].copy()
+
+        prototype = _native_hmac(
+            hmac.new(key, digestmod=getattr(hashlib, algorithm)))
+        with self._lock:
+            self._entries[index] = (key, prototype)
+            _move_to_end(self._entries, index)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return prototype.copy()
+
+    def invalidate(self, id=None):
+        """
+        Drops cached entries.
+
+        :param id=None:
+            Only drop the entries for this credentials ID.
+            If None, drop all entries.
+        :type id=None: str
+        """
+        with self._lock:
+            if id is None:
+                self._entries.clear()
+                return
+            for index in list(self._entries):
+                if index[0] == id:
+                    del self._entries[index]
+
+
+def _native_hmac(keyed_hmac):
+    # On Python 3 hmac.HMAC usually wraps a native OpenSSL HMAC object in
+    # the private _hmac attribute. Copying that object directly is about
+    # a third cheaper than copying the wrapper. It is an implementation
+    # detail of the stdlib, so only use it when it has everything a
+    # caller needs and fall back to the wrapper otherwise.
+    native = getattr(keyed_hmac, '_hmac', None)
+    if native is None:
+        return keyed_hmac
+    for name in ('copy', 'update', 'digest'):
+        if not callable(getattr(native, name, None)):
+            return keyed_hmac
+    if getattr(native, 'digest_size', None) != keyed_hmac.digest_size:
+        return keyed_hmac
+    return native
+
+
+#: The :class:`mohawk.util.HmacKeyCache` used for all MAC calculations.
+#: To resize it, set ``hmac_key_cache.max_size``.
+hmac_key_cache = HmacKeyCache()
+
+
+def _move_to_end(entries, key):
+    # Marks an OrderedDict entry as the most recently used one.
+    if hasattr(entries, 'move_to_end'):
+        entries.move_to_end(key)
+    else:
+        # Python 2 does not have move_to_end().
+        entries[key] = entries.pop(key)
+
+
 def normalize_string(mac_type, resource, content_hash):
     """Serializes mac_type and resource into a HAWK string."""
 
@@ -145,6 +504,60 @@ def normalize_string(mac_type, resource, content_hash):
     return normalized
 
 
+# Constant parts of the normalized string, keyed by
+# (mac_type, method, host, port).
+_normalized_templates = {}
+_MAX_NORMALIZED_TEMPLATES = 1024
+
+
+def _normalized_template(mac_type, method, host, port):
+    index = (mac_type, method, host, port)
+    template = _normalized_templates.get(index)
+    if template is None:
+        if len(_normalized_templates) >= _MAX_NORMALIZED_TEMPLATES:
+            _normalized_templates.clear()
+        template = _normalized_templates[index] = (
+            # The timestamp and nonce come right after the prefix so
+            # method, host and port are separate fragments.
+            'hawk.' + str(HAWK_VER) + '.' + mac_type + '\n',
+            '\n' + normalize_header_attr(method or '') + '\n',
+            '\n' + normalize_header_attr(host) +
+            '\n' + normalize_header_attr(port) + '\n',
+        )
+    return template
+
+
+def _normalize_bytes(mac_type, resource, content_hash):
+    # This is normalize_string() encoded as UTF-8. It is built from a
+    # template so that only the values which vary per message are joined.
+    prefix, method, host_and_port = _normalized_template(
+        mac_type, resource.method, resource.host, resource.port)
+    # calculate_payload_hash() and random_string() return base64 bytes.
+    # Decode them here so that the join below does not fail over to
+    # normalizing every part.
+    if isinstance(content_hash, six.binary_type):
+        content_hash = content_hash.decode('utf8')
+    nonce = resource.nonce
+    if isinstance(nonce, six.binary_type):
+        nonce = nonce.decode('utf8')
+    parts = [prefix,
+             resource.timestamp, '\n',
+             nonce, method,
+             resource.name or '', host_and_port,
+             content_hash or '', '\n',
+             resource.ext or '', '\n']
+    if resource.app:
+        parts.extend((resource.app, '\n', resource.dlg or '', '\n'))
+    try:
+        normalized = ''.join(parts)
+    except (TypeError, UnicodeDecodeError):
+        # Some values are UTF-8 bytes.
+        normalized = ''.join([normalize_header_attr(p) for p in parts])
+    if not isinstance(normalized, six.binary_type):
+        normalized = normalized.encode('utf8')
+    return normalized
+
+
 def parse_content_type(content_type):
     """Cleans up content_type."""
     if content_type:
@@ -175,6 +588,61 @@ def parse_authorization_header(auth_header):
                        .format(scheme=scheme))
 
 
+    attributes = _parse_attributes(attributes_string)
+    if attributes is None:
+        # The header is not well formed. The regex parser raises the
+        # appropriate exception.
+        attributes = _parse_attributes_re(attributes_string)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('parsed Hawk header: %s into: \n%s',
+                  auth_header, pprint.pformat(attributes))
+    return attributes
+
+
+def _parse_attributes(attributes_string):
+    """
+    Parses the attributes of a well formed Hawk header in a single pass.
+
+    This returns None for anything unusual, such as unknown or duplicate
+    keys, illegal characters, or whitespace other than spaces.
+    """
+    if not _header_chars.match(attributes_string):
+        return None
+
+    # A well formed header splits into alternating 'key=' separators and
+    # values: 'k1=', 'v1', ', k2=', 'v2', ''
+    parts = attributes_string.split('"')
+    if not len(parts) % 2:
+        # There is an unterminated value.
+        return None
+
+    attributes = {}
+    for i in range(0, len(parts) - 1, 2):
+        key = parts[i]
+        if i:
+            key = key.lstrip(' ')
+            if key[:1] != ',':
+                return None
+            key = key[1:].lstrip(' ')
+        if key[-1:] != '=':
+            return None
+        key = key[:-1]
+        if key not in allowable_header_keys or key in attributes:
+            return None
+        attributes[key] = parts[i + 1]
+
+    if not attributes:
+        return None if attributes_string else attributes
+    trailer = parts[-1].strip(' ')
+    if trailer and trailer != ',':
+        return None
+
+    return attributes
+
+
+def _parse_attributes_re(attributes_string):
+    """Parses the attributes of a Hawk header with a regex."""
     attributes = {}
 
     def replace_attribute(match):
@@ -196,8 +664,6 @@ def parse_authorization_header(auth_header):
     if unparsed_header != '':
         raise BadHeaderValue("Couldn't parse Hawk header", unparsed_header)
 
-    log.debug('parsed Hawk header: {header} into: \n{parsed}'
-              .format(header=auth_header, parsed=pprint.pformat(attributes)))
     return attributes
 
 
@@ -205,6 +671,30 @@ def strings_match(a, b):
     # Constant time string comparision, mitigates side channel attacks.
     if len(a) != len(b):
         return False
+    if _compare_digest is None:
+        return _strings_match_loop(a, b)
+    return _compare_digest(_comparable(a), _comparable(b))
+
+
+# Python 2.7 before 2.7.7 does not have compare_digest().
+_compare_digest = getattr(hmac, 'compare_digest', None)
+
+
+def _comparable(buf):
+    # compare_digest() only takes bytes (or ASCII text) so text is encoded
+    # in a way that keeps the character values. Like the old loop, that
+    # means text and bytes are compared by character and byte value.
+    if not isinstance(buf, six.text_type):
+        return buf
+    try:
+        return buf.encode('latin-1')
+    except UnicodeEncodeError:
+        # Text with characters beyond latin-1 can only match other text
+        # like it. Its longer encoding never matches any latin-1 or bytes.
+        return buf.encode('utf-32-le')
+
+
+def _strings_match_loop(a, b):
     result = 0
 
     def byte_ints(buf):
@@ -231,6 +721,9 @@ def utc_now(offset_in_seconds=0.0):
 # !#$%&'()*+,-./:;<=>?@[]^_`{|}~ and space, a-z, A-Z, 0-9, \, "
 _header_attribute_chars = re.compile(
     r"^[ a-zA-Z0-9_\!#\$%&'\(\)\*\+,\-\./\:;<\=>\?@\[\]\^`\{\|\}~]*$")
+# The same characters plus double quotes, for checking a whole header.
+_header_chars = re.compile(
+    r"^[ a-zA-Z0-9_\!#\$%&'\(\)\*\+,\-\./\:;<\=>\?@\[\]\^`\{\|\}~\"]*$")
 
 
 def validate_header_attr(val, name=None):
@@ -0,0 +1,467 @@
+"""
+WSGI middleware for Hawk authentication.
+
+See :ref:`wsgi` for details.
+"""
+import io
+import logging
+import sys
+
+import six
+from six.moves.urllib.parse import quote
+
+from .base import default_ts_skew_in_seconds, EmptyValue, RequestTarget
+from .exc import HawkFail, MisComputedContentHash
+from .receiver import Receiver
+from .util import DEFAULT_BLOCK_SIZE, PayloadHasher, strings_match
+
+__all__ = ['HawkMiddleware']
+log = logging.getLogger(__name__)
+
+# Characters that browsers and HTTP clients leave unquoted in a path.
+_PATH_SAFE = "/:@!$&'()*+,;=~"
+
+
+class HawkMiddleware(object):
+    """
+    WSGI middleware that only lets Hawk authenticated requests through.
+
+    The request header is verified before the application is called.
+    The request body is hashed as the application reads ``wsgi.input``
+    and checked against the hash in the header once it has all been read.
+    The read that reaches the end of the body raises
+    :class:`mohawk.exc.MisComputedContentHash` if the hash does not
+    match. Whatever the application does, the client then gets a
+    ``401 Unauthorized`` response instead of the application's response.
+    Whatever the application has not read by the time its response
+    starts is hashed and discarded.
+
+    .. important::
+
+        The application sees the body before it has been verified.
+        Don't act on it until you have read all of it, or pass
+        ``verify_body_first=True``.
+
+    The :class:`mohawk.Receiver` for the request is available to the
+    application as ``environ['mohawk.receiver']``.
+    Responses are signed with a ``Server-Authorization`` header unless
+    the application sets one itself.
+
+    :param app: The WSGI application to protect.
+    :type app: callable
+
+    :param credentials_map:
+        Callable to look up the credentials dict by sender ID.
+        See :class:`mohawk.Receiver`.
+    :type credentials_map: callable
+
+    :param seen_nonce=None:
+        A callable that returns True if a nonce has been seen.
+        See :ref:`nonce` for details.
+    :type seen_nonce=None: callable
+
+    :param bypass=():
+        Requests to skip authentication for. Each item is either a path
+        prefix, such as ``'/health'``, or a callable that takes the WSGI
+        environ and returns True to skip it.
+    :type bypass=(): sequence
+
+    :param sign_responses=True:
+        When True, sign responses. The response body is buffered to hash
+        it unless the application returns a list or tuple.
+        When False, responses are streamed through.
+    :type sign_responses=True: bool
+
+    :param verify_body_first=False:
+        When True, read and verify the whole request body before the
+        application is called. The application then reads it from
+        memory. This is also needed if the application reads the body
+        from its response iterator.
+    :type verify_body_first=False: bool
+
+    :param accept_untrusted_content=False:
+        When True, allow requests that do not hash their body.
+        See :class:`mohawk.Receiver`.
+    :type accept_untrusted_content=False: bool
+
+    :param localtime_offset_in_seconds=0:
+        See :class:`mohawk.Receiver`.
+    :type localtime_offset_in_seconds=0: float
+
+    :param timestamp_skew_in_seconds=60:
+        See :class:`mohawk.Receiver`.
+    :type timestamp_skew_in_seconds=60: float
+
+    :param sink=None:
+        A :class:`mohawk.instrument.Sink`. See :class:`mohawk.Receiver`.
+    :type sink=None: :class:`mohawk.instrument.Sink`
+    """
+
+    def __init__(self, app, credentials_map, seen_nonce=None, bypass=(),
+                 sign_responses=True, verify_body_first=False,
+                 accept_untrusted_content=False,
+                 localtime_offset_in_seconds=0,
+                 timestamp_skew_in_seconds=default_ts_skew_in_seconds,
+                 sink=None):
+        self.app = app
+        self.credentials_map = credentials_map
+        self.seen_nonce = seen_nonce
+        self.bypass_prefixes = tuple(b for b in bypass
+                                     if isinstance(b, six.string_types))
+        self.bypass_checks = [b for b in bypass
+                              if not isinstance(b, six.string_types)]
+        self.sign_responses = sign_responses
+        self.verify_body_first = verify_body_first
+        self.accept_untrusted_content = accept_untrusted_content
+        self.localtime_offset_in_seconds = localtime_offset_in_seconds
+        self.timestamp_skew_in_seconds = timestamp_skew_in_seconds
+        self.sink = sink
+
+    def __call__(self, environ, start_response):
+        if self._bypass(environ):
+            return self.app(environ, start_response)
+
+        length = _body_length(environ)
+        try:
+            receiver = _StreamingReceiver(
+                self.credentials_map,
+                environ.get('HTTP_AUTHORIZATION'),
+                request_target(environ),
+                environ['REQUEST_METHOD'],
+                content=b'',
+                content_type=environ.get('CONTENT_TYPE', ''),
+                seen_nonce=self.seen_nonce,
+                accept_untrusted_content=self.accept_untrusted_content,
+                localtime_offset_in_seconds=self.localtime_offset_in_seconds,
+                timestamp_skew_in_seconds=self.timestamp_skew_in_seconds,
+                sink=self.sink)
+
+            their_hash = receiver.parsed_header.get('hash')
+            if their_hash is None and length != 0 and \
+                    not self.accept_untrusted_content:
+                raise MisComputedContentHash(
+                    'request has a body but did not hash it')
+        except HawkFail:
+            return _unauthorized(start_response, sys.exc_info()[1])
+
+        environ['mohawk.receiver'] = receiver
+        body = None
+        if their_hash is not None:
+            body = _HashingInput(
+                environ['wsgi.input'],
+                PayloadHasher(receiver.resource.credentials['algorithm'],
+                              environ.get('CONTENT_TYPE', '')),
+                their_hash, length)
+            environ['wsgi.input'] = body
+            if self.verify_body_first and not body.finish(keep=True):
+                return _unauthorized(start_response, body.error)
+
+        response = _Response()
+        try:
+            result = self.app(environ, response.start_response)
+        except MisComputedContentHash:
+            if body is None or body.error is None:
+                raise
+            return _unauthorized(start_response, body.error)
+
+        if self.sign_responses:
+            return self._signed(result, response, receiver, body,
+                                start_response)
+
+        try:
+            chunks = response.start(result)
+            if body is not None and not body.finish():
+                _close(result)
+                return _unauthorized(start_response, body.error)
+        except MisComputedContentHash:
+            _close(result)
+            if body is None or body.error is None:
+                raise
+            return _unauthorized(start_response, body.error)
+        except:
+            _close(result)
+            raise
+        start_response(response.status, response.headers, response.exc_info)
+        return _ClosingIterator(chunks, result)
+
+    def _bypass(self, environ):
+        if self.bypass_prefixes and \
+                environ.get('PATH_INFO', '').startswith(self.bypass_prefixes):
+            return True
+        for check in self.bypass_checks:
+            if check(environ):
+                return True
+        return False
+
+    def _signed(self, result, response, receiver, body, start_response):
+        try:
+            chunks = response.read(result)
+        except MisComputedContentHash:
+            _close(result)
+            if body is None or body.error is None:
+                raise
+            return _unauthorized(start_response, body.error)
+        except:
+            _close(result)
+            raise
+        if chunks is not result:
+            # The server closes the result when it is passed on.
+            _close(result)
+
+        if body is not None and not body.finish():
+            if chunks is result:
+                _close(result)
+            return _unauthorized(start_response, body.error)
+
+        headers = response.headers
+        if not any(name.lower() == 'server-authorization'
+                   for name, value in headers):
+            content_type = ''
+            for name, value in headers:
+                if name.lower() == 'content-type':
+                    content_type = value
+            hasher = PayloadHasher(receiver.resource.credentials['algorithm'],
+                                   content_type)
+            for chunk in chunks:
+                hasher.update(chunk)
+            headers = headers + [('Server-Authorization', receiver.respond(
+                content_type=content_type, content_hash=hasher))]
+
+        start_response(response.status, headers, response.exc_info)
+        return chunks
+
+
+def request_target(environ):
+    """
+    Returns a :class:`mohawk.base.RequestTarget` for a WSGI request.
+
+    The path is taken from ``REQUEST_URI`` or ``RAW_URI`` if the server
+    provides them because that is the path that the client signed.
+    Otherwise, it is quoted from ``SCRIPT_NAME`` and ``PATH_INFO``.
+
+    :param environ: WSGI environ.
+    :type environ: dict
+    """
+    scheme = environ['wsgi.url_scheme']
+    host = environ.get('HTTP_HOST')
+    if host:
+        host, port = _split_host(host)
+    else:
+        host = environ['SERVER_NAME']
+        port = environ.get('SERVER_PORT') or None
+
+    raw = environ.get('REQUEST_URI') or environ.get('RAW_URI')
+    if raw and raw.startswith('/'):
+        path, _, query = raw.partition('?')
+    else:
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if not isinstance(path, six.binary_type):
+            # WSGI strings are bytes decoded as latin-1.
+            path = path.encode('latin-1')
+        path = quote(path, safe=_PATH_SAFE) or '/'
+        query = environ.get('QUERY_STRING', '')
+    return RequestTarget(scheme, host, port=port, path=path, query=query)
+
+
+def _split_host(host):
+    # Splits a Host header into a host and a port, which may be None.
+    port = None
+    if host.startswith('['):
+        # An IPv6 address.
+        end = host.find(']')
+        if host[end + 1:end + 2] == ':':
+            port = host[end + 2:]
+        host = host[1:end]
+    elif ':' in host:
+        host, _, port = host.partition(':')
+    return host, port or None
+
+
+class _StreamingReceiver(Receiver):
+    # A receiver that trusts the hash in the header for now because
+    # HawkMiddleware checks the body against it as the body streams in.
+
+    def _accept_request(self, parsed_header, credentials, url, method,
+                        content=EmptyValue, content_type=EmptyValue,
+                        content_hash=None, **auth_kw):
+        if 'hash' in parsed_header:
+            content = EmptyValue
+            content_hash = parsed_header['hash']
+        super(_StreamingReceiver, self)._accept_request(
+            parsed_header, credentials, url, method,
+            content=content, content_type=content_type,
+            content_hash=content_hash, **auth_kw)
+
+
+class _HashingInput(object):
+    # Wraps wsgi.input to hash the body as it is read.
+
+    def __init__(self, stream, hasher, expected_hash, length):
+        self._stream = stream
+        self._hasher = hasher
+        self._expected_hash = expected_hash
+        # Bytes left to read or None to read until EOF.
+        self._remaining = length
+        # What is left of the body after finish().
+        self._rest = None
+        self._verified = False
+        self.error = None
+
+    def read(self, size=-1):
+        if self._rest is not None:
+            return self._rest.read(size)
+        return self._hashed(self._stream.read, size)
+
+    def readline(self, size=-1):
+        if self._rest is not None:
+            return self._rest.readline(size)
+        return self._hashed(self._stream.readline, size)
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in iter(self.readline, b''):
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def _hashed(self, read, size):
+        remaining = self._remaining
+        if remaining == 0:
+            self._verify()
+            return b''
+        if remaining is not None and (
+                size is None or size < 0 or size > remaining):
+            size = remaining
+        if size is None or size < 0:
+            chunk = read()
+        else:
+            chunk = read(size)
+        self._hasher.update(chunk)
+        if remaining is not None:
+            self._remaining = remaining - len(chunk)
+        if not chunk or self._remaining == 0:
+            # This was the end of the body.
+            self._verify()
+        return chunk
+
+    def _verify(self):
+        if not self._verified:
+            self._verified = True
+            self._remaining = 0
+            if not strings_match(self._hasher.digest(),
+                                 self._expected_hash):
+                self.error = MisComputedContentHash(
+                    'request body did not match the hash in the header')
+        if self.error is not None:
+            raise self.error
+
+    def finish(self, keep=False):
+        """
+        Hashes whatever the application did not read and returns True
+        if the body matched.
+
+        The rest of the body is only kept for the application to read
+        if ``keep`` is True. Otherwise it is discarded as it is hashed.
+        """
+        if self._rest is None:
+            rest = []
+            try:
+                while True:
+                    chunk = self._hashed(self._stream.read,
+                                         DEFAULT_BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    if keep:
+                        rest.append(chunk)
+            except MisComputedContentHash:
+                return False
+            self._rest = io.BytesIO(b''.join(rest))
+        return self.error is None
+
+
+class _Response(object):
+    # Holds on to what the application passes to start_response().
+
+    def __init__(self):
+        self.status = None
+        self.headers = None
+        self.exc_info = None
+        self.written = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = list(headers)
+        self.exc_info = exc_info
+        return self.written.append
+
+    def start(self, result):
+        # Returns an iterator over the body after making sure that the
+        # application has called start_response().
+        chunks = iter(result)
+        first = []
+        if self.status is None:
+            for chunk in chunks:
+                first.append(chunk)
+                if self.status is not None:
+                    break
+        return _chain(self.written, first, chunks)
+
+    def read(self, result):
+        # Returns the whole body as a list.
+        if isinstance(result, (list, tuple)) and not self.written:
+            return result
+        return self.written + list(result)
+
+
+def _chain(*iterables):
+    for iterable in iterables:
+        for chunk in iterable:
+            yield chunk
+
+
+class _ClosingIterator(object):
+
+    def __init__(self, chunks, result):
+        self._chunks = chunks
+        self._result = result
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        _close(self._result)
+
+
+def _close(result):
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+
+
+def _body_length(environ):
+    # Returns the number of body bytes to read or None to read until EOF.
+    length = environ.get('CONTENT_LENGTH')
+    if length:
+        try:
+            return max(0, int(length))
+        except ValueError:
+            pass
+    if environ.get('wsgi.input_terminated'):
+        return None
+    return 0
+
+
+def _unauthorized(start_response, exc):
+    # Never send the exception message; it may help an attacker.
+    log.info('rejecting request: %s', exc.__class__.__name__)
+    headers = [('Content-Type', 'text/plain'),
+               ('WWW-Authenticate',
+                getattr(exc, 'www_authenticate', None) or 'Hawk')]
+    start_response('401 Unauthorized', headers)
+    return [b'Unauthorized']
@@ -35,5 +35,5 @@ Read more: https://github.com/kumar303/mohawk/
           'Programming Language :: Python :: 3.7',
           'Topic :: Internet :: WWW/HTTP',
       ],
-      packages=find_packages(exclude=['tests']),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       install_requires=['six'])